@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+import numpy as np
+from pathlib import Path
+import argparse
+import gzip
+import logging
+import sys
+
+### Deterministic generator for synthetic vembrane TSVs, VCFs and BED files.
+### The same scale and seed always produce byte-identical files.
+
+logger = logging.getLogger()
+
+### GRCh38 lengths of the primary assembly
+CONTIG_LENGTHS = {
+    "chr1": 248956422,
+    "chr2": 242193529,
+    "chr3": 198295559,
+    "chr4": 190214555,
+    "chr5": 181538259,
+    "chr6": 170805979,
+    "chr7": 159345973,
+    "chr8": 145138636,
+    "chr9": 138394717,
+    "chr10": 133797422,
+    "chr11": 135086622,
+    "chr12": 133275309,
+    "chr13": 114364328,
+    "chr14": 107043718,
+    "chr15": 101991189,
+    "chr16": 90338345,
+    "chr17": 83257441,
+    "chr18": 80373285,
+    "chr19": 58617616,
+    "chr20": 64444167,
+    "chr21": 46709983,
+    "chr22": 50818468,
+    "chrX": 156040895,
+    "chrY": 57227415,
+}
+
+### Panel and WES targets are short capture intervals, WGS uses a few broad callable regions per contig.
+### on_target is the fraction of variants called within the targets, depth the mean read depth.
+SCALES = {
+    "panel": {"variants": 2000, "intervals": 1000, "interval_width": 150, "on_target": 0.9, "depth": 500, "samples": 1},
+    "wes": {"variants": 50000, "intervals": 200000, "interval_width": 170, "on_target": 0.85, "depth": 120, "samples": 2},
+    "wgs": {"variants": 4000000, "intervals": 1200, "interval_width": None, "on_target": 1.0, "depth": 35, "samples": 2},
+}
+
+### Variant classes of VEP with their frequency among somatic calls
+VARIANT_CLASSES = ["SNV", "deletion", "insertion", "substitution", "sequence_alteration"]
+VARIANT_CLASS_WEIGHTS = [0.8, 0.08, 0.07, 0.04, 0.01]
+
+### Consequences per variant class, compound consequences are joined by "&" like in VEP
+CONSEQUENCES = {
+    "SNV": [
+        "missense_variant",
+        "synonymous_variant",
+        "intron_variant",
+        "stop_gained",
+        "missense_variant&splice_region_variant",
+        "upstream_gene_variant",
+        "downstream_gene_variant",
+        "3_prime_UTR_variant",
+        "5_prime_UTR_variant&NMD_transcript_variant",
+        "non_coding_transcript_exon_variant",
+        "splice_donor_variant",
+        "intergenic_variant",
+    ],
+    "indel": [
+        "frameshift_variant",
+        "inframe_deletion",
+        "inframe_insertion",
+        "intron_variant",
+        "frameshift_variant&splice_region_variant",
+        "upstream_gene_variant",
+        "3_prime_UTR_variant",
+        "splice_acceptor_variant",
+        "intergenic_variant",
+    ],
+}
+IMPACTS = {
+    "missense_variant": "MODERATE",
+    "inframe_deletion": "MODERATE",
+    "inframe_insertion": "MODERATE",
+    "stop_gained": "HIGH",
+    "frameshift_variant": "HIGH",
+    "splice_donor_variant": "HIGH",
+    "splice_acceptor_variant": "HIGH",
+    "synonymous_variant": "LOW",
+}
+BIOTYPES = ["protein_coding", "protein_coding", "protein_coding", "nonsense_mediated_decay", "lncRNA", "retained_intron"]
+FILTERS = ["PASS", "PASS", "PASS", "PASS", "PASS", "PASS", "weak_evidence", "clustered_events", "LowQual", "weak_evidence;strand_bias"]
+
+### CSQ fields written to the TSV and the VCF header, in VEP order
+CSQ_FIELDS = [
+    "Allele",
+    "Consequence",
+    "IMPACT",
+    "SYMBOL",
+    "Gene",
+    "Feature_type",
+    "Feature",
+    "BIOTYPE",
+    "EXON",
+    "HGVSc",
+    "HGVSp",
+    "Existing_variation",
+    "CANONICAL",
+    "VARIANT_CLASS",
+    "MAX_AF",
+    "gnomADe_AF",
+]
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Generate deterministic synthetic vembrane TSV, VCF and BED files at panel, WES or WGS scale \
+        for benchmarking the scripts in bin/.",
+        epilog="Example: python3 generate_data.py --scale wes --outdir bench_data",
+    )
+    parser.add_argument(
+        "--scale",
+        help="Size of the generated data set.",
+        choices=list(SCALES),
+        default="panel",
+    )
+    parser.add_argument(
+        "--outdir",
+        metavar="OUTDIR",
+        type=Path,
+        help="Directory of the generated files.",
+        default=Path("."),
+    )
+    parser.add_argument(
+        "--seed",
+        metavar="SEED",
+        type=int,
+        help="Seed of the random number generator.",
+        default=1,
+    )
+    parser.add_argument(
+        "--variants",
+        metavar="VARIANTS",
+        type=int,
+        help="Number of variants, overrides the default of the scale.",
+    )
+    parser.add_argument(
+        "--samples",
+        metavar="SAMPLES",
+        type=int,
+        help="Number of samples with allele_fraction, read_depth and FORMAT columns, overrides the default of the scale.",
+    )
+    parser.add_argument(
+        "--vcf_csq",
+        help="Annotate the VCF records with the CSQ INFO field, like a VEP-annotated VCF.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(argv)
+
+
+def scale_settings(scale, variants=None, samples=None):
+    ### Settings of the scale with optional overrides
+    settings = dict(SCALES[scale])
+    if variants is not None:
+        settings["variants"] = variants
+    if samples is not None:
+        settings["samples"] = samples
+    return settings
+
+
+def contig_shares(count):
+    ### Distribute count items over the contigs proportional to their length, every contig gets at least one
+    lengths = np.array(list(CONTIG_LENGTHS.values()), dtype=np.int64)
+    shares = np.maximum(np.floor(count * lengths / lengths.sum()).astype(np.int64), 1)
+    shares[0] += max(count - int(shares.sum()), 0)
+    return shares
+
+
+def generate_bed(rng, settings):
+    """
+    Target intervals as 0-based, half-open BED records sorted by contig and start.
+    Capture targets may overlap like in vendor BED files, WGS regions tile each contig with small gaps.
+    """
+    chroms, starts, ends = [], [], []
+    for (contig, length), count in zip(CONTIG_LENGTHS.items(), contig_shares(settings["intervals"])):
+        if settings["interval_width"] is None:
+            bounds = np.linspace(0, length, count + 1).astype(np.int64)
+            gaps = rng.integers(1000, 100000, count)
+            contig_starts, contig_ends = bounds[:-1] + gaps, bounds[1:] - gaps
+        else:
+            widths = np.maximum(rng.lognormal(np.log(settings["interval_width"]), 0.4, count).astype(np.int64), 20)
+            contig_starts = np.sort(rng.integers(10000, length - 10000, count))
+            contig_ends = contig_starts + widths
+        chroms.append(np.full(count, contig))
+        starts.append(contig_starts)
+        ends.append(contig_ends)
+    return pd.DataFrame({0: np.concatenate(chroms), 1: np.concatenate(starts), 2: np.concatenate(ends)})
+
+
+def random_bases(rng, lengths):
+    ### Random DNA sequences of the given lengths, sliced from one random sequence
+    sequence = "".join(np.array(list("ACGT"))[rng.integers(0, 4, int(lengths.sum()))])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return np.array([sequence[start:end] for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+
+def generate_variants(rng, settings, bed):
+    """
+    One row per variant with position, alleles, variant class, FILTER and per-sample values.
+    On-target variants are placed within random BED intervals, the others uniformly on the genome.
+    """
+    n = settings["variants"]
+    contigs = np.array(list(CONTIG_LENGTHS))
+    lengths = np.array(list(CONTIG_LENGTHS.values()), dtype=np.int64)
+
+    on_target = rng.random(n) < settings["on_target"]
+    interval = rng.integers(0, len(bed.index), n)
+    interval_starts, interval_ends = bed[1].to_numpy()[interval], bed[2].to_numpy()[interval]
+    contig_code = np.where(
+        on_target,
+        pd.Categorical(bed[0].to_numpy()[interval], categories=contigs).codes,
+        rng.choice(len(contigs), n, p=lengths / lengths.sum()),
+    )
+    ### BED is 0-based, VCF positions are 1-based
+    positions = np.where(
+        on_target,
+        interval_starts + 1 + (rng.random(n) * (interval_ends - interval_starts)).astype(np.int64),
+        1 + (rng.random(n) * (lengths[contig_code] - 1)).astype(np.int64),
+    )
+    order = np.lexsort((positions, contig_code))
+    contig_code, positions = contig_code[order], positions[order]
+
+    variant_class = np.array(VARIANT_CLASSES)[rng.choice(len(VARIANT_CLASSES), n, p=VARIANT_CLASS_WEIGHTS)]
+    indel_length = 1 + rng.geometric(0.4, n)
+    ref_length = np.select(
+        [variant_class == "deletion", variant_class == "substitution", variant_class == "sequence_alteration"],
+        [indel_length, 2 + (indel_length % 2), indel_length + 1],
+        1,
+    )
+    alt_length = np.select(
+        [variant_class == "insertion", variant_class == "substitution"],
+        [indel_length, ref_length],
+        1,
+    )
+    ref = random_bases(rng, ref_length)
+    alt = random_bases(rng, alt_length)
+    ### Anchor base of indels and a different base for SNVs
+    is_indel = np.isin(variant_class, ["deletion", "insertion"])
+    anchors = np.array([sequence[0] for sequence in ref], dtype=object)
+    alt = np.where(variant_class == "insertion", anchors + alt, alt)
+    alt = np.where(variant_class == "deletion", anchors, alt)
+    ref = np.where(variant_class == "deletion", anchors + ref, ref)
+    is_snv = variant_class == "SNV"
+    ref_codes = np.array(["ACGT".find(base) for base in ref[is_snv]], dtype=np.int64)
+    alt[is_snv] = np.array(list("ACGT"))[(ref_codes + rng.integers(1, 4, len(ref_codes))) % 4]
+
+    variants = pd.DataFrame(
+        {
+            "CHROM": contigs[contig_code],
+            "POS": positions,
+            "ID": ".",
+            "REF": ref,
+            "ALT": alt,
+            "QUAL": np.round(rng.gamma(2.0, 40.0, n), 1),
+            "FILTER": np.array(FILTERS)[rng.integers(0, len(FILTERS), n)],
+            "VARIANT_CLASS": variant_class,
+            "is_indel": is_indel,
+        }
+    )
+    variants["MAX_AF"] = np.where(rng.random(n) < 0.6, np.nan, np.round(10 ** rng.uniform(-5, -0.3, n), 6))
+    variants["gnomADe_AF"] = np.where(np.isnan(variants["MAX_AF"]), np.nan, np.round(variants["MAX_AF"] * rng.random(n), 6))
+    rsids = np.char.add("rs", rng.integers(1000, 900000000, n).astype(str))
+    variants["Existing_variation"] = np.where(np.isnan(variants["MAX_AF"]), "", rsids)
+
+    for sample in sample_names(settings["samples"]):
+        depth = rng.negative_binomial(4, 4 / (4 + settings["depth"]), n)
+        ### Mixture of subclonal somatic and heterozygous/homozygous germline allele fractions
+        fraction = np.where(rng.random(n) < 0.7, rng.beta(2, 10, n), np.where(rng.random(n) < 0.8, rng.beta(40, 40, n), 1.0))
+        alt_reads = rng.binomial(depth, fraction)
+        missing = rng.random(n) < 0.03
+        variants[f"allele_fraction[{sample}]"] = np.where(
+            missing | (depth == 0), np.nan, np.round(alt_reads / np.maximum(depth, 1), 4)
+        )
+        variants[f"read_depth[{sample}]"] = pd.Series(np.where(missing, np.nan, depth)).astype("Int64")
+        variants[f"FORMAT_GT[{sample}]"] = np.where(missing, "./.", np.where(fraction > 0.9, "1/1", "0/1"))
+        variants[f"FORMAT_AD[{sample}][0]"] = pd.Series(np.where(missing, np.nan, depth - alt_reads)).astype("Int64")
+        variants[f"FORMAT_AD[{sample}][1]"] = pd.Series(np.where(missing, np.nan, alt_reads)).astype("Int64")
+    return variants
+
+
+def sample_names(samples):
+    return [f"SAMPLE{index + 1}" for index in range(samples)]
+
+
+def generate_transcripts(rng, variants):
+    """
+    Expand the variants to one row per overlapping transcript with the CSQ fields of VEP.
+    Genes are assigned by 50 kb bins of the position, so neighbouring variants share genes.
+    """
+    n = len(variants.index)
+    transcripts = np.minimum(1 + rng.poisson(1.5, n), 8)
+    variant_index = np.repeat(np.arange(n), transcripts)
+    transcript_index = np.arange(len(variant_index)) - np.repeat(np.cumsum(transcripts) - transcripts, transcripts)
+    rows = len(variant_index)
+
+    is_indel = variants["is_indel"].to_numpy()[variant_index]
+    consequence = np.where(
+        is_indel,
+        np.array(CONSEQUENCES["indel"])[rng.integers(0, len(CONSEQUENCES["indel"]), rows)],
+        np.array(CONSEQUENCES["SNV"])[rng.integers(0, len(CONSEQUENCES["SNV"]), rows)],
+    )
+    impact = pd.Series(consequence).str.split("&").str[0].map(IMPACTS).fillna("MODIFIER").to_numpy()
+    gene_bin = variants["POS"].to_numpy()[variant_index] // 50000
+    chrom_code = pd.factorize(variants["CHROM"])[0][variant_index]
+    gene_number = chrom_code * 10000 + gene_bin % 10000
+    transcript_number = variant_index * 8 + transcript_index
+    exon = np.char.add(np.char.add(rng.integers(1, 20, rows).astype(str), "/"), np.full(rows, "20"))
+    coding_position = rng.integers(1, 5000, rows).astype(str)
+
+    csq = {
+        "Allele": variants["ALT"].to_numpy()[variant_index],
+        "Consequence": consequence,
+        "IMPACT": impact,
+        "SYMBOL": np.char.add("GENE", gene_number.astype(str)),
+        "Gene": np.char.add("ENSG", np.char.zfill(gene_number.astype(str), 11)),
+        "Feature_type": "Transcript",
+        "Feature": np.char.add("ENST", np.char.zfill(transcript_number.astype(str), 11)),
+        "BIOTYPE": np.array(BIOTYPES)[rng.integers(0, len(BIOTYPES), rows)],
+        "EXON": np.where(np.char.find(consequence.astype(str), "intron") >= 0, "", exon),
+        "HGVSc": np.char.add(np.char.add(np.char.add("ENST", np.char.zfill(transcript_number.astype(str), 11)), ".1:c."), coding_position),
+        "HGVSp": np.where(impact == "MODIFIER", "", np.char.add("ENSP00000000001.1:p.", coding_position)),
+        "Existing_variation": variants["Existing_variation"].to_numpy()[variant_index],
+        "CANONICAL": np.where(transcript_index == 0, "YES", ""),
+        "VARIANT_CLASS": variants["VARIANT_CLASS"].to_numpy()[variant_index],
+        "MAX_AF": variants["MAX_AF"].to_numpy()[variant_index],
+        "gnomADe_AF": variants["gnomADe_AF"].to_numpy()[variant_index],
+    }
+    return (variant_index, pd.DataFrame(csq))
+
+
+def vembrane_table(variants, variant_index, csq):
+    ### Columns of the vembrane table: VCF fields, CSQ fields with prefix, then the per-sample fields
+    vcf_columns = ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER"]
+    sample_columns = [column for column in variants.columns if "[" in column]
+    table = variants[vcf_columns].iloc[variant_index].reset_index(drop=True)
+    table = pd.concat([table, csq.add_prefix("CSQ_"), variants[sample_columns].iloc[variant_index].reset_index(drop=True)], axis=1)
+    return table
+
+
+def write_tsv(table, file_out):
+    table.to_csv(file_out, sep="\t", index=False, na_rep="")
+
+
+def vcf_header(samples, vcf_csq):
+    header = [
+        "##fileformat=VCFv4.2",
+        '##FILTER=<ID=PASS,Description="All filters passed">',
+    ]
+    for value in sorted({filter for filters in FILTERS for filter in filters.split(";")} - {"PASS"}):
+        header.append(f'##FILTER=<ID={value},Description="Synthetic filter {value}">')
+    header += [
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+        '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths for the ref and alt alleles">',
+        '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth">',
+        '##FORMAT=<ID=AF,Number=A,Type=Float,Description="Allele fractions of alternate alleles">',
+        '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total depth">',
+    ]
+    if vcf_csq:
+        header.append(
+            '##INFO=<ID=CSQ,Number=.,Type=String,Description="Consequence annotations from Ensembl VEP. Format: '
+            + "|".join(CSQ_FIELDS)
+            + '">'
+        )
+    header += [f"##contig=<ID={contig},length={length}>" for contig, length in CONTIG_LENGTHS.items()]
+    header.append("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + sample_names(samples)))
+    return header
+
+
+def vcf_records(variants, variant_index, csq, samples, vcf_csq):
+    ### VCF body with one record per variant, the CSQ entries of all transcripts are joined by ","
+    def integer_field(values):
+        return values.astype(str).replace("<NA>", ".")
+
+    records = variants[["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER"]].copy()
+    depth_total = sum(variants[f"read_depth[{sample}]"].fillna(0) for sample in sample_names(samples))
+    info = "DP=" + depth_total.astype(str)
+    if vcf_csq:
+        entries = csq.astype(str).replace("nan", "").agg("|".join, axis=1)
+        info = info + ";CSQ=" + entries.groupby(variant_index).agg(",".join).to_numpy()
+    records["INFO"] = info
+    records["FORMAT"] = "GT:AD:DP:AF"
+    for sample in sample_names(samples):
+        records[sample] = (
+            variants[f"FORMAT_GT[{sample}]"]
+            + ":"
+            + integer_field(variants[f"FORMAT_AD[{sample}][0]"])
+            + ","
+            + integer_field(variants[f"FORMAT_AD[{sample}][1]"])
+            + ":"
+            + integer_field(variants[f"read_depth[{sample}]"])
+            + ":"
+            + variants[f"allele_fraction[{sample}]"].astype(str).replace("nan", ".")
+        )
+    return records
+
+
+def write_vcf(header, records, file_out):
+    opener = gzip.open if str(file_out).endswith(".gz") else open
+    with opener(file_out, "wt") as vcf:
+        vcf.write("\n".join(header) + "\n")
+        records.to_csv(vcf, sep="\t", header=False, index=False)
+
+
+def write_bed(bed, file_out):
+    bed.to_csv(file_out, sep="\t", header=False, index=False)
+
+
+def generate_dataset(outdir, scale, seed=1, variants=None, samples=None, vcf_csq=False):
+    """
+    Write <scale>.tsv, <scale>.vcf and <scale>.bed to outdir and return their paths.
+    All random draws come from one generator seeded with seed, so the files are reproducible.
+    """
+    settings = scale_settings(scale, variants, samples)
+    rng = np.random.default_rng(seed)
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    paths = {key: outdir / f"{scale}.{key}" for key in ["tsv", "vcf", "bed"]}
+
+    bed = generate_bed(rng, settings)
+    variant_table = generate_variants(rng, settings, bed)
+    variant_index, csq = generate_transcripts(rng, variant_table)
+    write_bed(bed, paths["bed"])
+    write_tsv(vembrane_table(variant_table, variant_index, csq), paths["tsv"])
+    write_vcf(
+        vcf_header(settings["samples"], vcf_csq),
+        vcf_records(variant_table, variant_index, csq, settings["samples"], vcf_csq),
+        paths["vcf"],
+    )
+    logger.info(
+        f"Generated {len(bed.index)} intervals, {len(variant_table.index)} variants and {len(variant_index)} transcript rows in {outdir}."
+    )
+    return paths
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    generate_dataset(args.outdir, args.scale, args.seed, args.variants, args.samples, args.vcf_csq)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
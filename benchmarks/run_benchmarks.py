@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+import numpy as np
+from pathlib import Path
+import argparse
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+from generate_data import SCALES, generate_dataset
+
+### Throughput and memory benchmarks of the main functions of the scripts in bin/.
+### Every benchmark reports rows/s of its best repetition and the peak memory allocated during one call.
+
+logger = logging.getLogger()
+
+BIN_DIR = Path(__file__).resolve().parent.parent / "bin"
+ASSETS_DIR = Path(__file__).resolve().parent.parent / "assets"
+SCRIPTS = ["calculate_TMB", "preprocess_datavzrd", "check_vcf", "process_bedfiles"]
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the main functions of calculate_TMB.py, preprocess_datavzrd.py, check_vcf.py and \
+        process_bedfiles.py on synthetic data. Reports rows/s and peak memory of each function and flags regressions \
+        against a stored baseline.",
+        epilog="Example: python3 run_benchmarks.py --scale wes --baseline baseline.json",
+    )
+    parser.add_argument(
+        "--scale",
+        help="Size of the synthetic data set, see generate_data.py.",
+        choices=list(SCALES),
+        default="panel",
+    )
+    parser.add_argument(
+        "--scripts",
+        help="Scripts to benchmark (default all).",
+        nargs="+",
+        choices=SCRIPTS,
+        default=SCRIPTS,
+    )
+    parser.add_argument(
+        "--datadir",
+        metavar="DATADIR",
+        type=Path,
+        help="Directory of the synthetic data, generated if the files of the scale are missing (default temporary directory).",
+    )
+    parser.add_argument(
+        "--seed",
+        metavar="SEED",
+        type=int,
+        help="Seed of the synthetic data.",
+        default=1,
+    )
+    parser.add_argument(
+        "--repeat",
+        metavar="REPEAT",
+        type=int,
+        help="Timed repetitions of each benchmark, the fastest one is reported.",
+        default=3,
+    )
+    parser.add_argument(
+        "--results_out",
+        metavar="RESULTS_OUT",
+        type=Path,
+        help="JSON file for the benchmark results.",
+    )
+    parser.add_argument(
+        "--baseline",
+        metavar="BASELINE",
+        type=Path,
+        help="JSON file with baseline results per scale, regressions against it are reported and fail the run.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        metavar="TOLERANCE",
+        type=float,
+        help="Allowed relative loss of rows/s and increase of peak memory against the baseline.",
+        default=0.25,
+    )
+    parser.add_argument(
+        "--save_baseline",
+        help="Store the results of this scale in --baseline instead of comparing against it.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default INFO).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="INFO",
+    )
+    return parser.parse_args(argv)
+
+
+def load_script(name):
+    ### Import a script of bin/ as module, scripts with missing dependencies are skipped
+    ### Scripts of bin/ import shared functions from each other, e.g. calculate_TMB.py from process_bedfiles.py
+    if str(BIN_DIR) not in sys.path:
+        sys.path.insert(0, str(BIN_DIR))
+    spec = importlib.util.spec_from_file_location(name, BIN_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError as error:
+        logger.warning(f"Skipping benchmarks of {name}.py: {error}")
+        return None
+    return module
+
+
+def peak_rss_mb():
+    ### Peak resident set size of this process, ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(setup, repeat):
+    """
+    Time the benchmark function returned by setup() and measure its peak memory.
+    setup() is called before every repetition and is not timed, it returns the number of processed rows and
+    the function to benchmark, so that benchmarks modifying their input start from fresh data.
+    The peak memory is traced in a separate call, as tracing slows down the allocations.
+    """
+    timings = []
+    for _ in range(repeat):
+        rows, function = setup()
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    rows, function = setup()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(timings)
+    return {
+        "rows": rows,
+        "seconds": round(best, 6),
+        "rows_per_s": round(rows / best, 1) if best > 0 else float("inf"),
+        "peak_mb": round(peak / 2**20, 2),
+    }
+
+
+### Benchmarks of each script, every function returns a list of (name, setup) pairs
+
+
+def calculate_TMB_benchmarks(module, data, workdir):
+    header = module.read_header(data["tsv"])
+    _, suffix_list = module.multisample_check(header)
+    population_db = "CSQ_MAX_AF"
+    csq_values = "missense_variant,stop_gained,frameshift_variant,splice_donor_variant,splice_acceptor_variant"
+    term_bits = module.consequence_term_bits(ASSETS_DIR / "tmb_consequence_filters.csv", csq_values)
+    bed = pd.read_csv(data["bed"], sep="\t", header=None)
+    interval_index, panel_sizes = module.build_interval_index([bed])
+    panels = [(None, 0, int(panel_sizes[0]))]
+    loaded = module.read_vembraneout(data["tsv"], header, population_db)
+    rows_total = len(loaded.index)
+    selected, _ = module.preprocess_vembraneout(loaded.copy(), "snv", True, csq_values, term_bits)
+    rows = np.flatnonzero(selected)
+
+    def load():
+        return (rows_total, lambda: module.read_vembraneout(data["tsv"], header, population_db))
+
+    def preprocess():
+        frame = loaded.copy()
+        return (rows_total, lambda: module.preprocess_vembraneout(frame, "snv", True, csq_values, term_bits))
+
+    def roi_filter():
+        return (len(rows), lambda: module.filter_bedrange(loaded, rows, interval_index, panels))
+
+    def roi_filter_panels():
+        ### Full panel, every second interval and intervals shifted by 100 bp as three overlapping panels
+        shifted = bed.copy()
+        shifted[[1, 2]] += 100
+        panel_index, sizes = module.build_interval_index([bed, bed.iloc[::2], shifted])
+        three_panels = [(name, bit, int(size)) for bit, (name, size) in enumerate(zip(["full", "half", "shifted"], sizes))]
+        return (len(rows), lambda: module.filter_bedrange(loaded, rows, panel_index, three_panels))
+
+    def filter_cascade():
+        def run():
+            arrays = module.cascade_arrays(loaded, rows, suffix_list, population_db)
+            module.filter_cascade(*arrays, 20, 0.05, 0.9, 0.02)
+
+        return (len(rows), run)
+
+    def af_histograms():
+        frame = module.plot_frame(loaded, rows, suffix_list)
+        arrays = module.cascade_arrays(loaded, rows, suffix_list, population_db)
+        covfilt = module.filter_cascade(*arrays, 20, 0.05, 0.9, 0.02)[0]
+        regions = np.ones((len(rows), 1), dtype=bool)
+        return (len(rows), lambda: module.af_histograms(frame, covfilt, regions, suffix_list))
+
+    def end_to_end():
+        argv = [
+            "--file_in", str(data["tsv"]),
+            "--bedfile", str(data["bed"]),
+            "--min_AF", "0.05",
+            "--max_AF", "0.9",
+            "--min_cov", "20",
+            "--popfreq_max", "0.02",
+            "--filter_muttype", "snv",
+            "--population_db", population_db,
+            "--prefilter_region",
+            "--plot", "none",
+            "--file_out", str(workdir / "TMB_report.csv"),
+        ]
+        return (rows_total, lambda: module.main(argv))
+
+    return [
+        ("read_vembraneout", load),
+        ("preprocess_vembraneout", preprocess),
+        ("filter_bedrange", roi_filter),
+        ("filter_bedrange_3_panels", roi_filter_panels),
+        ("filter_cascade", filter_cascade),
+        ("af_histograms", af_histograms),
+        ("main", end_to_end),
+    ]
+
+
+def preprocess_datavzrd_benchmarks(module, data, workdir):
+    variant_table = pd.read_csv(data["tsv"], sep="\t").convert_dtypes()
+    colinfo_table = pd.read_csv(ASSETS_DIR / "annotation_colinfo.tsv", sep="\t").convert_dtypes()
+    identifiers = ["chrom", "pos", "ref", "alt", "id", "feature"]
+    rows_total = len(variant_table.index)
+
+    def process_ann_cols():
+        variant_df, colinfo_df = variant_table.copy(), colinfo_table.copy()
+        return (
+            rows_total,
+            lambda: module.process_ann_cols(variant_df, colinfo_df, "identifier", "group", identifiers, "variant", "label"),
+        )
+
+    def split_df_by_group():
+        variant_df, colinfo_df = module.process_ann_cols(
+            variant_table.copy(), colinfo_table.copy(), "identifier", "group", identifiers, "variant", "label"
+        )
+
+        def run():
+            for group in set(colinfo_df["group"]):
+                module.split_df_by_group(
+                    colinfo_df, variant_df, group, "identifier", "group", identifiers, "variant", str(workdir / "bench")
+                )
+
+        return (rows_total, run)
+
+    return [
+        ("process_ann_cols", process_ann_cols),
+        ("split_df_by_group", split_df_by_group),
+    ]
+
+
+def check_vcf_benchmarks(module, data, workdir):
+    vcfheader, summary = module.read_vcf(str(data["vcf"]))
+    records = summary["records"]
+
+    return [
+        ("read_vcf", lambda: (records, lambda: module.read_vcf(str(data["vcf"])))),
+        ("check_chrom_def", lambda: (records, lambda: module.check_chrom_def(summary, "bench", "ERROR"))),
+        ("check_VEP", lambda: (records, lambda: module.check_VEP(summary, vcfheader, "bench", "WARNING"))),
+        ("check_FILTERs", lambda: (records, lambda: module.check_FILTERs(summary, "bench", "WARNING"))),
+    ]
+
+
+def process_bedfiles_benchmarks(module, data, workdir):
+    bedfile = pd.read_csv(data["bed"], sep="\t", header=None)
+    intervals = len(bedfile.index)
+
+    return [
+        ("check_bed_structure", lambda: (intervals, lambda: module.check_bed_structure(bedfile))),
+        ("compile_panel", lambda: (intervals, lambda: module.compile_panel(bedfile))),
+    ]
+
+
+BENCHMARKS = {
+    "calculate_TMB": calculate_TMB_benchmarks,
+    "preprocess_datavzrd": preprocess_datavzrd_benchmarks,
+    "check_vcf": check_vcf_benchmarks,
+    "process_bedfiles": process_bedfiles_benchmarks,
+}
+
+
+def dataset(datadir, scale, seed):
+    ### Reuse previously generated files of the scale, generate them otherwise
+    paths = {key: datadir / f"{scale}.{key}" for key in ["tsv", "vcf", "bed"]}
+    if all(path.is_file() for path in paths.values()):
+        logger.info(f"Using synthetic {scale} data in {datadir}.")
+        return paths
+    logger.info(f"Generating synthetic {scale} data in {datadir}.")
+    return generate_dataset(datadir, scale, seed)
+
+
+def run_benchmarks(scripts, data, workdir, repeat):
+    results = {}
+    for script in scripts:
+        module = load_script(script)
+        if module is None:
+            continue
+        for name, setup in BENCHMARKS[script](module, data, workdir):
+            key = f"{script}.{name}"
+            ### Silence the messages the scripts print or log while they are benchmarked
+            logging.disable(logging.WARNING)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                results[key] = measure(setup, repeat)
+            logging.disable(logging.NOTSET)
+            logger.info(
+                f"{key}: {results[key]['rows']} rows in {results[key]['seconds']:.4f} s, "
+                f"{results[key]['rows_per_s']:.0f} rows/s, peak {results[key]['peak_mb']:.1f} MB"
+            )
+    return results
+
+
+def compare_baseline(results, baseline, tolerance):
+    """
+    List the benchmarks with fewer rows/s or more peak memory than the baseline allows.
+    Benchmarks missing from the baseline are not compared, peak memory increases below 1 MB are ignored.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        if result["rows_per_s"] < baseline[key]["rows_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{key}: {result['rows_per_s']:.0f} rows/s, baseline {baseline[key]['rows_per_s']:.0f} rows/s"
+            )
+        if result["peak_mb"] > baseline[key]["peak_mb"] * (1 + tolerance) + 1:
+            regressions.append(f"{key}: peak {result['peak_mb']:.1f} MB, baseline {baseline[key]['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        datadir = args.datadir or Path(tempdir) / "data"
+        workdir = Path(tempdir) / "work"
+        workdir.mkdir()
+        data = dataset(datadir, args.scale, args.seed)
+        results = run_benchmarks(args.scripts, data, workdir, args.repeat)
+    logger.info(f"Peak resident memory of the benchmark process: {peak_rss_mb():.1f} MB")
+
+    if args.results_out is not None:
+        with open(args.results_out, "w") as file:
+            json.dump({args.scale: results}, file, indent=4)
+
+    if args.baseline is None:
+        return 0
+    baselines = {}
+    if args.baseline.is_file():
+        with open(args.baseline, "r") as file:
+            baselines = json.load(file)
+    if args.save_baseline:
+        baselines[args.scale] = results
+        with open(args.baseline, "w") as file:
+            json.dump(baselines, file, indent=4)
+        logger.info(f"Stored {args.scale} baseline in {args.baseline}.")
+        return 0
+    if args.scale not in baselines:
+        logger.warning(f"The baseline {args.baseline} contains no results for scale {args.scale}.")
+        return 0
+    regressions = compare_baseline(results, baselines[args.scale], args.tolerance)
+    for regression in regressions:
+        logger.error(f"Regression of {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,16 +3,39 @@
 
 import pandas as pd
 import numpy as np
-import pyranges as pr
-import matplotlib.pyplot as plt
-import seaborn as sns
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import argparse
+import hashlib
+import json
 import logging
+import os
+import resource
+import shutil
+import struct
 import sys
+import tempfile
+import time
+import zipfile
+
+from process_bedfiles import segment_panels
 
 logger = logging.getLogger()
 
+### Bit layout of the 64-bit integer variant key (Mut_ID): contig code | position | allele code
+CONTIG_BITS = 10
+POSITION_BITS = 31
+ALLELE_BITS = 22
+SNV_ALLELE_CODES = {
+    (ref, alt): index for index, (ref, alt) in enumerate((ref, alt) for ref in "ACGT" for alt in "ACGT")
+}
+### Version of the cache entries, to be increased whenever the calculation or the cached outputs change
+CACHE_VERSION = 2
+### Input file suffixes read with pyarrow instead of the TSV parser
+ARROW_FORMATS = {".parquet": "parquet", ".pq": "parquet", ".arrow": "ipc", ".feather": "ipc", ".ipc": "ipc"}
+### Bins of the AF plot and histogram with a width of 0.01
+AF_BIN_EDGES = np.linspace(0, 1, 101)
+
 
 def parse_args(argv=None):
     """Define and immediately parse command line arguments."""
@@ -24,7 +47,34 @@ def parse_args(argv=None):
         "--file_in",
         metavar="file_in",
         type=Path,
-        help="Input TSV file of the vembrane TSV converter module",
+        help="Input TSV file of the vembrane TSV converter module, or the same columns as Parquet (.parquet, .pq) or Arrow IPC (.arrow, .feather, .ipc) file",
+    )
+    parser.add_argument(
+        "--manifest",
+        metavar="manifest",
+        type=Path,
+        help="CSV file with the columns sample and file_in listing the vembrane TSV files of a cohort, replaces --file_in",
+    )
+    parser.add_argument(
+        "--outdir",
+        metavar="outdir",
+        type=Path,
+        default=Path("."),
+        help="Output directory of the per-sample TMB reports and plots (<sample>.csv, <sample>.png) with --manifest",
+    )
+    parser.add_argument(
+        "--cohort_out",
+        metavar="cohort_out",
+        type=Path,
+        default=Path("cohort_TMB.csv"),
+        help="Combined TMB table of all samples of the --manifest",
+    )
+    parser.add_argument(
+        "--workers",
+        metavar="workers",
+        type=int,
+        default=1,
+        help="Number of processes calculating the TMB of the --manifest samples in parallel",
     )
     parser.add_argument(
         "--sampleindex",
@@ -36,7 +86,15 @@ def parse_args(argv=None):
         "--bedfile",
         metavar="bedfile",
         type=Path,
-        help="Path to the provided BED file with .bed suffix.",
+        nargs="+",
+        help="Path to the provided BED file with .bed suffix or the compiled panel (.npz) of process_bedfiles.py. "
+        "Several files define several panels named by their file names, the TMB of all panels is calculated in one pass.",
+    )
+    parser.add_argument(
+        "--panel_column",
+        metavar="panel_column",
+        type=int,
+        help="1-based column of the BED files holding the panel name of each interval, every name defines a separate panel",
     )
     parser.add_argument(
         "--prefilter_region",
@@ -92,6 +150,12 @@ def parse_args(argv=None):
         type=str,
         help="String containing the VEP consequences for which should be filtered.",
     )
+    parser.add_argument(
+        "--csq_terms",
+        metavar="csq_terms",
+        type=Path,
+        help="CSV file containing the VEP consequence terms which are encoded for consequence filtering.",
+    )
     parser.add_argument(
         "--population_db",
         metavar="population_db",
@@ -110,6 +174,88 @@ def parse_args(argv=None):
         type=Path,
         help="Stacked histogramm of the AFs in the sample",
     )
+    parser.add_argument(
+        "--variants_out",
+        metavar="VARIANTS_OUT",
+        type=Path,
+        help="Parquet file of the mutations after consequence, deduplication and mutation type filtering, with their ROI membership and the filter result of each sample; written as <sample>.parquet to --outdir with --manifest",
+    )
+    parser.add_argument(
+        "--plot",
+        metavar="PLOT",
+        choices=["png", "json", "none"],
+        default="png",
+        help="Plot the AF distribution as PNG, write the binned AF distribution per consequence as <plot_out>.histogram.json or skip plotting",
+    )
+    parser.add_argument(
+        "--metrics_json",
+        "--metrics-json",
+        dest="metrics_json",
+        metavar="METRICS_JSON",
+        type=Path,
+        help="MultiQC custom content JSON (*_mqc.json) with wall time, rows in/out and peak RSS of each calculation stage",
+    )
+    parser.add_argument(
+        "--sweep_out",
+        metavar="SWEEP_OUT",
+        type=Path,
+        help="CSV file with the TMB for every combination of the --sweep_* thresholds and each sample",
+    )
+    parser.add_argument(
+        "--sweep_min_AF",
+        metavar="sweep_min_AF",
+        type=float,
+        nargs="+",
+        help="Minimal AF thresholds evaluated in the threshold sweep, defaults to --min_AF",
+    )
+    parser.add_argument(
+        "--sweep_max_AF",
+        metavar="sweep_max_AF",
+        type=float,
+        nargs="+",
+        help="Maximal AF thresholds evaluated in the threshold sweep, defaults to --max_AF",
+    )
+    parser.add_argument(
+        "--sweep_min_cov",
+        metavar="sweep_min_cov",
+        type=int,
+        nargs="+",
+        help="Minimal coverage thresholds evaluated in the threshold sweep, defaults to --min_cov",
+    )
+    parser.add_argument(
+        "--sweep_popfreq_max",
+        metavar="sweep_popfreq_max",
+        type=float,
+        nargs="+",
+        help="Maximal population AF thresholds evaluated in the threshold sweep, defaults to --popfreq_max",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Read the TSV in chunks with bounded memory instead of loading it completely, e.g. for WGS data. "
+        "Plots and sweeps are built from AF histograms and threshold counts summed over the chunks.",
+    )
+    parser.add_argument(
+        "--chunksize",
+        metavar="chunksize",
+        type=int,
+        default=500000,
+        help="Number of TSV rows read per chunk in --streaming mode.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        metavar="cache_dir",
+        type=Path,
+        help="Directory of a local result cache keyed by the TSV content, panel and filter parameters. Cached reports, "
+        "plots and sweeps are restored instead of recalculating the TMB. Not used with --variants_out.",
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        metavar="cache_max_mb",
+        type=float,
+        default=1024,
+        help="Maximal size of the --cache_dir in MB, the least recently used entries are evicted beyond it.",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -122,133 +268,425 @@ def parse_args(argv=None):
 
 logger = logging.getLogger()
 
-def multisample_check(file_in):
-    ### Read in sample
-    TMB_multicontrol = pd.read_csv(file_in, sep="\t")
+def multisample_check(TMB_inputfile):
     ### Generate boolean based on AF column if single- or multisample
-    multi_control = len(TMB_multicontrol.filter(regex='allele_fraction*').columns) > 1 ### check based on AF
+    multi_control = len(TMB_inputfile.filter(regex='allele_fraction*').columns) > 1 ### check based on AF
     ### Isolate sample suffix(es)
-    matching_columns = [col for col in TMB_multicontrol.columns if col.startswith('allele_fraction')]
+    matching_columns = [col for col in TMB_inputfile.columns if col.startswith('allele_fraction')]
     suffix_list = list(map( lambda x: x.replace('allele_fraction', ''), matching_columns))
     ### Return all relevant variables
     return (multi_control, suffix_list)
 
 
-def preprocess_vembraneout(file_in, allele_fraction, read_depth, filter_muttype, population_db, filter_consequence, csq_values):
-    TMB_inputfile = pd.read_csv(file_in, sep="\t")
-    filtering_rates = []
-    TMB_inputfile["Mut_ID"] = TMB_inputfile[["CHROM", "POS", "REF", "ALT"]].apply(
-        lambda row: ":".join(row.values.astype(str)), axis=1
+def tmb_column_dtypes(columns, population_db):
+    ### Columns of the vembrane TSV used for TMB calculation and their dtypes, all other columns are not parsed
+    dtypes = {
+        "CHROM": "category",
+        "POS": np.int64,
+        "REF": "category",
+        "ALT": "category",
+        "FILTER": "category",
+        "CSQ_VARIANT_CLASS": "category",
+        "CSQ_Consequence": "category",
+        population_db: np.float64,
+    }
+    for column in columns:
+        if column.startswith("allele_fraction"):
+            dtypes[column] = np.float64
+        elif column.startswith("read_depth"):
+            dtypes[column] = np.float32
+    return {column: dtype for column, dtype in dtypes.items() if column in columns}
+
+
+def read_header(file_in):
+    ### Column-only dataframe of the TSV, Parquet or Arrow IPC input
+    if file_in.suffix not in ARROW_FORMATS:
+        return pd.read_csv(file_in, sep="\t", nrows=0)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if ARROW_FORMATS[file_in.suffix] == "parquet":
+        names = pq.read_schema(file_in, memory_map=True).names
+    else:
+        names = pa.ipc.open_file(pa.memory_map(str(file_in), "r")).schema.names
+    return pd.DataFrame(columns=names)
+
+
+def read_arrow_table(file_in, columns):
+    ### Memory-mapped table of the given columns of a Parquet or Arrow IPC file
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if ARROW_FORMATS[file_in.suffix] == "parquet":
+        return pq.read_table(file_in, columns=columns, memory_map=True)
+    ### Arrow IPC files are read without copying from the memory map
+    return pa.ipc.open_file(pa.memory_map(str(file_in), "r")).read_all().select(columns)
+
+
+def read_arrow_batches(file_in, columns, chunksize):
+    ### Record batches of at most chunksize rows, Parquet row groups are only decoded when reached
+    import pyarrow.parquet as pq
+
+    if ARROW_FORMATS[file_in.suffix] == "parquet":
+        return pq.ParquetFile(file_in, memory_map=True).iter_batches(batch_size=chunksize, columns=columns)
+    return read_arrow_table(file_in, columns).to_batches(max_chunksize=chunksize)
+
+
+def read_vembraneout(file_in, header, population_db, chunksize=None):
+    ### Parse only the TMB-relevant columns of the TSV, header is the column-only dataframe of the file
+    dtypes = tmb_column_dtypes(header.columns, population_db)
+    if file_in.suffix not in ARROW_FORMATS:
+        return pd.read_csv(file_in, sep="\t", usecols=list(dtypes), dtype=dtypes, chunksize=chunksize)
+    if chunksize is None:
+        return read_arrow_table(file_in, list(dtypes)).to_pandas().astype(dtypes)
+    return (batch.to_pandas().astype(dtypes) for batch in read_arrow_batches(file_in, list(dtypes), chunksize))
+
+
+def encode_variant_keys(TMB_inputfile, contig_codes):
+    """
+    Encode CHROM, POS, REF and ALT of each row into one 64-bit integer key.
+    Contigs receive consecutive codes in order of appearance, the passed contig_codes dictionary is updated
+    and can be reused to obtain consistent keys over several calls.
+    SNVs get exact allele codes, all other allele pairs are hashed into the remaining bits with the highest
+    allele bit set, so a collision requires two different non-SNV allele pairs at the very same position.
+    """
+    ### Contig code per unique contig name
+    contig_index, contigs = pd.factorize(TMB_inputfile["CHROM"].astype(str))
+    for contig in contigs:
+        contig_codes.setdefault(contig, len(contig_codes))
+    if len(contig_codes) > 2**CONTIG_BITS:
+        raise ValueError(f"The TSV contains more than {2**CONTIG_BITS} contigs, which exceeds the variant key capacity.")
+    contig_code = np.array([contig_codes[contig] for contig in contigs], dtype=np.int64)[contig_index]
+
+    positions = TMB_inputfile["POS"].to_numpy(dtype=np.int64)
+    if len(positions) > 0 and (positions.min() < 0 or positions.max() >= 2**POSITION_BITS):
+        raise ValueError(f"The TSV contains positions outside of the variant key range [0, {2**POSITION_BITS}).")
+
+    ### Allele code per unique REF/ALT pair, built from the category codes of REF and ALT
+    refs = TMB_inputfile["REF"].astype("category").cat
+    alts = TMB_inputfile["ALT"].astype("category").cat
+    ### Missing alleles have the code -1, the modulo maps them to the "nan" category appended last
+    ref_categories = np.append(refs.categories.astype(str).to_numpy(dtype=object), "nan")
+    alt_categories = np.append(alts.categories.astype(str).to_numpy(dtype=object), "nan")
+    allele_index, pair_codes = pd.factorize(
+        (refs.codes.to_numpy(dtype=np.int64) % len(ref_categories)) * len(alt_categories)
+        + alts.codes.to_numpy(dtype=np.int64) % len(alt_categories)
     )
+    allele_pairs = ref_categories[pair_codes // len(alt_categories)] + ">" + alt_categories[pair_codes % len(alt_categories)]
+    hashed_alleles = pd.util.hash_array(allele_pairs).astype(np.int64) & (2 ** (ALLELE_BITS - 1) - 1)
+    unique_allele_code = np.array(
+        [
+            SNV_ALLELE_CODES.get(tuple(pair.split(">")), hashed | 2 ** (ALLELE_BITS - 1))
+            for pair, hashed in zip(allele_pairs, hashed_alleles)
+        ],
+        dtype=np.int64,
+    )
+    allele_code = unique_allele_code[allele_index]
+
+    return (contig_code << (POSITION_BITS + ALLELE_BITS)) | (positions << ALLELE_BITS) | allele_code
+
+
+def variant_ids(TMB_inputfile, rows):
+    ### Readable CHROM:POS:REF:ALT identifiers of the given rows for output files, Mut_ID holds the integer keys
+    chrom, pos, ref, alt = [
+        TMB_inputfile[column].iloc[rows].astype(str).to_numpy(dtype=object) for column in ["CHROM", "POS", "REF", "ALT"]
+    ]
+    return chrom + ":" + pos + ":" + ref + ":" + alt
+
+
+def preprocess_vembraneout(TMB_inputfile, filter_muttype, filter_consequence, csq_values, term_bits, metrics=None):
+    """
+    Sample-independent preprocessing, performed once for all samples of the TSV.
+    The consequence, deduplication and mutation type filters are combined into one boolean mask over the
+    rows of the TSV, no intermediate frames are built. Returns the mask and the unique mutations after each step.
+    """
+    filtering_rates = []
+    started = time.perf_counter()
+    TMB_inputfile["Mut_ID"] = encode_variant_keys(TMB_inputfile, contig_codes={})
+    keys = TMB_inputfile["Mut_ID"].to_numpy()
     ### Count initial unique mutations based on Mut_ID
-    initial_unique = TMB_inputfile["Mut_ID"].nunique()
-    filtering_rates.append(initial_unique)
+    filtering_rates.append(len(pd.unique(keys)))
+    record_stage(metrics, "mut_id", started, len(keys), len(keys))
     ### move consequence filter into preprocessing to circumvent deduplication pitfall
+    started = time.perf_counter()
     if filter_consequence is True:
-        TMB_consequence, filtering_csq = consequence_filter(TMB_inputfile, csq_values)
-        filtering_rates.append(filtering_csq)
+        selected = consequence_filter(TMB_inputfile, csq_values, term_bits)
     else:
-        TMB_consequence = TMB_inputfile
-        filtering_rates.append(initial_unique)
-    TMB_deduplicated = TMB_consequence.drop_duplicates("Mut_ID", keep="first")
-    ### reduce dataset on relevant columns for TMB calculation
-    TMB_minimal = TMB_deduplicated.filter(
-        items=[
-            "Mut_ID",
-            "CHROM",
-            "POS",
-            "REF",
-            "ALT",
-            "FILTER",
-            allele_fraction,
-            read_depth,
-            "CSQ_VARIANT_CLASS",
-            "CSQ_Consequence",
-            population_db,
-        ],
-        axis=1,
-    )
+        selected = np.ones(len(keys), dtype=bool)
+    rows_consequence = int(selected.sum())
+    record_stage(metrics, "consequence_filter", started, len(keys), rows_consequence)
+    ### Deduplicate by keeping the first remaining row of each mutation
+    started = time.perf_counter()
+    selected[selected] = ~pd.Series(keys[selected]).duplicated().to_numpy()
+    filtering_rates.append(int(selected.sum()))
+    record_stage(metrics, "deduplication", started, rows_consequence, filtering_rates[1])
+    started = time.perf_counter()
+    selected &= filter_muttype_rows(TMB_inputfile, filter_muttype)
+    filtering_rates.append(int(selected.sum()))
+    record_stage(metrics, "muttype_filter", started, filtering_rates[1], filtering_rates[2])
+    return (selected, filtering_rates)
+
+
+def preprocess_chunk(TMB_chunk, filter_muttype, filter_consequence, csq_values, term_bits, contig_codes, last_keys, metrics=None):
+    """
+    Streaming counterpart of preprocess_vembraneout for one chunk of the TSV.
+    vembrane writes all transcript rows of a variant next to each other, hence unique mutations are counted
+    and deduplicated as changes of the Mut_ID between consecutive rows. last_keys holds the last Mut_ID before
+    and after the consequence filter and is carried over to the next chunk.
+    """
+    filtering_rates = []
+    started = time.perf_counter()
+    TMB_chunk["Mut_ID"] = encode_variant_keys(TMB_chunk, contig_codes)
+    keys = TMB_chunk["Mut_ID"].to_numpy()
+    filtering_rates.append(int(first_of_run(keys, last_keys, "initial").sum()))
+    record_stage(metrics, "mut_id", started, len(keys), len(keys))
+    started = time.perf_counter()
+    if filter_consequence is True:
+        selected = consequence_filter(TMB_chunk, csq_values, term_bits)
+    else:
+        selected = np.ones(len(keys), dtype=bool)
+    rows_consequence = int(selected.sum())
+    record_stage(metrics, "consequence_filter", started, len(keys), rows_consequence)
+    started = time.perf_counter()
+    selected[selected] = first_of_run(keys[selected], last_keys, "consequence")
+    filtering_rates.append(int(selected.sum()))
+    record_stage(metrics, "deduplication", started, rows_consequence, filtering_rates[1])
+    started = time.perf_counter()
+    selected &= filter_muttype_rows(TMB_chunk, filter_muttype)
+    filtering_rates.append(int(selected.sum()))
+    record_stage(metrics, "muttype_filter", started, filtering_rates[1], filtering_rates[2])
+    return (selected, filtering_rates)
+
+
+def first_of_run(keys, last_keys, step):
+    ### Flag rows starting a new mutation, the first row is compared to the last key of the previous chunk
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = keys[1:] != keys[:-1]
+    if len(keys) > 0:
+        is_first[0] = keys[0] != last_keys.get(step)
+        last_keys[step] = keys[-1]
+    return is_first
+
+
+def filter_muttype_rows(TMB_inputfile, filter_muttype):
+    ### Boolean mask of the rows with an eligible mutation type
     if filter_muttype in ["snv", "snvs"]:
-        TMB_filtered = filter_onlySNV(TMB_minimal)
+        return filter_onlySNV(TMB_inputfile)
     elif filter_muttype in ["mnv", "mnvs"]:
-        TMB_filtered = filter_retainMNV(TMB_minimal)
+        return filter_retainMNV(TMB_inputfile)
     else:
-        TMB_filtered = TMB_minimal
-    filtering_rates.append(TMB_filtered["Mut_ID"].nunique())
-    return (TMB_filtered, filtering_rates)
+        return np.ones(len(TMB_inputfile.index), dtype=bool)
+
+
+def is_single_base(TMB_inputfile):
+    return (TMB_inputfile["REF"].isin(["A", "G", "T", "C"]) & TMB_inputfile["ALT"].isin(["A", "G", "T", "C"])).to_numpy()
 
 
 def filter_onlySNV(TMB_inputfile):
-    TMB_onlySNV = TMB_inputfile[
-        (TMB_inputfile["REF"].isin(["A", "G", "T", "C"]))
-        & (TMB_inputfile["ALT"].isin(["A", "G", "T", "C"]))
-    ].reset_index(drop=True)
-    if TMB_onlySNV["CSQ_VARIANT_CLASS"].eq("SNV").all():
-        return TMB_onlySNV
-    else:
-        TMB_onlySNV = TMB_onlySNV[(TMB_onlySNV["CSQ_VARIANT_CLASS"] == "SNV")]
-        return TMB_onlySNV
+    ### Single-base substitutions which are also classified as SNV by VEP
+    return is_single_base(TMB_inputfile) & (TMB_inputfile["CSQ_VARIANT_CLASS"] == "SNV").to_numpy()
 
 
 def filter_retainMNV(TMB_inputfile):
-    TMB_SNVs = TMB_inputfile[
-        (TMB_inputfile["REF"].isin(["A", "G", "T", "C"]))
-        & (TMB_inputfile["ALT"].isin(["A", "G", "T", "C"]))
-    ].reset_index(drop=True)
-    TMB_MNVs = TMB_inputfile[
-        (TMB_inputfile["CSQ_VARIANT_CLASS"] == "substitution")
-    ].reset_index(
-        drop=True
-    )  ### contains DBS, SNVs close to repeats and non-normalized SNVs close to InDels
-    TMB_return = pd.concat([TMB_SNVs, TMB_MNVs])
-    return TMB_return
-
-
-def csq_match(row, values):
-    row_values = row.split('&')
-    return any(value in row_values for value in values)
-
-
-def consequence_filter(TMB_inputfile, csq_values):
-    csq_list = csq_values.split(",")
-    TMB_prefilt = TMB_inputfile.copy()
-    TMB_filt = TMB_prefilt[TMB_prefilt["CSQ_Consequence"].apply(lambda x: csq_match(x, csq_list))]
-    filtering_rates = TMB_filt["Mut_ID"].nunique()
-    return (TMB_filt, filtering_rates)
-
-
-def filter_bedrange(TMB_inputfile, panel_data_in):
-    ### Separate filter for ROI independant of tag_roi
-    ### Read bedfile and convert to range
-    panel_data = panel_data_in.iloc[:, 0:3]
-    panel_data.columns = ["Chromosome", "Start", "End"]
-    panel_range = pr.PyRanges(panel_data)
-    ### Read in data
-    TMB_prefilt = TMB_inputfile.copy()
-    TMB_prefilt = TMB_prefilt[["CHROM", "POS"]].rename(columns={"CHROM": "Chromosome", "POS": "Start"})
-    TMB_prefilt['End'] = TMB_prefilt['Start']
-    TMB_range = pr.PyRanges(TMB_prefilt)
-    ### Create intersection and return ROI-filtered dataframe
-    TMB_intersect = panel_range.intersect(TMB_range)
-    TMB_intersect_df = TMB_intersect.df.rename(columns={"Chromosome": "CHROM", "Start": "POS"}).iloc[:,0:2]
-    ### Check if the intersection df is not empty and pass a warning parameter to output writer
-    if len(TMB_intersect_df.index) > 0:
-        TMB_filt = pd.merge(TMB_inputfile, TMB_intersect_df[["CHROM", "POS"]], on=["CHROM", "POS"])
-        is_notempty = True
-        filtering_rates = TMB_filt.index.nunique()
-        return (TMB_filt, is_notempty, filtering_rates)
-    else:
-        TMB_filt = TMB_inputfile
-        is_notempty = False
-        filtering_rates = TMB_filt.index.nunique()
-        return (TMB_filt, is_notempty, filtering_rates)
+    ### VEP substitutions contain DBS, SNVs close to repeats and non-normalized SNVs close to InDels
+    return is_single_base(TMB_inputfile) | (TMB_inputfile["CSQ_VARIANT_CLASS"] == "substitution").to_numpy()
 
 
-def check_bed_size(panel_data_in, breaking_thresh):
-    panel_data = panel_data_in.iloc[:, 0:3]
-    panel_data.columns = ["Chromosome", "Start", "End"]
-    panel_range = pr.PyRanges(panel_data)
-    panel_size = panel_range.length
+def consequence_term_bits(csq_terms, csq_values):
+    ### Assign one bit to each SO term of the consequence CSV, requested terms missing in the CSV get additional bits
+    terms = []
+    if csq_terms is not None:
+        with open(csq_terms, "r") as file:
+            terms += [term.strip() for term in file.read().split(",") if term.strip()]
+    if csq_values:
+        terms += [term.strip() for term in csq_values.split(",") if term.strip()]
+    terms = list(dict.fromkeys(terms))
+    if len(terms) > 63:
+        raise ValueError(f"{len(terms)} consequence terms were provided, but at most 63 can be encoded.")
+    return {term: 1 << bit for bit, term in enumerate(terms)}
+
+
+def encode_consequences(consequences, term_bits):
+    """
+    Encode the "&"-separated VEP consequences of each row as integer bitmask of the SO terms in term_bits.
+    Each unique consequence string is split only once, rows are mapped through their category codes.
+    Terms not contained in term_bits are not encoded.
+    """
+    categories = consequences.astype("category").cat
+    ### The additional last entry is selected by the code -1 of missing values
+    category_masks = np.zeros(len(categories.categories) + 1, dtype=np.int64)
+    for index, category in enumerate(categories.categories.astype(str)):
+        for term in category.split("&"):
+            category_masks[index] |= term_bits.get(term, 0)
+    return category_masks[categories.codes.to_numpy()]
+
+
+def encode_first_consequence(consequences):
+    ### Integer code of the first SO term of each row and the corresponding terms, missing values have the code -1
+    categories = consequences.astype("category").cat
+    first_codes, first_terms = pd.factorize(categories.categories.astype(str).str.split("&").str[0])
+    first_codes = np.append(first_codes, -1)
+    return (first_codes[categories.codes.to_numpy()], np.asarray(first_terms, dtype=object))
+
+
+def consequence_filter(TMB_inputfile, csq_values, term_bits):
+    ### Boolean mask of the rows with any consequence being one of the requested csq_values
+    selected_bits = np.bitwise_or.reduce([term_bits[term.strip()] for term in csq_values.split(",") if term.strip()])
+    csq_bits = encode_consequences(TMB_inputfile["CSQ_Consequence"], term_bits)
+    return (csq_bits & selected_bits) != 0
+
+
+def build_interval_index(panel_data):
+    """
+    Build the interval index of the BED frames of all panels, with the segments of process_bedfiles.segment_panels
+    per contig, which compiles panels the same way.
+    Returns the interval index of (starts, ends, masks) per contig and the size of each panel.
+    """
+    contig_panels = {}
+    for bit, panel_data_in in enumerate(panel_data):
+        intervals_panel = panel_data_in.iloc[:, 0:3]
+        intervals_panel.columns = ["Chromosome", "Start", "End"]
+        for contig, intervals in intervals_panel.groupby(intervals_panel["Chromosome"].astype(str), sort=False):
+            contig_panels.setdefault(contig, {})[bit] = (
+                intervals["Start"].to_numpy(dtype=np.int64),
+                intervals["End"].to_numpy(dtype=np.int64),
+            )
+
+    panel_sizes = np.zeros(len(panel_data), dtype=np.int64)
+    interval_index = {}
+    for contig, panels in contig_panels.items():
+        interval_index[contig], sizes = segment_panels(panels)
+        for bit, size in sizes.items():
+            panel_sizes[bit] += size
+    return (interval_index, panel_sizes)
+
+
+def query_interval_index(interval_index, chroms, positions):
+    ### Panel bitmask of the 1-based VCF positions located within the 0-based, half-open BED segments, 0 outside all panels
+    panel_bits = np.zeros(len(positions), dtype=np.uint64)
+    contig_index, contigs = pd.factorize(chroms)
+    zero_based = np.asarray(positions, dtype=np.int64) - 1
+    for code, contig in enumerate(contigs):
+        if str(contig) not in interval_index:
+            continue
+        starts, ends, masks = interval_index[str(contig)]
+        rows = np.flatnonzero(contig_index == code)
+        ### Last segment starting at or before the position, which has to end after it
+        segment = np.searchsorted(starts, zero_based[rows], side="right") - 1
+        is_covered = (segment >= 0) & (zero_based[rows] < ends[np.maximum(segment, 0)])
+        panel_bits[rows] = np.where(is_covered, masks[np.maximum(segment, 0)], 0)
+    return panel_bits
+
+
+def panel_membership(panel_bits, panels):
+    ### Boolean matrix (positions x panels) of the panel bitmasks
+    bits = np.array([bit for _, bit, _ in panels], dtype=np.uint64)
+    return ((panel_bits[:, np.newaxis] >> bits) & np.uint64(1)).astype(bool)
+
+
+def filter_bedrange(TMB_inputfile, rows, interval_index, panels):
+    ### Separate filter for ROI independant of tag_roi, returns the mask (rows x panels) of the given rows to retain
+    panel_bits = query_interval_index(interval_index, TMB_inputfile["CHROM"].iloc[rows], TMB_inputfile["POS"].to_numpy()[rows])
+    in_roi = panel_membership(panel_bits, panels)
+    ### Check if any mutation is located in the ROI of each panel and pass a warning parameter to output writer
+    is_notempty = in_roi.any(axis=0)
+    in_roi[:, ~is_notempty] = True
+    filtering_rates = in_roi.sum(axis=0)
+    return (in_roi, is_notempty, filtering_rates)
+
+
+def load_compiled_panel(panel_file):
+    """
+    Memory-map the compiled panel written by process_bedfiles.py --panel_out.
+    The .npz archive is stored uncompressed, so every array is a contiguous .npy record inside the zip file.
+    Panels compiled from a BED file with panel names additionally contain the panel bitmask of each segment,
+    the panel names and sizes. Returns the interval index, the panel names and the panel sizes.
+    """
+    panel = {}
+    with zipfile.ZipFile(panel_file) as archive, open(panel_file, "rb") as file:
+        for member in archive.infolist():
+            if member.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"The compiled panel {panel_file} is compressed and cannot be memory-mapped.")
+            ### The local file header has 30 bytes followed by the file name and extra field
+            file.seek(member.header_offset)
+            name_length, extra_length = struct.unpack("<HH", file.read(30)[26:30])
+            file.seek(member.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            name = member.filename[: -len(".npy")]
+            if shape == ():
+                panel[name] = np.fromfile(file, dtype=dtype, count=1)[0]
+            else:
+                panel[name] = np.memmap(
+                    panel_file, dtype=dtype, mode="r", shape=shape, offset=file.tell(), order="F" if fortran_order else "C"
+                )
+    offsets = panel["offsets"]
+    ### Panels compiled without panel names cover all intervals with bit 0
+    masks = panel["masks"] if "masks" in panel else np.ones(len(panel["starts"]), dtype=np.uint64)
+    interval_index = {
+        str(contig): (
+            panel["starts"][offsets[index] : offsets[index + 1]],
+            panel["ends"][offsets[index] : offsets[index + 1]],
+            masks[offsets[index] : offsets[index + 1]],
+        )
+        for index, contig in enumerate(panel["contigs"])
+    }
+    if "panel_names" not in panel:
+        return (interval_index, [None], [int(panel["panel_size"])])
+    return (interval_index, [str(name) for name in panel["panel_names"]], [int(size) for size in panel["panel_sizes"]])
+
+
+def compiled_panel_data(panel_file):
+    ### BED frames of each panel of a compiled panel, to combine it with further panels
+    interval_index, panel_names, _ = load_compiled_panel(panel_file)
+    panel_data = []
+    for bit in range(len(panel_names)):
+        intervals = []
+        for contig, (starts, ends, masks) in interval_index.items():
+            is_covered = ((masks >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+            intervals.append(pd.DataFrame({0: contig, 1: starts[is_covered], 2: ends[is_covered]}))
+        panel_data.append(pd.concat(intervals, ignore_index=True))
+    return (panel_names, panel_data)
+
+
+def read_panels(bedfiles, panel_column):
+    """
+    Read the intervals of all panels. Every BED file defines one panel named by its file name, unless
+    panel_column is given, then every distinct value of this column defines one panel.
+    Returns the panel names and a BED frame for each panel.
+    """
+    panel_names, panel_data = [], []
+    for bedfile in bedfiles:
+        if bedfile.suffix == ".npz":
+            names, data = compiled_panel_data(bedfile)
+            panel_names += [bedfile.stem if name is None else name for name in names]
+            panel_data += data
+            continue
+        bed = pd.read_csv(bedfile, sep="\t", header=None)
+        if panel_column is None:
+            panel_names.append(bedfile.stem)
+            panel_data.append(bed)
+            continue
+        if panel_column < 4 or panel_column > len(bed.columns):
+            raise ValueError(f"The BED file {bedfile} has no panel name column {panel_column}.")
+        for name, intervals in bed.groupby(bed.iloc[:, panel_column - 1].astype(str), sort=False):
+            panel_names.append(name)
+            panel_data.append(intervals)
+    duplicates = {name for name in panel_names if panel_names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Found duplicate panel names: {', '.join(sorted(duplicates))}")
+    if len(panel_names) > 64:
+        raise ValueError(f"{len(panel_names)} panels were provided, but at most 64 can be calculated in one pass.")
+    ### A single panel keeps the output file names of a single BED file
+    if len(panel_names) == 1:
+        panel_names = [None]
+    return (panel_names, panel_data)
+
+
+def check_bed_size(panel_size, breaking_thresh):
     if panel_size >= breaking_thresh:
         if panel_size >= 1000000:
             logger.info(
@@ -278,110 +716,464 @@ def check_bed_size(panel_data_in, breaking_thresh):
         return False, False
 
 
-def coverage_filter(input, read_depth, threshold):
-    TMB_covfilt = input[(input[read_depth] >= threshold)].reset_index(drop=True)
-    filtering_rates = TMB_covfilt["Mut_ID"].nunique()
-    return (TMB_covfilt, filtering_rates)
+def coverage_filter(read_depths, threshold):
+    ### Boolean mask (mutations x samples) of mutations above the coverage threshold
+    return read_depths >= threshold
 
 
-def allelefrequency_filter(input, allele_fraction, lower_threshold, higher_threshold):
-    TMB_AFboundariesfilt = input[
-        (input[allele_fraction] >= lower_threshold)
-        & (input[allele_fraction] <= higher_threshold)
-    ].reset_index(drop=True)
-    filtering_rates = TMB_AFboundariesfilt["Mut_ID"].nunique()
-    return (TMB_AFboundariesfilt, filtering_rates)
+def allelefrequency_filter(allele_fractions, lower_threshold, higher_threshold):
+    return (allele_fractions >= lower_threshold) & (allele_fractions <= higher_threshold)
 
 
-def popfrequency_filter(input, database, threshold):
+def popfrequency_filter(popfreqs, threshold):
     ### NaN should be retained
-    TMB_popfreqfilt = input[(input[database] <= threshold) | input[database].isna()].reset_index(drop=True)
-    filtering_rates = TMB_popfreqfilt["Mut_ID"].nunique()
-    return (TMB_popfreqfilt, filtering_rates)
+    return (popfreqs <= threshold) | np.isnan(popfreqs)
 
 
-def calculate_TMB(input, panel_size):
-    TMB = round((input["Mut_ID"].nunique() / panel_size) * 1000000, 2)
-    return TMB
+def cascade_arrays(TMB_inputfile, rows, suffix_list, population_db):
+    ### Read depths and AFs (mutations x samples) and population AFs (mutations x 1) of the given rows
+    ### Only the selected rows of each column are converted, the frame itself is not copied
+    def column_values(columns):
+        return np.column_stack([TMB_inputfile[column].to_numpy()[rows] for column in columns]).astype(float)
 
+    read_depths = column_values([f"read_depth{suffix}" for suffix in suffix_list])
+    allele_fractions = column_values([f"allele_fraction{suffix}" for suffix in suffix_list])
+    popfreqs = column_values([population_db])
+    return (read_depths, allele_fractions, popfreqs)
 
-def process_single_sample(args, suffix):
-    ### Wrapper for single-sample TSV
-    allele_fraction = f'allele_fraction{suffix}'
-    read_depth = f'read_depth{suffix}'
-    TMB_df, filtering_rates_total = preprocess_vembraneout(
-        args.file_in, allele_fraction, read_depth, args.filter_muttype, args.population_db, args.filter_consequence, args.csq_values
-    )
-    process_data(args, TMB_df, filtering_rates_total, args.prefilter_region, allele_fraction, read_depth, args.file_out, args.plot_out)
 
+def filter_cascade(read_depths, allele_fractions, popfreqs, min_cov, min_AF, max_AF, popfreq_max):
+    ### Evaluate coverage, AF and population frequency filters for all sample columns at once
+    ### Rows are unique mutations, each column of the returned masks corresponds to one sample
+    covfilt = coverage_filter(read_depths, min_cov)
+    affilt = covfilt & allelefrequency_filter(allele_fractions, min_AF, max_AF)
+    popfilt = affilt & popfrequency_filter(popfreqs, popfreq_max)
+    return (covfilt, affilt, popfilt)
 
-def process_multi_sample(args, suffix_list):
-    ### Wrapper for multi-sample TSV
-    ### Outputs each sample in the VCF/TSV as seperate file
-    for suffix in suffix_list:
-        allele_fraction = f'allele_fraction{suffix}'
-        read_depth = f'read_depth{suffix}'
-        output_filename = f"{str(args.file_out).strip('.txt')}_{suffix}.csv"
-        output_plotname = f"{str(args.plot_out).strip('.png')}_{suffix}.png"
-        TMB_df, filtering_rates_total = preprocess_vembraneout(
-            args.file_in, allele_fraction, read_depth, args.filter_muttype, args.population_db, args.filter_consequence, args.csq_values
-        )
-        process_data(args, TMB_df, filtering_rates_total, args.prefilter_region, allele_fraction, read_depth, output_filename, output_plotname)
 
+def roi_column(panel_name):
+    ### Column of the ROI membership, named by the panel if several panels are calculated
+    return "in_ROI" if panel_name is None else f"in_ROI_{panel_name}"
 
-def process_data(args, TMB_df, filtering_rates_total, prefilter_region, allele_fraction, read_depth, output_file, output_plot):
-    ### Processes data based on thresholds and filter conditions to generate the output txt files
-    panel_bedfile = pd.read_csv(args.bedfile, sep="\t", header=None)
-    is_eligible, panel_size = check_bed_size(panel_bedfile, args.panelsize_threshold)
 
-    if not is_eligible:
-        logger.info(
-            "The calculation was not performed as the panel_size is below the allowed threshold."
-        )
-        return
+def open_variant_writer(variants_out, dtypes, suffix_list, prefilter_region, panels):
+    ### Parquet writer of the filtered mutations with a fixed schema, so all chunks are written consistently
+    import pyarrow as pa
+    import pyarrow.parquet as pq
 
+    arrow_types = {"category": pa.string(), np.int64: pa.int64(), np.float64: pa.float64(), np.float32: pa.float32()}
+    fields = [("Mut_ID", pa.string())] + [(column, arrow_types[dtype]) for column, dtype in dtypes.items()]
     if prefilter_region == True:
-        TMB_df, is_notempty, filtering_rates_roi = filter_bedrange(TMB_df, panel_bedfile)
-    else:
-        is_notempty = True
-        filtering_rates_roi = 0 ## ensure script is running as intended when prefilter_region is not passed
+        fields += [(roi_column(panel_name), pa.bool_()) for panel_name, _, _ in panels]
+    fields += [(f"TMB_passed{suffix}", pa.bool_()) for suffix in suffix_list]
+    return pq.ParquetWriter(variants_out, pa.schema(fields))
 
-    TMB_covfilt, filtering_rates_cov = coverage_filter(
-        TMB_df, read_depth, args.min_cov
-    )
-    TMB_affilt, filtering_rates_af = allelefrequency_filter(
-        TMB_covfilt, allele_fraction, args.min_AF, args.max_AF
-    )
-    TMB_popfilt, filtering_rates_popfreq = popfrequency_filter(
-        TMB_affilt, args.population_db, args.popfreq_max
-    )
-    TMB_value = calculate_TMB(
-        TMB_popfilt, panel_size
+
+def write_variants(writer, TMB_inputfile, rows, dtypes, in_roi, TMB_popfilt, suffix_list, panels):
+    ### Append the given rows with readable Mut_IDs, ROI membership per panel and coverage/AF/popfreq filter result per sample
+    import pyarrow as pa
+
+    variants = pd.DataFrame({"Mut_ID": variant_ids(TMB_inputfile, rows)})
+    for column in dtypes:
+        variants[column] = TMB_inputfile[column].iloc[rows].to_numpy()
+    if in_roi is not None:
+        for index, (panel_name, _, _) in enumerate(panels):
+            variants[roi_column(panel_name)] = in_roi[:, index]
+    for index, suffix in enumerate(suffix_list):
+        variants[f"TMB_passed{suffix}"] = TMB_popfilt[:, index]
+    writer.write_table(pa.Table.from_pandas(variants, schema=writer.schema, preserve_index=False))
+
+
+def plot_frame(TMB_inputfile, rows, suffix_list):
+    ### Frame of the given rows with the columns required for plotting, the only frame built after filtering
+    columns = ["CSQ_Consequence", *[f"allele_fraction{suffix}" for suffix in suffix_list]]
+    return pd.DataFrame({column: TMB_inputfile[column].iloc[rows].reset_index(drop=True) for column in columns})
+
+
+def af_histograms(TMB_df, TMB_covfilt, regions, suffix_list):
+    """
+    Count the AFs of the plotted mutations in the bins of the AF plot for each consequence, sample and region.
+    The rows of TMB_df are unique mutations, the plotted mutations of a sample pass its coverage filter and are
+    counted with the first term of their consequence. regions is a boolean matrix (mutations x regions), e.g. of the
+    ROI of each panel.
+    Returns a dictionary of the consequences with counts of the shape (samples, regions, bins + 1). The last bin
+    counts missing AFs, so that consequences without AF are listed as well. Counts of several chunks of the TSV
+    are summed by add_histograms, so that the plots never require all mutations at once.
+    """
+    bins = len(AF_BIN_EDGES) - 1
+    first_codes, terms = encode_first_consequence(TMB_df["CSQ_Consequence"])
+    histograms = {}
+    for sample, suffix in enumerate(suffix_list):
+        rows = np.flatnonzero(TMB_covfilt[:, sample])
+        codes = first_codes[rows]
+        afs = TMB_df[f"allele_fraction{suffix}"].to_numpy(dtype=np.float64)[rows]
+        ### The last bin includes AF 1, AFs outside of [0, 1] and missing AFs are counted in the additional bin
+        af_bins = np.searchsorted(AF_BIN_EDGES, afs, side="right") - 1
+        af_bins[afs == AF_BIN_EDGES[-1]] = bins - 1
+        af_bins[(af_bins < 0) | (af_bins >= bins)] = bins
+        has_term = codes >= 0
+        for region in range(regions.shape[1]):
+            is_counted = has_term & regions[rows, region]
+            counts = np.bincount(
+                codes[is_counted] * (bins + 1) + af_bins[is_counted], minlength=len(terms) * (bins + 1)
+            ).reshape(len(terms), bins + 1)
+            for code in np.flatnonzero(counts.any(axis=1)):
+                term_counts = histograms.setdefault(
+                    terms[code], np.zeros((len(suffix_list), regions.shape[1], bins + 1), dtype=np.int64)
+                )
+                term_counts[sample, region] += counts[code]
+    return histograms
+
+
+def add_histograms(total, histograms):
+    ### Sum the AF histograms of af_histograms over several chunks of the TSV
+    for consequence, counts in histograms.items():
+        total[consequence] = total[consequence] + counts if consequence in total else counts
+    return total
+
+
+def sweep_grid(args):
+    ### Threshold lists of the sweep, thresholds without a list are fixed to the single-run value
+    return (
+        args.sweep_min_cov or [args.min_cov],
+        args.sweep_popfreq_max or [args.popfreq_max],
+        args.sweep_min_AF or [args.min_AF],
+        args.sweep_max_AF or [args.max_AF],
     )
-    plot_TMB(
-        TMB_covfilt, output_plot, allele_fraction, args.min_AF, args.max_AF
+
+
+def sweep_thresholds(read_depths, allele_fractions, popfreqs, min_covs, popfreq_maxs, min_AFs, max_AFs):
+    """
+    Count the mutations passing the filter cascade for every combination of thresholds without re-filtering.
+    The AFs of each sample are sorted once, the mutations within an AF range are then obtained by searchsorted
+    on the cumulative count of mutations passing the coverage and population AF thresholds.
+    Returns the counts with the shape (samples, min_covs, popfreq_maxs, min_AFs, max_AFs).
+    """
+    counts = np.zeros(
+        (read_depths.shape[1], len(min_covs), len(popfreq_maxs), len(min_AFs), len(max_AFs)), dtype=np.int64
     )
+    for sample in range(read_depths.shape[1]):
+        ### NaN AFs are sorted last and never fall into an AF range
+        order = np.argsort(allele_fractions[:, sample], kind="stable")
+        sorted_afs = allele_fractions[order, sample]
+        lower = np.searchsorted(sorted_afs, min_AFs, side="left")
+        upper = np.searchsorted(sorted_afs, max_AFs, side="right")
+        for cov_index, min_cov in enumerate(min_covs):
+            covfilt = coverage_filter(read_depths[order, sample], min_cov)
+            for pop_index, popfreq_max in enumerate(popfreq_maxs):
+                passing = np.concatenate([[0], np.cumsum(covfilt & popfrequency_filter(popfreqs[order, 0], popfreq_max))])
+                counts[sample, cov_index, pop_index] = np.maximum(
+                    passing[upper][np.newaxis, :] - passing[lower][:, np.newaxis], 0
+                )
+    return counts
+
+
+def write_sweep(sweep_out, suffix_list, grid, counts, panels):
+    ### One row per sample and threshold combination, preceded by the panel column if several panels are calculated
+    sweeps = []
+    for (panel_name, _, panel_size), panel_counts in zip(panels, counts):
+        sweep = pd.MultiIndex.from_product(
+            [[suffix.strip("[]") for suffix in suffix_list], *grid],
+            names=["sample", "min_cov", "popfreq_max", "min_AF", "max_AF"],
+        ).to_frame(index=False)
+        sweep["mutations"] = panel_counts.ravel()
+        sweep["TMB"] = calculate_TMB(sweep["mutations"], panel_size)
+        if panel_name is not None:
+            sweep.insert(0, "panel", panel_name)
+        sweeps.append(sweep)
+    pd.concat(sweeps, ignore_index=True).to_csv(sweep_out, index=False)
+
 
-    filtering_rates_total += [
-        filtering_rates_roi,
-        filtering_rates_cov,
-        filtering_rates_af,
-        filtering_rates_popfreq,
+def calculate_TMB(mutation_count, panel_size):
+    TMB = round((mutation_count / panel_size) * 1000000, 2)
+    return TMB
+
+
+def sample_outputs(args, is_multi, suffix_list, panels):
+    ### Single-sample TSVs are written to the given file names
+    if not is_multi:
+        outputs = [(args.file_out, args.plot_out)]
+    ### Multi-sample TSVs are written as seperate file for each sample in the VCF/TSV, named after the given file names
+    else:
+        file_out, plot_out = Path(args.file_out), Path(args.plot_out)
+        outputs = [
+            (
+                str(file_out.with_name(f"{file_out.stem}_{suffix}.csv")),
+                str(plot_out.with_name(f"{plot_out.stem}_{suffix}.png")),
+            )
+            for suffix in suffix_list
+        ]
+    ### Several panels are written as seperate file for each panel, one list of sample outputs per panel
+    return [
+        [(panel_output(output_file, panel_name), panel_output(output_plot, panel_name)) for output_file, output_plot in outputs]
+        for panel_name, _, _ in panels
     ]
 
-    write_output(
-        output_file,
-        filtering_rates_total,
-        args.prefilter_region,
-        args.min_cov,
-        args.min_AF,
-        args.max_AF,
-        args.population_db,
-        args.popfreq_max,
-        TMB_value,
-        panel_size,
-        is_notempty,
+
+def panel_output(file_name, panel_name):
+    if panel_name is None:
+        return file_name
+    file_name = Path(file_name)
+    return f"{file_name.parent / file_name.stem}_{panel_name}{file_name.suffix}"
+
+
+def compiled_panel_file(args):
+    ### The single compiled panel of process_bedfiles.py, None if BED files are merged and segmented here
+    if len(args.bedfile) == 1 and args.bedfile[0].suffix == ".npz":
+        return args.bedfile[0]
+    return None
+
+
+def load_panel(args):
+    """
+    Load the intervals of all panels into one interval index with a panel bitmask per segment.
+    A single compiled panel of process_bedfiles.py skips BED parsing, BED files are merged and segmented here.
+    Returns the interval index and the (name, bit, size) of each panel above the size threshold.
+    """
+    if compiled_panel_file(args) is not None:
+        interval_index, panel_names, panel_sizes = load_compiled_panel(compiled_panel_file(args))
+    else:
+        panel_names, panel_data = read_panels(args.bedfile, args.panel_column)
+        interval_index, panel_sizes = build_interval_index(panel_data)
+    panels = []
+    for bit, (panel_name, panel_size) in enumerate(zip(panel_names, panel_sizes)):
+        if panel_name is not None:
+            logger.info(f"Panel {panel_name}:")
+        is_eligible, panel_size = check_bed_size(int(panel_size), args.panelsize_threshold)
+        if is_eligible:
+            panels.append((panel_name, bit, panel_size))
+        else:
+            logger.info(
+                "The calculation was not performed as the panel_size is below the allowed threshold."
+            )
+    return (interval_index, panels)
+
+
+def process_data(args, TMB_inputfile, selected, filtering_rates_total, prefilter_region, suffix_list, outputs, panel, metrics=None):
+    ### Processes data based on thresholds and filter conditions to generate the output txt files
+    ### The cascade is evaluated once, the ROI filter and reports are evaluated for each panel
+    interval_index, panels = panel
+
+    rows = np.flatnonzero(selected)
+    started = time.perf_counter()
+    read_depths, allele_fractions, popfreqs = cascade_arrays(TMB_inputfile, rows, suffix_list, args.population_db)
+    TMB_covfilt, TMB_affilt, TMB_popfilt = filter_cascade(
+        read_depths, allele_fractions, popfreqs, args.min_cov, args.min_AF, args.max_AF, args.popfreq_max
+    )
+    record_stage(metrics, "cov_af_popfreq_filter", started, len(rows), int(TMB_popfilt.any(axis=1).sum()))
+    started = time.perf_counter()
+    if prefilter_region == True:
+        in_roi, is_notempty, filtering_rates_roi = filter_bedrange(TMB_inputfile, rows, interval_index, panels)
+    else:
+        in_roi = np.ones((len(rows), len(panels)), dtype=bool)
+        is_notempty = np.ones(len(panels), dtype=bool)
+        filtering_rates_roi = [0] * len(panels) ## ensure script is running as intended when prefilter_region is not passed
+    record_stage(metrics, "roi_filter", started, len(rows), int(in_roi.any(axis=1).sum()))
+
+    if args.variants_out is not None:
+        dtypes = tmb_column_dtypes(TMB_inputfile.columns, args.population_db)
+        with open_variant_writer(args.variants_out, dtypes, suffix_list, prefilter_region, panels) as writer:
+            write_variants(
+                writer, TMB_inputfile, rows, dtypes, in_roi & is_notempty if prefilter_region == True else None, TMB_popfilt, suffix_list, panels
+            )
+
+    histograms = None
+    if args.plot != "none":
+        histograms = af_histograms(plot_frame(TMB_inputfile, rows, suffix_list), TMB_covfilt, in_roi, suffix_list)
+
+    results = []
+    sweep_counts = []
+    for index, (panel_name, _, panel_size) in enumerate(panels):
+        ### Restrict all arrays to the mutations in the ROI of the panel
+        panel_roi = in_roi[:, index]
+        panel_rows = rows[panel_roi]
+        if args.sweep_out is not None:
+            sweep_counts.append(
+                sweep_thresholds(read_depths[panel_roi], allele_fractions[panel_roi], popfreqs[panel_roi], *sweep_grid(args))
+            )
+        started = time.perf_counter()
+        panel_results = report_samples(
+            args,
+            suffix_list,
+            outputs[index],
+            filtering_rates_total + [filtering_rates_roi[index]],
+            [TMB_covfilt[panel_roi].sum(axis=0), TMB_affilt[panel_roi].sum(axis=0), TMB_popfilt[panel_roi].sum(axis=0)],
+            panel_histograms(histograms, index),
+            panel_size,
+            is_notempty[index],
+        )
+        record_stage(metrics, "plot_and_report", started, len(panel_rows), len(panel_rows))
+        results += [(suffix, panel_name, panel_size, count, TMB_value) for suffix, count, TMB_value in panel_results]
+    if args.sweep_out is not None:
+        write_sweep(args.sweep_out, suffix_list, sweep_grid(args), sweep_counts, panels)
+    return results
+
+
+def process_streaming(args, header, suffix_list, outputs, term_bits, panel, metrics=None):
+    ### Same as preprocess_vembraneout and process_data, but only one chunk of the TSV is kept in memory
+    ### Plots and sweeps are built from AF histograms and sweep counts summed over the chunks
+    interval_index, panels = panel
+
+    contig_codes = {}
+    last_keys = {}
+    filtering_rates_total = [0, 0, 0]
+    filtering_rates_roi = np.zeros(len(panels), dtype=np.int64)
+    ### Cascade counts for all mutations and for mutations in the ROI of each panel, as the ROI filter falls back to
+    ### all mutations if none of them is located in the ROI, which is only known after the last chunk
+    cascade_rates = np.zeros((3, len(suffix_list)), dtype=np.int64)
+    cascade_rates_roi = np.zeros((len(panels), 3, len(suffix_list)), dtype=np.int64)
+    ### The last region of the histograms and sweep counts holds all mutations
+    histograms = {}
+    sweep_counts_roi = np.zeros(
+        (len(panels) + 1, len(suffix_list), *[len(thresholds) for thresholds in sweep_grid(args)]), dtype=np.int64
     )
+    dtypes = tmb_column_dtypes(header.columns, args.population_db)
+    writer = None
+    if args.variants_out is not None:
+        writer = open_variant_writer(args.variants_out, dtypes, suffix_list, args.prefilter_region, panels)
+
+    chunks = iter(read_vembraneout(args.file_in, header, args.population_db, chunksize=args.chunksize))
+    while True:
+        started = time.perf_counter()
+        TMB_chunk = next(chunks, None)
+        if TMB_chunk is None:
+            break
+        record_stage(metrics, "load", started, len(TMB_chunk.index), len(TMB_chunk.index))
+        selected, filtering_rates = preprocess_chunk(
+            TMB_chunk,
+            args.filter_muttype,
+            args.filter_consequence,
+            args.csq_values,
+            term_bits,
+            contig_codes,
+            last_keys,
+            metrics,
+        )
+        filtering_rates_total = [total + rate for total, rate in zip(filtering_rates_total, filtering_rates)]
+        rows = np.flatnonzero(selected)
+        if len(rows) == 0:
+            continue
+
+        started = time.perf_counter()
+        in_roi = np.ones((len(rows), len(panels)), dtype=bool)
+        if args.prefilter_region == True:
+            panel_bits = query_interval_index(interval_index, TMB_chunk["CHROM"].iloc[rows], TMB_chunk["POS"].to_numpy()[rows])
+            in_roi = panel_membership(panel_bits, panels)
+            filtering_rates_roi += in_roi.sum(axis=0)
+        record_stage(metrics, "roi_filter", started, len(rows), int(in_roi.any(axis=1).sum()))
+
+        started = time.perf_counter()
+        read_depths, allele_fractions, popfreqs = cascade_arrays(TMB_chunk, rows, suffix_list, args.population_db)
+        TMB_covfilt, TMB_affilt, TMB_popfilt = filter_cascade(
+            read_depths, allele_fractions, popfreqs, args.min_cov, args.min_AF, args.max_AF, args.popfreq_max
+        )
+        record_stage(metrics, "cov_af_popfreq_filter", started, len(rows), int(TMB_popfilt.any(axis=1).sum()))
+        for index, mask in enumerate([TMB_covfilt, TMB_affilt, TMB_popfilt]):
+            cascade_rates[index] += mask.sum(axis=0)
+            ### (panels x mutations) @ (mutations x samples) counts the passing mutations in each ROI
+            cascade_rates_roi[:, index] += in_roi.T.astype(np.int64) @ mask.astype(np.int64)
+        if writer is not None:
+            write_variants(
+                writer, TMB_chunk, rows, dtypes, in_roi if args.prefilter_region == True else None, TMB_popfilt, suffix_list, panels
+            )
+
+        regions = np.column_stack([in_roi, np.ones(len(rows), dtype=bool)])
+        if args.plot != "none":
+            add_histograms(histograms, af_histograms(plot_frame(TMB_chunk, rows, suffix_list), TMB_covfilt, regions, suffix_list))
+        if args.sweep_out is not None:
+            for region, is_in_region in enumerate(regions.T):
+                sweep_counts_roi[region] += sweep_thresholds(
+                    read_depths[is_in_region], allele_fractions[is_in_region], popfreqs[is_in_region], *sweep_grid(args)
+                )
+
+    if writer is not None:
+        writer.close()
+
+    results = []
+    sweep_counts = []
+    for index, (panel_name, _, panel_size) in enumerate(panels):
+        if args.prefilter_region == True and filtering_rates_roi[index] > 0:
+            is_notempty = True
+            panel_cascade_rates = cascade_rates_roi[index]
+            region = index
+        else:
+            is_notempty = not args.prefilter_region
+            panel_cascade_rates = cascade_rates
+            region = len(panels)
+            if args.prefilter_region == True:
+                filtering_rates_roi[index] = filtering_rates_total[2]
+
+        if args.sweep_out is not None:
+            sweep_counts.append(sweep_counts_roi[region])
+
+        started = time.perf_counter()
+        panel_results = report_samples(
+            args,
+            suffix_list,
+            outputs[index],
+            filtering_rates_total + [filtering_rates_roi[index]],
+            list(panel_cascade_rates),
+            panel_histograms(histograms, region),
+            panel_size,
+            is_notempty,
+        )
+        panel_rows = int(filtering_rates_roi[index]) if args.prefilter_region == True else filtering_rates_total[2]
+        record_stage(metrics, "plot_and_report", started, panel_rows, panel_rows)
+        results += [(suffix, panel_name, panel_size, count, TMB_value) for suffix, count, TMB_value in panel_results]
+    if args.sweep_out is not None:
+        write_sweep(args.sweep_out, suffix_list, sweep_grid(args), sweep_counts, panels)
+    return results
+
+
+def panel_histograms(histograms, region):
+    ### AF histograms of af_histograms restricted to one region, None without plots
+    if histograms is None:
+        return None
+    return {consequence: counts[:, region] for consequence, counts in histograms.items()}
+
+
+def report_samples(args, suffix_list, outputs, filtering_rates_total, cascade_rates, histograms, panel_size, is_notempty):
+    ### Plot and write the TMB report of each sample, cascade_rates holds the coverage, AF and popfreq counts per sample
+    ### and histograms the AF histograms of the panel per consequence
+    ### Returns the mutation count and TMB of each sample
+    filtering_rates_cov, filtering_rates_af, filtering_rates_popfreq = cascade_rates
+    results = []
+    for index, (suffix, (output_file, output_plot)) in enumerate(zip(suffix_list, outputs)):
+        allele_fraction = f"allele_fraction{suffix}"
+        TMB_value = calculate_TMB(
+            filtering_rates_popfreq[index], panel_size
+        )
+        if args.plot != "none":
+            plot_function = plot_TMB if args.plot == "png" else histogram_TMB
+            plot_function(
+                {consequence: counts[index] for consequence, counts in histograms.items() if counts[index].any()},
+                output_plot,
+                allele_fraction,
+                args.min_AF,
+                args.max_AF,
+            )
+
+        filtering_rates_sample = filtering_rates_total + [
+            filtering_rates_cov[index],
+            filtering_rates_af[index],
+            filtering_rates_popfreq[index],
+        ]
+
+        write_output(
+            output_file,
+            filtering_rates_sample,
+            args.prefilter_region,
+            args.min_cov,
+            args.min_AF,
+            args.max_AF,
+            args.population_db,
+            args.popfreq_max,
+            TMB_value,
+            panel_size,
+            is_notempty,
+        )
+        results.append((suffix, filtering_rates_popfreq[index], TMB_value))
+    return results
 
 def write_output(
     output_file, filtering_rates, prefilter_region, min_cov, min_AF, max_AF, population_db, popfreq_max, TMB_value, panel_size, is_notempty
@@ -415,31 +1207,34 @@ def write_output(
             f"TMB value,{TMB_value}/Mbp,Panelsize_in_bp_{panel_size}"
         )
 
-def plot_TMB(input, output_plotname, allele_fraction, lower_af, higher_af):
-    ### Preprocess for plotting
-    counts_consequence = input.groupby(
-        input.columns.tolist(), as_index=False, dropna=False
-    ).size()
-    index_filter = (
-        counts_consequence.groupby("Mut_ID")["size"]
-        .transform("max")
-        .ne(counts_consequence["size"])
-    )
-    most_prevalent_con = counts_consequence[~index_filter.values]
-    TMB_forplot = (
-        pd.DataFrame(
-            {
-                "Mut_ID": most_prevalent_con["Mut_ID"],
-                "CSQ_Consequence": most_prevalent_con["CSQ_Consequence"],
-            }
-        )
-        .merge(input)
-        .drop_duplicates()
-    )
-    TMB_forplot["CSQ_Consequence"] = (
-        TMB_forplot["CSQ_Consequence"].str.split("&").str[0]
+def histogram_TMB(histogram, output_plotname, allele_fraction, lower_af, higher_af):
+    ### Binned AF distribution per consequence with the bins of the PNG plot, for rendering e.g. in MultiQC
+    histogram = {
+        "allele_fraction": allele_fraction,
+        "min_AF": lower_af,
+        "max_AF": higher_af,
+        "bin_edges": AF_BIN_EDGES.round(2).tolist(),
+        "counts": {consequence: histogram[consequence][:-1].tolist() for consequence in sorted(histogram)},
+    }
+    with open(Path(output_plotname).with_suffix(".histogram.json"), "w") as file:
+        json.dump(histogram, file, indent=2)
+
+
+def plot_TMB(histogram, output_plotname, allele_fraction, lower_af, higher_af):
+    ### Plotting libraries are only imported when a PNG is requested, as they dominate the startup time
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    ### One row per consequence and bin, weighted by the number of mutations
+    consequences = sorted(histogram)
+    bin_centers = (AF_BIN_EDGES[:-1] + AF_BIN_EDGES[1:]) / 2
+    TMB_forplot = pd.DataFrame(
+        {
+            allele_fraction: np.tile(bin_centers, len(consequences)),
+            "CSQ_Consequence": np.repeat(np.array(consequences, dtype=object), len(bin_centers)),
+            "mutations": np.concatenate([histogram[consequence][:-1] for consequence in consequences] or [[]]),
+        }
     )
-    TMB_forplot = TMB_forplot.drop_duplicates("Mut_ID", keep="first")
 
     ### Draw the plot
     fig, ax = plt.subplots(figsize=(14, 8))
@@ -449,11 +1244,13 @@ def plot_TMB(input, output_plotname, allele_fraction, lower_af, higher_af):
         ax=ax,
         stat="count",
         multiple="stack",
-        binwidth=0.01,
+        bins=AF_BIN_EDGES.tolist(),
         x=allele_fraction,
+        weights="mutations",
         kde=False,
         palette="colorblind",
         hue="CSQ_Consequence",
+        hue_order=consequences,
         element="bars",
     )
 
@@ -468,14 +1265,276 @@ def plot_TMB(input, output_plotname, allele_fraction, lower_af, higher_af):
     plt.xticks(np.arange(0, 1.1, 0.1))
     ax.yaxis.get_major_locator().set_params(integer=True)  ## force integers on y-axis
     plt.savefig(output_plotname, bbox_inches="tight")
+    plt.close(fig)
+
+
+def file_digest(file_in):
+    ### SHA-256 of the file content, read in blocks of 1 MiB
+    digest = hashlib.sha256()
+    with open(file_in, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def panel_digest(interval_index, panels):
+    ### SHA-256 of the segments of all contigs and the name, bit and size of each panel
+    digest = hashlib.sha256()
+    for contig in sorted(interval_index):
+        digest.update(contig.encode())
+        for array in interval_index[contig]:
+            digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(json.dumps(panels).encode())
+    return digest.hexdigest()
+
+
+def cache_key(args, panel, term_bits):
+    """
+    Content-addressed key of the TMB results: the TSV content, the panel segments and all parameters changing
+    the reports, plots or sweep. Output names, --streaming and --chunksize do not change the results.
+    """
+    parameters = {
+        "version": CACHE_VERSION,
+        "tsv": file_digest(args.file_in),
+        "panel": panel_digest(*panel),
+        "term_bits": sorted(term_bits.items()),
+        "plot": args.plot,
+        "sweep": sweep_grid(args) if args.sweep_out is not None else None,
+    }
+    for name in ["min_AF", "max_AF", "min_cov", "popfreq_max", "filter_muttype", "filter_consequence", "csq_values", "population_db", "prefilter_region"]:
+        parameters[name] = getattr(args, name)
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def cached_files(args, outputs):
+    ### Cache file name and output path of every report, plot and sweep file of the calculation
+    files = {}
+    for panel_index, panel_outputs in enumerate(outputs):
+        for sample_index, (output_file, output_plot) in enumerate(panel_outputs):
+            files[f"report_{panel_index}_{sample_index}.csv"] = Path(output_file)
+            if args.plot == "png":
+                files[f"plot_{panel_index}_{sample_index}.png"] = Path(output_plot)
+            elif args.plot == "json":
+                files[f"plot_{panel_index}_{sample_index}.histogram.json"] = Path(output_plot).with_suffix(".histogram.json")
+    if args.sweep_out is not None:
+        files["sweep.csv"] = args.sweep_out
+    return files
+
+
+def read_cache(cache_dir, key, files):
+    """
+    Restore the outputs of a cache entry to their output paths and return the cached results, None if the key
+    is not cached. The modification time of a hit is updated, so that eviction removes least recently used entries.
+    """
+    entry = cache_dir / key
+    if not all((entry / cache_name).is_file() for cache_name in ["results.json", *files]):
+        return None
+    with open(entry / "results.json", "r") as file:
+        results = [tuple(result) for result in json.load(file)]
+    for cache_name, output_path in files.items():
+        shutil.copyfile(entry / cache_name, output_path)
+    os.utime(entry)
+    return results
+
+
+def write_cache(cache_dir, key, files, results, cache_max_mb):
+    ### Entries are written to a temporary directory and renamed, so concurrent writers never expose partial entries
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=cache_dir, prefix=".tmp_"))
+    for cache_name, output_path in files.items():
+        shutil.copyfile(output_path, staging / cache_name)
+    with open(staging / "results.json", "w") as file:
+        json.dump([[suffix, panel_name, int(panel_size), int(count), float(TMB_value)] for suffix, panel_name, panel_size, count, TMB_value in results], file)
+    try:
+        os.rename(staging, cache_dir / key)
+    except OSError:
+        ### Another process cached the same key in the meantime
+        shutil.rmtree(staging, ignore_errors=True)
+    evict_cache(cache_dir, cache_max_mb)
+
+
+def evict_cache(cache_dir, cache_max_mb):
+    ### Remove the least recently used entries until the cache fits into cache_max_mb
+    entries = []
+    for entry in cache_dir.iterdir():
+        if entry.name.startswith(".tmp_") or not entry.is_dir():
+            continue
+        try:
+            size = sum(file.stat().st_size for file in entry.iterdir())
+            entries.append((entry.stat().st_mtime, size, entry))
+        except FileNotFoundError:
+            ### Evicted by another process in the meantime
+            continue
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total_size <= cache_max_mb * 2**20:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+        logger.info(f"Evicted cache entry {entry.name}.")
+
+
+def process_sample(args, panel, term_bits):
+    """
+    Calculate the TMB of all samples of one vembrane TSV file.
+    Returns the mutation count and TMB of each sample and the stage metrics, if --metrics_json is given.
+    """
+    if not args.file_in.is_file():
+        logger.error(f"The given input file {args.file_in} was not found!")
+        return ([], None)
+    metrics = {} if args.metrics_json is not None else None
+
+    # Check if the input is a single-sample or multi-sample TSV report based on the header only
+    header = read_header(args.file_in)
+    is_multi, suffix_list = multisample_check(header)
+    outputs = sample_outputs(args, is_multi, suffix_list, panel[1])
+
+    # Results of a previous calculation with the same TSV, panel and parameters are restored from the cache
+    use_cache = args.cache_dir is not None and args.variants_out is None
+    if use_cache:
+        started = time.perf_counter()
+        key = cache_key(args, panel, term_bits)
+        files = cached_files(args, outputs)
+        results = read_cache(args.cache_dir, key, files)
+        record_stage(metrics, "cache_lookup", started, 0, 0 if results is None else len(results))
+        if results is not None:
+            logger.info(f"Restored the TMB results of {args.file_in} from cache entry {key}.")
+            return (results, metrics)
+
+    # In-memory mode reads the TSV report only once, it is shared by all samples
+    if args.streaming:
+        results = process_streaming(args, header, suffix_list, outputs, term_bits, panel, metrics)
+    else:
+        started = time.perf_counter()
+        TMB_inputfile = read_vembraneout(args.file_in, header, args.population_db)
+        record_stage(metrics, "load", started, len(TMB_inputfile.index), len(TMB_inputfile.index))
+        selected, filtering_rates_total = preprocess_vembraneout(
+            TMB_inputfile, args.filter_muttype, args.filter_consequence, args.csq_values, term_bits, metrics
+        )
+        results = process_data(
+            args, TMB_inputfile, selected, filtering_rates_total, args.prefilter_region, suffix_list, outputs, panel, metrics
+        )
+    if use_cache:
+        write_cache(args.cache_dir, key, files, results, args.cache_max_mb)
+    return (results, metrics)
+
+
+def record_stage(metrics, stage, started, rows_in, rows_out):
+    ### Add the wall time and rows of a stage, the stages of all chunks add up in streaming mode
+    if metrics is None:
+        return
+    stage_metrics = metrics.setdefault(stage, {"wall_time_s": 0.0, "rows_in": 0, "rows_out": 0})
+    stage_metrics["wall_time_s"] += time.perf_counter() - started
+    stage_metrics["rows_in"] += rows_in
+    stage_metrics["rows_out"] += rows_out
+    ### ru_maxrss is the peak RSS of the process so far in KiB (Linux)
+    stage_metrics["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def write_metrics(metrics_json, sample_metrics):
+    ### MultiQC custom content table with one row per TSV file, rows and per-stage peak RSS are hidden by default
+    data = {}
+    headers = {}
+    for sample, metrics in sample_metrics.items():
+        data[sample] = {}
+        for stage, stage_metrics in metrics.items():
+            data[sample][f"{stage}_time"] = round(stage_metrics["wall_time_s"], 3)
+            data[sample][f"{stage}_rows_in"] = stage_metrics["rows_in"]
+            data[sample][f"{stage}_rows_out"] = stage_metrics["rows_out"]
+            data[sample][f"{stage}_peak_rss"] = stage_metrics["peak_rss_mb"]
+            headers[f"{stage}_time"] = {"title": f"{stage} [s]", "description": f"Wall time of the {stage} stage", "format": "{:,.3f}"}
+            headers[f"{stage}_rows_in"] = {"title": f"{stage} rows in", "description": f"Rows entering the {stage} stage", "format": "{:,.0f}", "hidden": True}
+            headers[f"{stage}_rows_out"] = {"title": f"{stage} rows out", "description": f"Rows leaving the {stage} stage", "format": "{:,.0f}", "hidden": True}
+            headers[f"{stage}_peak_rss"] = {"title": f"{stage} RSS [MB]", "description": f"Peak RSS after the {stage} stage", "format": "{:,.1f}", "hidden": True}
+        data[sample]["peak_rss"] = max(stage_metrics["peak_rss_mb"] for stage_metrics in metrics.values())
+    headers["peak_rss"] = {"title": "Peak RSS [MB]", "description": "Peak resident memory of the TMB calculation", "format": "{:,.1f}"}
+    content = {
+        "id": "tmb_stage_metrics",
+        "section_name": "TMB calculation stages",
+        "description": "Wall time, rows and peak memory of each stage of the TMB calculation.",
+        "plot_type": "table",
+        "pconfig": {"id": "tmb_stage_metrics_table", "title": "TMB calculation stages"},
+        "headers": headers,
+        "data": data,
+    }
+    with open(metrics_json, "w") as file:
+        json.dump(content, file, indent=2)
+
+
+### Panel and consequence bits shared by all samples of a cohort, set once in each worker process
+cohort_state = {}
+
+
+def init_cohort_worker(panel, term_bits, panel_file=None):
+    ### A compiled panel is memory-mapped by each worker, as its arrays would be copied into the worker when pickled
+    if panel_file is not None:
+        panel = (load_compiled_panel(panel_file)[0], panel[1])
+    cohort_state["panel"] = panel
+    cohort_state["term_bits"] = term_bits
+
+
+def process_cohort_sample(args):
+    ### Peak RSS of a worker covers all samples processed by it so far
+    return process_sample(args, cohort_state["panel"], cohort_state["term_bits"])
+
+
+def process_cohort(args, panel, term_bits):
+    """
+    Calculate the TMB of all vembrane TSV files of the manifest in a process pool.
+    The panel is loaded once and handed to each worker on startup, a compiled panel is only handed over by its path
+    and memory-mapped by the worker. Per-sample outputs are written to --outdir and the TMB of all samples is
+    combined into the --cohort_out table.
+    """
+    manifest = pd.read_csv(args.manifest, dtype=str)
+    sample_args = []
+    for sample, file_in in zip(manifest["sample"], manifest["file_in"]):
+        sample_arg = argparse.Namespace(**vars(args))
+        sample_arg.file_in = Path(file_in)
+        sample_arg.file_out = args.outdir / f"{sample}.csv"
+        sample_arg.plot_out = args.outdir / f"{sample}.png"
+        sample_arg.sampleindex = sample
+        if args.variants_out is not None:
+            sample_arg.variants_out = args.outdir / f"{sample}.parquet"
+        sample_args.append(sample_arg)
+
+    panel_file = compiled_panel_file(args)
+    if panel_file is not None:
+        initargs = ((None, panel[1]), term_bits, panel_file)
+    else:
+        initargs = (panel, term_bits, None)
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_cohort_worker, initargs=initargs) as executor:
+        results = list(executor.map(process_cohort_sample, sample_args))
+
+    if args.metrics_json is not None:
+        write_metrics(
+            args.metrics_json,
+            {sample: metrics for sample, (_, metrics) in zip(manifest["sample"], results) if metrics is not None},
+        )
+
+    cohort = pd.DataFrame(
+        [
+            (sample, suffix.strip("[]"), panel_name, mutation_count, panel_size, TMB_value)
+            for sample, (sample_results, _) in zip(manifest["sample"], results)
+            for suffix, panel_name, panel_size, mutation_count, TMB_value in sample_results
+        ],
+        columns=["sample", "vcf_sample", "panel", "mutations", "panel_size", "TMB"],
+    )
+    ### The panel column is only written if several panels are calculated
+    if all(panel_name is None for panel_name, _, _ in panel[1]):
+        cohort = cohort.drop(columns="panel")
+    cohort.to_csv(args.cohort_out, index=False)
 
 
 def main(argv=None):
     ### Parse arguments
     args = parse_args(argv)
 
-    if not args.file_in.is_file():
-        logger.error(f"The given input file {args.file_in} was not found!")
+    if args.manifest is None and args.file_in is None:
+        logger.error("Either --file_in or --manifest has to be given!")
+        return
+    if args.manifest is not None and not args.manifest.is_file():
+        logger.error(f"The given manifest {args.manifest} was not found!")
         return
 
     # Set default parameters if they are None
@@ -483,14 +1542,19 @@ def main(argv=None):
     args.min_AF = args.min_AF or 0.00
     args.panelsize_threshold = args.panelsize_threshold or 0
 
-    # Check if the input is a single-sample or multi-sample TSV report
-    is_multi, suffix_list = multisample_check(args.file_in)
+    # The panel and consequence bits are shared by all samples
+    interval_index, panels = load_panel(args)
+    if not panels:
+        return
+    term_bits = consequence_term_bits(args.csq_terms, args.csq_values)
 
-    # Split workflow based on single or multi-sample TSV
-    if not is_multi:
-        process_single_sample(args, suffix_list[0])
+    if args.manifest is not None:
+        process_cohort(args, (interval_index, panels), term_bits)
     else:
-        process_multi_sample(args, suffix_list)
+        _, metrics = process_sample(args, (interval_index, panels), term_bits)
+        if metrics is not None:
+            write_metrics(args.metrics_json, {args.sampleindex or args.file_in.stem: metrics})
+
 
 if __name__ == "__main__":
     sys.exit(main())
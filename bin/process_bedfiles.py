@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import pandas as pd
+import numpy as np
 from pathlib import Path
+import hashlib
 import sys
 import argparse
 import logging
@@ -85,6 +87,18 @@ def parse_args(argv=None):
         type=Path,
         help="Filename after minimization"
     )
+    parser.add_argument(
+        "--panel_out",
+        metavar="PANEL_OUT",
+        type=Path,
+        help="Optional compiled panel (.npz) containing the merged intervals, panel size and content hash for calculate_TMB.py",
+    )
+    parser.add_argument(
+        "--panel_column",
+        metavar="PANEL_COLUMN",
+        type=int,
+        help="1-based column holding the panel name of each interval. The compiled panel then stores the intervals of all panels as segments with a panel bitmask.",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -160,6 +174,115 @@ def select_minimal(bed_input):
     return(minimal_bed)
 
 
+def merge_intervals(starts, ends):
+    ### Merge intervals sorted by start into non-overlapping intervals
+    is_new = np.ones(len(starts), dtype=bool)
+    ### An interval starts a new merged interval if it begins after all previous intervals ended
+    is_new[1:] = starts[1:] > np.maximum.accumulate(ends)[:-1]
+    block_starts = np.flatnonzero(is_new)
+    return (starts[block_starts], np.maximum.reduceat(ends, block_starts))
+
+
+def segment_panels(panel_intervals):
+    """
+    Merge the BED intervals of each panel on one contig and split the contig into elementary segments at all
+    interval boundaries. calculate_TMB.py builds the interval index of BED files with this function as well.
+    panel_intervals maps the panel bit to the (starts, ends) arrays of its intervals in any order. BED coordinates
+    are 0-based and half-open, the segments keep this convention.
+    Every segment carries a bitmask of the panels covering it (bit i for panel i), segments outside all panels are
+    dropped. A single panel yields its merged intervals.
+    Returns the (starts, ends, masks) of the segments and the number of basepairs covered by each panel.
+    """
+    merged = {}
+    for bit, (starts, ends) in panel_intervals.items():
+        order = np.argsort(starts, kind="stable")
+        merged[bit] = merge_intervals(np.asarray(starts, dtype=np.int64)[order], np.asarray(ends, dtype=np.int64)[order])
+    panel_sizes = {bit: int((ends - starts).sum()) for bit, (starts, ends) in merged.items()}
+    if len(merged) == 1:
+        [(bit, (starts, ends))] = merged.items()
+        return ((starts, ends, np.full(len(starts), 1 << bit, dtype=np.uint64)), panel_sizes)
+    ### Each segment between two consecutive boundaries is either fully covered by a panel or not at all
+    bounds = np.unique(np.concatenate([array for intervals in merged.values() for array in intervals]))
+    masks = np.zeros(len(bounds) - 1, dtype=np.uint64)
+    for bit, (starts, ends) in merged.items():
+        interval = np.searchsorted(starts, bounds[:-1], side="right") - 1
+        is_covered = (interval >= 0) & (bounds[:-1] < ends[np.maximum(interval, 0)])
+        masks |= is_covered.astype(np.uint64) << np.uint64(bit)
+    is_covered = masks != 0
+    return ((bounds[:-1][is_covered], bounds[1:][is_covered], masks[is_covered]), panel_sizes)
+
+
+def compile_panel(bed_input, panel_column=None):
+    """
+    Merge the intervals of each contig into sorted, non-overlapping 0-based half-open intervals.
+    The intervals of contig i are starts[offsets[i]:offsets[i + 1]] and ends[offsets[i]:offsets[i + 1]].
+    The panel size is the number of basepairs covered, the hash identifies the merged intervals independent of
+    the order and formatting of the BED file.
+    With a panel_column, the merged intervals of all panels are split into elementary segments at all interval
+    boundaries. Each segment carries a bitmask of the panels covering it (masks), panel_names and panel_sizes
+    list the panels in bit order and panel_size is the size of their union.
+    """
+    panel_data = select_minimal(bed_input)
+    panel_data.columns = ["Chromosome", "Start", "End"]
+    names, panel_bits = [""], None
+    if panel_column is not None:
+        if panel_column < 4 or panel_column > len(bed_input.columns):
+            raise ValueError(f"The BED file has no panel name column {panel_column}.")
+        panel_names = bed_input.iloc[:, panel_column - 1].astype(str)
+        names = list(dict.fromkeys(panel_names))
+        if len(names) > 64:
+            raise ValueError(f"The BED file defines {len(names)} panels, but at most 64 can be compiled.")
+        panel_bits = panel_names.map({name: bit for bit, name in enumerate(names)})
+
+    contigs, offsets, starts, ends, masks = [], [0], [], [], []
+    panel_sizes = np.zeros(len(names), dtype=np.int64)
+    for contig, intervals in panel_data.groupby(panel_data["Chromosome"].astype(str), sort=True):
+        if panel_column is None:
+            groups = [(0, intervals)]
+        else:
+            groups = intervals.groupby(panel_bits.loc[intervals.index], sort=True)
+        (contig_starts, contig_ends, contig_masks), sizes = segment_panels(
+            {
+                bit: (panel_intervals["Start"].to_numpy(dtype=np.int64), panel_intervals["End"].to_numpy(dtype=np.int64))
+                for bit, panel_intervals in groups
+            }
+        )
+        for bit, size in sizes.items():
+            panel_sizes[bit] += size
+        contigs.append(contig)
+        starts.append(contig_starts)
+        ends.append(contig_ends)
+        masks.append(contig_masks)
+        offsets.append(offsets[-1] + len(contig_starts))
+    panel = {
+        "contigs": np.array(contigs, dtype=str),
+        "offsets": np.array(offsets, dtype=np.int64),
+        "starts": np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64),
+        "ends": np.concatenate(ends) if ends else np.zeros(0, dtype=np.int64),
+    }
+    panel["panel_size"] = np.int64((panel["ends"] - panel["starts"]).sum())
+    hashed_keys = ["contigs", "offsets", "starts", "ends"]
+    ### Panels without names keep the layout read by previous versions of calculate_TMB.py
+    if panel_column is not None:
+        panel["masks"] = np.concatenate(masks) if masks else np.zeros(0, dtype=np.uint64)
+        panel["panel_names"] = np.array(names, dtype=str)
+        panel["panel_sizes"] = panel_sizes
+        hashed_keys += ["masks", "panel_names"]
+    panel_hash = hashlib.sha256()
+    for key in hashed_keys:
+        panel_hash.update(np.ascontiguousarray(panel[key]).tobytes())
+    panel["sha256"] = np.array(panel_hash.hexdigest())
+    return panel
+
+
+def write_compiled_panel(bed_input, panel_out, panel_column=None):
+    ### Uncompressed archive, so that calculate_TMB.py can memory-map the arrays
+    panel = compile_panel(bed_input, panel_column)
+    with open(panel_out, "wb") as file:
+        np.savez(file, **panel)
+    logger.info(f"Compiled panel covering {panel['panel_size']} basepairs with hash {panel['sha256']}.")
+
+
 def main(argv=None):
     """Coordinate argument parsing and program execution."""
     args = parse_args(argv)
@@ -177,6 +300,8 @@ def main(argv=None):
             minimal_bed = select_minimal(bedfile)
             structured_out.to_csv("bed_stats_structure.txt", header=False, index=False)
             minimal_bed.to_csv(args.file_out, header=False, index=False, sep='\t')
+            if args.panel_out is not None:
+                write_compiled_panel(bedfile, args.panel_out, args.panel_column)
         else:
             raise ValueError(
                 f"The given BED file is not well structured! Please check for floats, strings or thereof in your file!"
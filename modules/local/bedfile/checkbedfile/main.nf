@@ -14,17 +14,21 @@ process CHECKBEDFILE {
     output:
     env  valid_structure						, emit: bed_valid
     path "minimized_*"                          , emit: bedfile_min
+    path "*.panel.npz"                          , emit: panel
     path "versions.yml"							, emit: versions
 
     when:
     task.ext.when == null || task.ext.when
 
     script: // This script is bundled with the pipeline, in cio-abcd/variantinterpretation/bin/
+    def args = task.ext.args ?: ''
     """
     ### Start bedfile integrity check
     process_bedfiles.py \\
         $bedfile \\
-        'minimized_$bedfile'
+        'minimized_$bedfile' \\
+        --panel_out '${bedfile.baseName}.panel.npz' \\
+        $args
 
     ### Emit control boolean that bedfile adheres to standards
     if [ -f "bed_stats_structure.txt" ]; then
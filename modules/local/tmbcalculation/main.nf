@@ -10,10 +10,13 @@ process TMB_CALCULATE {
     input:
     tuple val(meta), path(tsv)
     path bedfile
+    path csq_terms
 
     output:
     tuple val(meta), path("*.csv"), emit: TMB_txt
-    tuple val(meta), path("*.png"), emit: TMB_png
+    tuple val(meta), path("*.png"), emit: TMB_png, optional: true
+    tuple val(meta), path("*.histogram.json"), emit: TMB_json, optional: true
+    tuple val(meta), path("*_mqc.json"), emit: metrics
     path "versions.yml"           , emit: versions
 
     when:
@@ -27,10 +30,13 @@ process TMB_CALCULATE {
     # Calculate TMB
     calculate_TMB.py \\
         --file_in $tsv \\
+        --sampleindex $meta.id \\
         --bedfile $bedfile \\
+        --csq_terms $csq_terms \\
         $args \\
         --file_out ${prefix}.csv \\
-        --plot_out ${prefix}.png
+        --plot_out ${prefix}.png \\
+        --metrics_json ${prefix}_tmb_mqc.json
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
@@ -0,0 +1,50 @@
+process TMB_CALCULATE_COHORT {
+    tag "cohort"
+    label 'process_medium'
+
+    conda "conda-forge::python=3.8.3 conda-forge::pandas=2.0.3 conda-forge::numpy=1.25.1 conda-forge::matplotlib=3.6.3 conda-forge::seaborn=0.12.2 conda-forge::pyranges=0.0.117"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/mulled-v2-371b28410c3e53c7f9010677515b1b0eb3764999:0267f53936b6c04b051e07833c218f1fdd2a7cac-0' :
+        'biocontainers/mulled-v2-371b28410c3e53c7f9010677515b1b0eb3764999:0267f53936b6c04b051e07833c218f1fdd2a7cac-0' }"
+
+    input:
+    tuple val(samples), path(tsvs)
+    path bedfile
+    path csq_terms
+
+    output:
+    path "tmb/*.csv"              , emit: TMB_txt
+    path "tmb/*.png"              , emit: TMB_png, optional: true
+    path "tmb/*.histogram.json"   , emit: TMB_json, optional: true
+    path "cohort_TMB.csv"         , emit: cohort
+    path "cohort_tmb_mqc.json"    , emit: metrics
+    path "versions.yml"           , emit: versions
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    def tsv_list = tsvs instanceof List ? tsvs : [tsvs]
+    def manifest = [samples, tsv_list].transpose().collect { sample, tsv -> "'${sample},${tsv}'" }.join(' ')
+
+    """
+    printf '%s\\n' 'sample,file_in' ${manifest} > manifest.csv
+
+    # Calculate TMB of all samples
+    calculate_TMB.py \\
+        --manifest manifest.csv \\
+        --bedfile $bedfile \\
+        --csq_terms $csq_terms \\
+        $args \\
+        --workers $task.cpus \\
+        --outdir tmb \\
+        --cohort_out cohort_TMB.csv \\
+        --metrics_json cohort_tmb_mqc.json
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+    END_VERSIONS
+    """
+}
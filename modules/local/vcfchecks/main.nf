@@ -7,10 +7,15 @@ process VCFCHECKS {
         'biocontainers/mulled-v2-0594c09780adaaa41fe60b1869ba41c8905a0c98:24a8102d6795963b77f04bb83cc82c081e4a2adc-0' }"
 
     input:
-    tuple val(meta), path(vcf), path (stats)
+    tuple val(meta), path(vcf), path(tbi), path (stats)
+    tuple val(meta2), path(fasta)
+    tuple val(meta3), path(fai)
 
     output:
     path("*_warnings.txt") , emit: warnings
+    path("*_stats.txt")    , emit: stats, optional: true
+    path("*_results.json") , emit: results
+    path("*_mqc.json")     , emit: metrics
 
     when:
     task.ext.when == null || task.ext.when
@@ -18,13 +23,20 @@ process VCFCHECKS {
     script:
     def args = task.ext.args ?: ''
     def prefix = task.ext.prefix ?: "${meta.id}"
+    // count variant classes from the VCF records if no bcftools stats file is provided
+    def stats_args = stats ? "--bcftools_stats_in $stats" : "--stats_out ${prefix}_stats.txt"
 
     """
     check_vcf.py \\
         --meta_id $meta.id \\
         --vcf_in $vcf \\
-        --bcftools_stats_in $stats \\
+        --tbi_in $tbi \\
+        --fasta_in $fasta \\
+        --fai_in $fai \\
+        $stats_args \\
         --warnings_out ${prefix}_warnings.txt \\
+        --results_out ${prefix}_results.json \\
+        --metrics_json ${prefix}_vcfchecks_mqc.json \\
         $args
     """
 }
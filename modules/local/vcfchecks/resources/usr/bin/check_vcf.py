@@ -1,10 +1,131 @@
 #!/usr/bin/env python
 
-import pandas as pd
 import re
 import argparse
+import csv
 import gzip
-from itertools import chain
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, takewhile
+
+# ALT alleles without an alternative sequence, e.g. reference blocks of gVCF files
+NOALT_ALLELES = {".", "<*>", "<NON_REF>", "<X>"}
+
+# summary counts and their keys in the SN section of bcftools stats
+STATS_KEYS = [
+    ("records", "number of records:"),
+    ("noalts", "number of no-ALTs:"),
+    ("snps", "number of SNPs:"),
+    ("mnps", "number of MNPs:"),
+    ("indels", "number of indels:"),
+    ("others", "number of others:"),
+    ("multiallelic", "number of multiallelic sites:"),
+    ("multiallelic_snps", "number of multiallelic SNP sites:"),
+]
+
+# bin number of the tabix pseudo-bin holding per contig metadata instead of file offsets
+TBI_PSEUDO_BIN = 37450
+
+# number of windows spread over the VCF file in sampling mode
+SAMPLE_WINDOWS = 64
+
+# gzip magic bytes with the FEXTRA flag set, which start every BGZF block
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+# checks that depend on the VCF records, with the summary condition that settles their outcome
+RECORD_CHECKS = {
+    "check_chr_prefix": lambda summary: any(not c.startswith("chr") for c in summary["contigs"]),
+    "check_vep_annotation": lambda summary: summary["csq_records"] > 0,
+    "check_FILTERs": lambda summary: any(
+        f not in ("PASS", ".") for filtervalue in summary["filters"] for f in filtervalue.split(";")
+    ),
+    "check_MNPs": lambda summary: summary["mnps"] > 0,
+    "check_gVCF": lambda summary: summary["noalts"] > 0,
+    "check_other_variants": lambda summary: summary["others"] > 0,
+    "check_multiallelic_sites": lambda summary: summary["multiallelic"] > 0,
+    "check_reference": lambda summary: summary["ref_mismatches"] > 0
+    or len(summary["unknown_contigs"]) > 0
+    or summary["out_of_range"] > 0
+    or summary["unsorted"] > 0,
+}
+
+# number of example records reported for REF alleles that do not match the reference genome
+REF_MISMATCH_EXAMPLES = 3
+
+# number of example values, e.g. contigs or FILTER values, reported in check results
+RESULT_EXAMPLES = 5
+
+# number of decompressed BGZF blocks of a bgzip compressed reference genome kept in memory
+REFERENCE_CACHED_BLOCKS = 4
+
+# checks that use the bcftools stats file instead of the VCF records if given
+STATS_CHECKS = ["check_MNPs", "check_gVCF", "check_other_variants", "check_multiallelic_sites"]
+
+
+def stats_float(value):
+    """
+    Convert a floating point value of a bcftools stats file, which may be missing (".").
+    """
+    return None if value == "." else float(value)
+
+
+# sections of the bcftools stats file that are indexed, with name and type of the columns after the set id.
+# Columns of newer bcftools versions that are not listed here are ignored, missing columns of older versions are left out.
+STATS_SECTIONS = {
+    "SN": [("key", str), ("value", int)],
+    "TSTV": [
+        ("ts", int),
+        ("tv", int),
+        ("ts_tv", stats_float),
+        ("ts_1st_alt", int),
+        ("tv_1st_alt", int),
+        ("ts_tv_1st_alt", stats_float),
+    ],
+    "SiS": [
+        ("allele_count", int),
+        ("snps", int),
+        ("transitions", int),
+        ("transversions", int),
+        ("indels", int),
+        ("repeat_consistent", int),
+        ("repeat_inconsistent", int),
+        ("not_applicable", int),
+    ],
+    "AF": [
+        ("allele_frequency", stats_float),
+        ("snps", int),
+        ("transitions", int),
+        ("transversions", int),
+        ("indels", int),
+        ("repeat_consistent", int),
+        ("repeat_inconsistent", int),
+        ("not_applicable", int),
+    ],
+    "QUAL": [
+        ("quality", stats_float),
+        ("snps", int),
+        ("transitions_1st_alt", int),
+        ("transversions_1st_alt", int),
+        ("indels", int),
+    ],
+    "IDD": [("length", int), ("sites", int), ("genotypes", int), ("mean_vaf", stats_float)],
+    "ST": [("type", str), ("count", int)],
+    # the last depth bin is open-ended, e.g. ">500", and therefore kept as string
+    "DP": [
+        ("bin", str),
+        ("genotypes", int),
+        ("genotypes_fraction", stats_float),
+        ("sites", int),
+        ("sites_fraction", stats_float),
+    ],
+}
 
 
 def parse_arguments():
@@ -21,14 +142,68 @@ def parse_arguments():
     )
     parser.add_argument(
         "--bcftools_stats_in",
-        help="bcftools stats file.",
+        help="bcftools stats file. If not given, variant classes are counted from the VCF records.",
+        type=str,
+    )
+    parser.add_argument(
+        "--stats_out",
+        help="name of .txt file to save the summary numbers of the VCF records in bcftools stats format.",
+        type=str,
+    )
+    parser.add_argument(
+        "--tbi_in",
+        help="tabix index of the bgzip compressed VCF file. Used to check contigs in parallel if --workers is larger than 1.",
         type=str,
     )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes checking contigs of the VCF file in parallel.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--max_records",
+        help="Sampling mode: only check this number of records, read in windows spread over the VCF file.",
+        type=int,
+    )
+    parser.add_argument(
+        "--max_bytes",
+        help="Sampling mode: only check records of this number of uncompressed bytes, read in windows spread over the VCF file.",
+        type=int,
+    )
     parser.add_argument(
         "--warnings_out",
         help="name of .txt file to save warnings.",
         type=str,
     )
+    parser.add_argument(
+        "--results_out",
+        help="name of .json file to save the results of all checks with severity, counts, examples, elapsed time and scanned records.",
+        type=str,
+    )
+    parser.add_argument(
+        "--metrics_json",
+        help="name of .json file to save the elapsed time of each check and of reading the VCF and stats files as MultiQC custom content.",
+        type=str,
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Batch mode: CSV file with the columns meta_id, vcf_in, tbi_in and bcftools_stats_in (the last two may be empty). "
+        "All samples are checked in a pool of --workers processes instead of the single --vcf_in.",
+        type=str,
+    )
+    parser.add_argument(
+        "--outdir",
+        help="Batch mode: directory of the per-sample warnings, check results and variant class counts.",
+        type=str,
+        default=".",
+    )
+    parser.add_argument(
+        "--batch_warnings_out",
+        help="Batch mode: name of .txt file to save the warnings of all samples.",
+        type=str,
+        default="combined.warnings.txt",
+    )
     parser.add_argument(
         "--check_chr_prefix",
         help='Check if CHROM column always has "chr" prefix.',
@@ -64,254 +239,1377 @@ def parse_arguments():
         help="Check if provided VCF file has multiallelic sites.",
         action="store_true",
     )
+    parser.add_argument(
+        "--check_reference",
+        help="Check REF alleles, contig names and lengths against the reference genome and if records are sorted. Requires --fasta_in and --fai_in.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--fasta_in",
+        help="Uncompressed or bgzip compressed reference genome FASTA file. A samtools .gzi index next to a bgzip compressed file is used if present.",
+        type=str,
+    )
+    parser.add_argument(
+        "--fai_in",
+        help="samtools faidx index of the reference genome FASTA file.",
+        type=str,
+    )
 
     return parser.parse_args()
 
 
-def read_vcf(vcf_in):
-    vcffile = pd.read_csv(vcf_in, sep="\t", comment="#", header=None)
-    if len(vcffile.columns) < 10:
-        raise ValueError(
-            "ERROR: Your VCF file has less than 10 columns and may miss columns."
-        )
-    else:
-        vcffile.columns = [
-            "CHROM",
-            "POS",
-            "ID",
-            "REF",
-            "ALT",
-            "QUAL",
-            "FILTER",
-            "INFO",
-            "FORMAT",
-        ] + ["SAMPLE{}".format(i) for i in range(1, len(vcffile.columns) - 8)]
-    return vcffile
-
-
-def read_vcf_header(vcf_in):
+def open_vcf(vcf_in):
+    """
+    Open a plain or gzip/bgzip compressed VCF file as text.
+    """
+    if vcf_in.endswith(".gz"):
+        return gzip.open(vcf_in, "rt")
+    return open(vcf_in, "rt")
+
+
+def new_summary():
+    """
+    Create an empty summary of VCF records.
+    All entries are either numbers or dictionaries of counts, so summaries of separate parts of a VCF file can be combined with merge_summaries.
+        records: number of records
+        contigs: number of records per CHROM value, in order of appearance
+        csq_records: number of records with a CSQ key in the INFO column
+        filters: number of records per FILTER column value, in order of appearance
+        noalts, snps, mnps, indels, others: number of records per variant class as defined by bcftools stats
+        multiallelic, multiallelic_snps: number of records with more than one ALT allele (and only SNPs)
+    Entries of the reference check, only filled if a reference genome is given:
+        ref_checked, ref_mismatches: number of REF alleles compared to and not matching the reference genome
+        ref_mismatch_examples: descriptions of the first mismatching REF alleles
+        unknown_contigs: number of records per CHROM value that is not a reference genome contig
+        out_of_range: number of records with REF alleles beyond the end of the contig
+        unsorted: number of records with a lower position than the previous record or a contig that occurred before
+        ref_seconds: time spent on comparing records to the reference genome, summed over processes
+    """
+    return {
+        "records": 0,
+        "contigs": {},
+        "csq_records": 0,
+        "filters": {},
+        "noalts": 0,
+        "snps": 0,
+        "mnps": 0,
+        "indels": 0,
+        "others": 0,
+        "multiallelic": 0,
+        "multiallelic_snps": 0,
+        "ref_checked": 0,
+        "ref_mismatches": 0,
+        "ref_mismatch_examples": {},
+        "unknown_contigs": {},
+        "out_of_range": 0,
+        "unsorted": 0,
+        "ref_seconds": 0.0,
+    }
+
+
+def allele_type(ref, alt):
+    """
+    Classify an ALT allele like htslib does for bcftools stats.
+    Single bases are compared case-sensitively, the mpileup allele X is no variant.
+    Otherwise common leading and trailing bases of REF and ALT are trimmed, then the remaining difference is:
+        "snp": a single base, "mnp": several bases of equal length, "indel": bases only in REF or ALT,
+        "other": symbolic alleles, breakends and complex substitutions, "ref": no difference.
+    The spanning deletion allele * is "overlap", which is counted in no variant class.
+    """
+    if alt in NOALT_ALLELES:
+        return "ref"
+    if alt == "*":
+        return "overlap"
+    if alt.startswith("<") or "[" in alt or "]" in alt:
+        return "other"
+    if len(ref) == 1 and len(alt) == 1:
+        return "ref" if alt in (ref, "X") else "snp"
+    ref = ref.upper()
+    alt = alt.upper()
+    if ref == alt:
+        return "ref"
+    # trim common leading bases
+    start = 0
+    shortest = min(len(ref), len(alt))
+    while start < shortest and ref[start] == alt[start]:
+        start += 1
+    if start == shortest:
+        return "indel"
+    # trim common trailing bases, but keep the first differing base
+    ref_end = len(ref) - 1
+    alt_end = len(alt) - 1
+    while ref_end > start and alt_end > start and ref[ref_end] == alt[alt_end]:
+        ref_end -= 1
+        alt_end -= 1
+    if ref_end == start and alt_end == start:
+        return "snp"
+    if ref_end == start or alt_end == start:
+        # one allele is reduced to a single base, which is an anchor base for indels
+        return "indel" if ref[ref_end] == alt[alt_end] else "other"
+    return "mnp" if ref_end == alt_end else "other"
+
+
+def scan_records(lines, summary, reference=None):
+    """
+    Add the VCF records of an iterable of lines to the summary.
+    Only the columns up to INFO are split, the FORMAT and sample columns are kept in one string.
+    If a reference genome opened by open_reference is given, the records are checked against it in the same pass.
+    """
+    contigs = summary["contigs"]
+    filters = summary["filters"]
+    records = 0
+    csq_records = 0
+    counts = {"ref": 0, "snp": 0, "mnp": 0, "indel": 0, "other": 0, "overlap": 0}
+    multiallelic = 0
+    multiallelic_snps = 0
+    if reference is not None:
+        fasta, fai = reference
+        unknown_contigs = summary["unknown_contigs"]
+        examples = summary["ref_mismatch_examples"]
+        ref_checked = 0
+        ref_mismatches = 0
+        out_of_range = 0
+        unsorted = 0
+        last_chrom = None
+        last_pos = 0
+        finished_contigs = set()
+        ref_seconds = 0.0
+    for line in lines:
+        if not line or line == "\n":
+            continue
+        fields = line.split("\t", 8)
+        # FORMAT and at least one sample column are required.
+        if len(fields) < 9 or "\t" not in fields[8]:
+            raise ValueError(
+                "ERROR: Your VCF file has less than 10 columns and may miss columns."
+            )
+        records += 1
+        chrom = fields[0]
+        contigs[chrom] = contigs.get(chrom, 0) + 1
+        filtervalue = fields[6]
+        filters[filtervalue] = filters.get(filtervalue, 0) + 1
+        if "CSQ" in fields[7]:
+            csq_records += 1
+        # count variant classes once per record
+        ref = fields[3]
+        alt = fields[4]
+        if "," not in alt:
+            if len(ref) == 1 and len(alt) == 1 and alt not in (ref, ".", "*", "X"):
+                counts["snp"] += 1
+            else:
+                counts[allele_type(ref, alt)] += 1
+        else:
+            types = {allele_type(ref, a) for a in alt.split(",")}
+            multiallelic += 1
+            # records are only no-ALTs if all ALT alleles are reference alleles, like gVCF <NON_REF> and <*> alleles
+            # do not add a variant type in htslib
+            if len(types) > 1:
+                types.discard("ref")
+            if types == {"snp"}:
+                multiallelic_snps += 1
+            for t in types:
+                counts[t] += 1
+        if reference is not None:
+            ref_started = time.perf_counter()
+            pos = int(fields[1])
+            # positions increase within contigs and all records of a contig follow each other
+            if chrom != last_chrom:
+                if last_chrom is not None:
+                    finished_contigs.add(last_chrom)
+                if chrom in finished_contigs:
+                    unsorted += 1
+                last_chrom = chrom
+            elif pos < last_pos:
+                unsorted += 1
+            last_pos = pos
+            entry = fai.get(chrom)
+            if entry is None:
+                unknown_contigs[chrom] = unknown_contigs.get(chrom, 0) + 1
+            elif pos < 1 or pos + len(ref) - 1 > entry[0]:
+                out_of_range += 1
+            else:
+                ref_checked += 1
+                bases = reference_bases(fasta, entry, pos, len(ref))
+                if bases != ref.upper():
+                    ref_mismatches += 1
+                    if len(examples) < REF_MISMATCH_EXAMPLES:
+                        examples[f"{chrom}:{pos} REF {ref} (reference {bases})"] = 1
+            ref_seconds += time.perf_counter() - ref_started
+    summary["records"] += records
+    summary["csq_records"] += csq_records
+    summary["noalts"] += counts["ref"]
+    summary["snps"] += counts["snp"]
+    summary["mnps"] += counts["mnp"]
+    summary["indels"] += counts["indel"]
+    summary["others"] += counts["other"]
+    summary["multiallelic"] += multiallelic
+    summary["multiallelic_snps"] += multiallelic_snps
+    if reference is not None:
+        summary["ref_checked"] += ref_checked
+        summary["ref_mismatches"] += ref_mismatches
+        summary["out_of_range"] += out_of_range
+        summary["unsorted"] += unsorted
+        summary["ref_seconds"] += ref_seconds
+    return summary
+
+
+def read_fai(fai_in):
+    """
+    Read a samtools faidx index into a dictionary of contig name to (length, offset, bases per line, bytes per line).
+    """
+    fai = {}
+    with open(fai_in, "rt") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 5:
+                fai[fields[0]] = tuple(int(value) for value in fields[1:5])
+    return fai
+
+
+def open_reference(fasta_in, fai_in):
+    """
+    Open a reference genome FASTA file for random access and read its index.
+    Uncompressed files are memory-mapped, bgzip compressed files are read by BGZF blocks, so the sequences are never
+    loaded as a whole. Returns a function reading the bytes between two offsets of the uncompressed file and the index.
+    """
+    if fasta_in is None or fai_in is None:
+        raise ValueError("ERROR: The reference check requires --fasta_in and --fai_in.")
+    if is_bgzf(fasta_in):
+        return bgzf_reader(fasta_in), read_fai(fai_in)
+    with open(fasta_in, "rb") as f:
+        if f.read(2) == BGZF_MAGIC[:2]:
+            raise ValueError(
+                "ERROR: The reference check requires an uncompressed or bgzip compressed FASTA file, "
+                f"but {fasta_in} is only gzip compressed."
+            )
+        fasta = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return (lambda first, last: fasta[first:last]), read_fai(fai_in)
+
+
+def read_bgzf_index(fasta_in):
+    """
+    Read the offsets of the BGZF blocks of a bgzip compressed file from the samtools .gzi index next to it.
+    Without index, the offsets are read from the header and trailer of each block, which give its compressed and
+    uncompressed size, without decompressing the blocks.
+    Returns the uncompressed and compressed offsets of all blocks in file order.
+    """
+    gzi_in = fasta_in + ".gzi"
+    if os.path.exists(gzi_in):
+        with open(gzi_in, "rb") as f:
+            (count,) = struct.unpack("<Q", f.read(8))
+            offsets = struct.unpack(f"<{2 * count}Q", f.read(16 * count))
+        # the index leaves out the first block at offset 0
+        return [0] + list(offsets[1::2]), [0] + list(offsets[0::2])
+    uoffsets, coffsets = [], []
+    uoffset = 0
+    coffset = 0
+    with open(fasta_in, "rb") as f:
+        while True:
+            f.seek(coffset)
+            header = read_bgzf_header(f)
+            if header is None:
+                break
+            block_size, _ = header
+            # the last 4 bytes of a block are its uncompressed size
+            f.seek(coffset + block_size - 4)
+            (isize,) = struct.unpack("<I", f.read(4))
+            uoffsets.append(uoffset)
+            coffsets.append(coffset)
+            uoffset += isize
+            coffset += block_size
+    return uoffsets, coffsets
+
+
+def bgzf_reader(fasta_in):
+    """
+    Random access to the uncompressed bytes of a bgzip compressed file.
+    Returns a function reading the bytes between two offsets of the uncompressed file. The last decompressed blocks
+    are kept, as the records of a sorted VCF file read the reference genome mostly in order.
+    """
+    uoffsets, coffsets = read_bgzf_index(fasta_in)
+    f = open(fasta_in, "rb")
+    blocks = {}
+
+    def block(index):
+        if index not in blocks:
+            if len(blocks) >= REFERENCE_CACHED_BLOCKS:
+                del blocks[next(iter(blocks))]
+            f.seek(coffsets[index])
+            blocks[index] = read_bgzf_block(f)
+        return blocks[index]
+
+    def read(first, last):
+        chunks = []
+        index = bisect_right(uoffsets, first) - 1
+        position = first
+        while position < last and index < len(uoffsets):
+            chunks.append(block(index)[position - uoffsets[index] : last - uoffsets[index]])
+            index += 1
+            if index < len(uoffsets):
+                position = uoffsets[index]
+        return b"".join(chunks)
+
+    return read
+
+
+def reference_bases(fasta, entry, pos, length):
+    """
+    Read the upper case reference bases at a 1-based position of a contig with the reader of open_reference.
+    The file offsets are calculated from the faidx entry of the contig, line breaks are removed.
+    """
+    seqlength, offset, linebases, linewidth = entry
+    start = pos - 1
+    end = min(start + length, seqlength)
+    first = offset + start // linebases * linewidth + start % linebases
+    last = offset + end // linebases * linewidth + end % linebases
+    bases = fasta(first, last)
+    if linewidth != linebases:
+        bases = bases.replace(b"\n", b"").replace(b"\r", b"")
+    return bases.decode().upper()
+
+
+def merge_summaries(summaries):
+    """
+    Combine summaries of separate parts of a VCF file into one summary.
+    Dictionary entries keep the order of appearance, so summaries have to be given in file order.
+    """
+    merged = new_summary()
+    for summary in summaries:
+        for key, value in summary.items():
+            if isinstance(value, dict):
+                counts = merged.setdefault(key, {})
+                for entry, count in value.items():
+                    counts[entry] = counts.get(entry, 0) + count
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def split_header(f):
+    """
+    Read the header of an opened VCF file.
+    Returns the "##" header lines followed by the "#CHROM" column header line and an iterator over the record lines.
+    """
     header = []
+    line = ""
+    for line in f:
+        if line.startswith("##"):
+            header.append(line.strip("\n"))
+        else:
+            break
+    # the first line after the meta-information is the column header line or already a record.
+    if line.startswith("#"):
+        header.append(line.strip("\n"))
+        return header, f
+    return header, chain([line], f)
+
+
+def read_vcf(vcf_in, reference=None):
+    """
+    Read a VCF file in a single streaming pass.
+    Returns the header lines and a summary of all records, so memory use does not depend on the number of records.
+    """
+    summary = new_summary()
+    with open_vcf(vcf_in) as f:
+        header, records = split_header(f)
+        scan_records(records, summary, reference)
+    return header, summary
+
+
+def read_tbi(tbi_in):
+    """
+    Read the range of virtual file offsets of each contig from a tabix index.
+    The index is bgzip compressed, the offsets of all chunks of a contig are combined into one range.
+    Returns a list of (contig, start, end) tuples in file order.
+    """
+    with gzip.open(tbi_in, "rb") as f:
+        data = f.read()
+    magic, n_ref = struct.unpack_from("<4si", data, 0)
+    if magic != b"TBI\x01":
+        raise ValueError(f"ERROR: {tbi_in} is not a tabix index.")
+    # names of the contigs are stored after the configuration, separated by null bytes
+    (l_nm,) = struct.unpack_from("<i", data, 32)
+    names = data[36 : 36 + l_nm].split(b"\x00")[:n_ref]
+    offset = 36 + l_nm
+    ranges = []
+    for name in names:
+        (n_bin,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        starts = []
+        ends = []
+        for _ in range(n_bin):
+            bin_number, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            if bin_number != TBI_PSEUDO_BIN:
+                chunks = struct.unpack_from(f"<{2 * n_chunk}Q", data, offset)
+                starts.append(min(chunks[0::2]))
+                ends.append(max(chunks[1::2]))
+            offset += 16 * n_chunk
+        # skip the linear index
+        (n_intv,) = struct.unpack_from("<i", data, offset)
+        offset += 4 + 8 * n_intv
+        if starts:
+            ranges.append((name.decode(), min(starts), max(ends)))
+    return sorted(ranges, key=lambda r: r[1])
+
+
+def read_bgzf_header(f):
+    """
+    Read the gzip header of the next BGZF block of an opened file.
+    The size of the block is given by the "BC" subfield of the header.
+    Returns the total size of the block and the size of its header, or None at the end of the file.
+    """
+    header = f.read(12)
+    if len(header) < 12:
+        return None
+    (xlen,) = struct.unpack_from("<H", header, 10)
+    extra = f.read(xlen)
+    block_size = None
+    position = 0
+    while position + 4 <= len(extra):
+        si1, si2, slen = struct.unpack_from("<BBH", extra, position)
+        if si1 == 66 and si2 == 67 and slen == 2 and position + 6 <= len(extra):
+            (block_size,) = struct.unpack_from("<H", extra, position + 4)
+        position += 4 + slen
+    if block_size is None:
+        raise ValueError(f"ERROR: {getattr(f, 'name', 'file')} is not bgzip compressed.")
+    return block_size + 1, 12 + xlen
+
+
+def read_bgzf_block(f):
+    """
+    Read and decompress the next BGZF block of an opened file. Returns None at the end of the file.
+    """
+    header = read_bgzf_header(f)
+    if header is None:
+        return None
+    block_size, header_size = header
+    # the remaining block contains the deflated data, CRC32 and uncompressed size
+    rest = f.read(block_size - header_size)
+    return zlib.decompress(rest[:-8], -15)
+
+
+def bgzf_lines(vcf_in, start, end=None):
+    """
+    Yield the lines of a bgzip compressed file starting between two virtual file offsets.
+    Virtual file offsets combine the file offset of a BGZF block (upper 48 bits) and an offset within the decompressed block (lower 16 bits).
+    A line cut by the end offset is completed from the following data. Without end offset, lines are read until the end of the file.
+    """
+    start_block, start_within = start >> 16, start & 0xFFFF
+    end_block, end_within = (end >> 16, end & 0xFFFF) if end is not None else (None, None)
+    rest = b""
+    cut_line = False
+    with open(vcf_in, "rb") as f:
+        f.seek(start_block)
+        while True:
+            block_offset = f.tell()
+            data = read_bgzf_block(f)
+            if data is None:
+                break
+            if cut_line:
+                # complete the line cut by the end offset
+                newline = data.find(b"\n")
+                if newline < 0:
+                    rest += data
+                    continue
+                rest += data[:newline]
+                break
+            if block_offset == end_block:
+                data, tail = data[:end_within], data[end_within:]
+            if block_offset == start_block:
+                data = data[start_within:]
+            # lines can span BGZF blocks, keep the incomplete last line for the next block
+            data = rest + data
+            cut = data.rfind(b"\n") + 1
+            rest = data[cut:]
+            if cut:
+                lines = data[: cut - 1].decode().split("\n")
+                for line in lines:
+                    yield line
+            if block_offset == end_block:
+                if not rest:
+                    break
+                cut_line = True
+                newline = tail.find(b"\n")
+                if newline >= 0:
+                    rest += tail[:newline]
+                    break
+                rest += tail
+    if rest:
+        yield rest.decode()
+
+
+def text_lines(vcf_in, start, end=None):
+    """
+    Yield the lines of a plain text file starting between two file offsets.
+    Without end offset, lines are read until the end of the file.
+    """
+    with open(vcf_in, "rb") as f:
+        f.seek(start)
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode()
+
+
+def scan_contig(vcf_in, contig, start, end, fasta_in=None, fai_in=None):
+    """
+    Summarize the records of one contig between the virtual file offsets of the tabix index.
+    Reading stops at the first record of another contig.
+    The reference genome is opened by each process, if given.
+    """
+    reference = open_reference(fasta_in, fai_in) if fasta_in is not None else None
+    prefix = contig + "\t"
+    records = takewhile(lambda line: line.startswith(prefix), bgzf_lines(vcf_in, start, end))
+    return scan_records(records, new_summary(), reference)
+
+
+def read_vcf_indexed(vcf_in, tbi_in, workers, fasta_in=None, fai_in=None):
+    """
+    Read a bgzip compressed VCF file with the contigs of its tabix index summarized in a process pool.
+    Returns the header lines and the summary of all records, merged in file order.
+    """
+    with open_vcf(vcf_in) as f:
+        header, _ = split_header(f)
+    ranges = read_tbi(tbi_in)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        summaries = list(
+            executor.map(
+                scan_contig,
+                [vcf_in] * len(ranges),
+                [contig for contig, _, _ in ranges],
+                [start for _, start, _ in ranges],
+                [end for _, _, end in ranges],
+                [fasta_in] * len(ranges),
+                [fai_in] * len(ranges),
+            )
+        )
+    return header, merge_summaries(summaries)
+
+
+def is_bgzf(vcf_in):
+    """
+    Check if a file starts with a BGZF block, i.e. is bgzip and not only gzip compressed.
+    """
+    with open(vcf_in, "rb") as f:
+        header = f.read(14)
+    return header[:4] == BGZF_MAGIC and header[12:14] == b"BC"
+
+
+def next_bgzf_block(f, offset):
+    """
+    Find the file offset of the first BGZF block starting at or after an offset of an opened file.
+    BGZF blocks are at most 64 KB large, so the next block starts within the following 64 KB. Returns None at the end of the file.
+    """
+    f.seek(offset)
+    data = f.read(2 * 65536)
+    position = data.find(BGZF_MAGIC)
+    while 0 <= position <= len(data) - 14:
+        if data[position + 12 : position + 14] == b"BC":
+            return offset + position
+        position = data.find(BGZF_MAGIC, position + 1)
+    return None
+
+
+def bgzf_boundary(f, offset):
+    """
+    Find a window boundary in a bgzip compressed file: the end of the first BGZF block at or after an offset of an opened file.
+    Returns the virtual file offsets of the boundary and of the last uncompressed byte before it, or None at the end of the file.
+    """
+    block = next_bgzf_block(f, offset)
+    if block is None:
+        return None
+    f.seek(block)
+    data = read_bgzf_block(f)
+    if not data:
+        return None
+    return f.tell() << 16, (block << 16) | (len(data) - 1)
+
+
+def gzip_lines(vcf_in):
+    """
+    Yield the lines of a gzip compressed file from the start.
+    """
+    with open_vcf(vcf_in) as f:
+        for line in f:
+            yield line
+
+
+def window_lines(lines, skip_first):
+    """
+    Yield the record lines of a window.
+    Windows within the file start at the last byte before their boundary, so the skipped first line is the end of the previous line.
+    """
+    if skip_first:
+        next(lines, None)
+    for line in lines:
+        if line not in ("", "\n") and not line.startswith("#"):
+            yield line
+
+
+def sample_windows(vcf_in, tbi_in, windows):
+    """
+    Create line iterators of windows spread over a VCF file in file order.
+    Each window reads the lines starting before the boundary to the next window.
+    With a tabix index, the windows are distributed over the contigs by their compressed size with at least one window per contig.
+    Otherwise, the windows are spread evenly over the bgzip compressed or plain file.
+    gzip compressed files that are not bgzip compressed can only be read from the start in a single window.
+    """
+    if vcf_in.endswith(".gz") and not is_bgzf(vcf_in):
+        return [window_lines(gzip_lines(vcf_in), skip_first=False)]
+
+    if vcf_in.endswith(".gz") and tbi_in:
+        ranges = read_tbi(tbi_in)
+        total = sum(end - start for _, start, end in ranges) or 1
+        iterators = []
+        with open(vcf_in, "rb") as f:
+            for contig, start, end in ranges:
+                n = max(1, round(windows * (end - start) / total))
+                # (boundary, start of reading) of each window
+                bounds = [(start, start)]
+                for i in range(1, n):
+                    bound = bgzf_boundary(f, (start >> 16) + i * ((end >> 16) - (start >> 16)) // n)
+                    if bound is not None and bounds[-1][0] < bound[0] < end:
+                        bounds.append(bound)
+                prefix = contig + "\t"
+                for i, (_, window_start) in enumerate(bounds):
+                    window_end = bounds[i + 1][0] if i + 1 < len(bounds) else end
+                    lines = window_lines(bgzf_lines(vcf_in, window_start, window_end), skip_first=i > 0)
+                    iterators.append(takewhile(lambda line, prefix=prefix: line.startswith(prefix), lines))
+        return iterators
+
+    size = os.path.getsize(vcf_in)
+    bounds = [(0, 0)]
     if vcf_in.endswith(".gz"):
-        with gzip.open(vcf_in, "rt") as f:
-            for l in f:
-                if l.startswith("##"):
-                    header.append(l.strip("\n"))
+        with open(vcf_in, "rb") as f:
+            for i in range(1, windows):
+                bound = bgzf_boundary(f, i * size // windows)
+                if bound is not None and bound[0] > bounds[-1][0]:
+                    bounds.append(bound)
+        read_lines = bgzf_lines
     else:
-        with open(vcf_in, "rt") as f:
-            for l in f:
-                if l.startswith("##"):
-                    header.append(l.strip("\n"))
-    return header
+        bounds += [(i * size // windows, i * size // windows - 1) for i in range(1, windows)]
+        read_lines = text_lines
+    return [
+        window_lines(
+            read_lines(vcf_in, window_start, bounds[i + 1][0] if i + 1 < len(bounds) else None), skip_first=i > 0
+        )
+        for i, (_, window_start) in enumerate(bounds)
+    ]
+
+
+def take_budget(lines, budget, truncated):
+    """
+    Yield lines while they fit into the budget of records and uncompressed bytes, which is used up in place.
+    Windows with remaining lines are recorded in the truncated list.
+    """
+    for line in lines:
+        if budget["records"] < 1 or budget["bytes"] < len(line) + 1:
+            truncated.append(True)
+            return
+        budget["records"] -= 1
+        budget["bytes"] -= len(line) + 1
+        yield line
+
+
+def sample_vcf(vcf_in, tbi_in, max_records=None, max_bytes=None, checks=(), reference=None):
+    """
+    Read a sample of the records of a VCF file within a budget of records and/or uncompressed bytes.
+    The budget is shared by windows spread across the file, which are read in file order. Each window gets an even
+    share of the remaining budget, so the budget left over by short windows passes on to the following windows.
+    With a smaller record budget than windows, only as many windows as records are read.
+    Reading stops early as soon as the outcome of all given record checks is settled.
+    Returns the header lines, the summary of the sampled records and whether all records were read.
+    """
+    with open_vcf(vcf_in) as f:
+        header, _ = split_header(f)
+    windows = sample_windows(vcf_in, tbi_in, SAMPLE_WINDOWS)
+    skipped = []
+    if max_records and max_records < len(windows):
+        kept = {i * len(windows) // max_records for i in range(max_records)}
+        skipped = [lines for i, lines in enumerate(windows) if i not in kept]
+        windows = [lines for i, lines in enumerate(windows) if i in kept]
+    remaining = {"records": max_records or sys.maxsize, "bytes": max_bytes or sys.maxsize}
+
+    summary = new_summary()
+    truncated = []
+    for i, lines in enumerate(windows):
+        budget = {key: value // (len(windows) - i) for key, value in remaining.items()}
+        allotted = dict(budget)
+        scan_records(take_budget(lines, budget, truncated), summary, reference)
+        for key in remaining:
+            remaining[key] -= allotted[key] - budget[key]
+        if i + 1 < len(windows) and checks and all(RECORD_CHECKS[check](summary) for check in checks):
+            truncated.append(True)
+            break
+    # records of windows that were not read leave the sample incomplete
+    if not truncated and any(next(lines, None) is not None for lines in skipped):
+        truncated.append(True)
+    return header, summary, not truncated
+
+
+def sampling_message(meta_id, summary, complete, checks, exhaustive_checks):
+    """
+    Report which checks were exhaustive, settled by the sampled records or only based on a sample of the records.
+    Sampled checks can miss records, so they are reported as warning.
+    """
+    if complete:
+        return check_result(
+            "CHECK",
+            f"{meta_id} sampling budget covered all {summary['records']} records, all checks are exhaustive.",
+            counts={"records": summary["records"]},
+        )
+    settled = [check for check in checks if RECORD_CHECKS[check](summary)]
+    sampled = [check for check in checks if check not in settled]
+    log_level = "WARNING" if sampled else "CHECK"
+    return check_result(
+        log_level,
+        f"{meta_id} was checked on a sample of {summary['records']} records. "
+        f"Exhaustive checks: {', '.join(exhaustive_checks) or 'none'}. "
+        f"Checks settled by the sampled records: {', '.join(settled) or 'none'}. "
+        f"Sampled checks that can miss records: {', '.join(sampled) or 'none'}.",
+        counts={
+            "records": summary["records"],
+            "exhaustive_checks": len(exhaustive_checks),
+            "settled_checks": len(settled),
+            "sampled_checks": len(sampled),
+        },
+    )
 
 
-def check_chrom_def(vcffile, meta_id, log_level):
+def check_chrom_def(summary, meta_id, log_level):
     """
     Check if the chromosome column always has the "chr" prefix.
     """
     # extract chromosomes
-    chromosomes = vcffile["CHROM"]
+    contigs = summary["contigs"]
+
+    # check for prefix
+    errors = [c for c in contigs if not c.startswith("chr")]
+    error_records = sum(contigs[c] for c in errors)
+    counts = {"records": summary["records"], "records_without_prefix": error_records, "contigs": len(contigs)}
+    examples = errors[:RESULT_EXAMPLES]
 
-    if chromosomes.dtype == "int":
-        report_message = f'{log_level}: {meta_id} "CHROM" column only contains integers. Chromosome names need the "chr" prefix in the "CHROM" column.'
+    if contigs and all(c.isdigit() for c in contigs):
+        report_message = check_result(
+            log_level,
+            f'{meta_id} "CHROM" column only contains integers. Chromosome names need the "chr" prefix in the "CHROM" column.',
+            counts,
+            examples,
+        )
+    elif not errors:
+        report_message = check_result(
+            "CHECK", f'{meta_id} always contains "chr" prefix in the CHROM column.', counts
+        )
     else:
-        # check for pattern
-        pattern = re.compile(r"^chr.*")
-        chrmatch = [bool(pattern.match(c)) for c in chromosomes]
-        if all(chrmatch):
-            report_message = (
-                f'CHECK: {meta_id} always contains "chr" prefix in the CHROM column.'
-            )
-        else:
-            error_indices = [idx for idx, result in enumerate(chrmatch) if not result]
-            report_message = (
-                f'{log_level}: {meta_id} contains records without "chr" prefix in the CHROM column. '
-                f"{len(error_indices)} out of {len(chromosomes)} records do not have this prefix, e.g. have chromosome defined like this entry: {chromosomes[error_indices[0]]}. "
-                'Please use the "chr" prefix consistently for all entries.'
-            )
+        report_message = check_result(
+            log_level,
+            f'{meta_id} contains records without "chr" prefix in the CHROM column. '
+            f"{error_records} out of {summary['records']} records do not have this prefix, e.g. have chromosome defined like this entry: {errors[0]}. "
+            'Please use the "chr" prefix consistently for all entries.',
+            counts,
+            examples,
+        )
     return report_message
 
 
-def check_VEP(vcffile, vcfheader, meta_id, log_level):
+def check_VEP(summary, vcfheader, meta_id, log_level):
     """
     Check for already present VEP annotations in the VCF file.
     First, it checks the presence of a VEP flag in the header.
     Then, it checks if a CSQ string is present in the INFO column.
     """
 
+    counts = {"csq_records": summary["csq_records"]}
     if "VEP" in vcfheader:
-        report_message = f"{log_level}: {meta_id} contains a VEP key in VCF header. If the VCF file contains previous annotations, these will be overwritten."
-    elif [any("CSQ" in e for e in vcffile["INFO"])][0]:
-        report_message = f"{log_level}: {meta_id} contains a CSQ key in the INFO column entries. If the VCF file contains previous annotations, these will be overwritten."
+        report_message = check_result(
+            log_level,
+            f"{meta_id} contains a VEP key in VCF header. If the VCF file contains previous annotations, these will be overwritten.",
+            counts,
+        )
+    elif summary["csq_records"] > 0:
+        report_message = check_result(
+            log_level,
+            f"{meta_id} contains a CSQ key in the INFO column entries. If the VCF file contains previous annotations, these will be overwritten.",
+            counts,
+        )
     else:
-        report_message = f"CHECK: {meta_id} is not annotated by VEP yet."
+        report_message = check_result("CHECK", f"{meta_id} is not annotated by VEP yet.", counts)
     return report_message
 
 
-def check_FILTERs(vcffile, meta_id, log_level, passfilters={"PASS", "."}):
+def check_FILTERs(summary, meta_id, log_level, passfilters={"PASS", "."}):
     """
     Checks if FILTER column has anything else than "." or "PASS".
-    If VCF FILTER columns has ".", i.e. no filter was applied, PyVCF convert it to "None" and "PASS" is converted to an empty list "[]".
-    Hence to check for both, we need to check for non-empty strings
+    Multiple FILTER values of a record are separated by semicolons.
     """
 
-    # get unique FILTER col entries from all vcf records
-    def get_entries_FILTER_col(vcffile):
-        # get filtervalues and split multiple values
-        filters = vcffile["FILTER"].str.split(";")
-        # remove nested list and get unique entries
-        allfilters = set(chain.from_iterable(filters))
-        # get unique entries
-        return allfilters
+    # get unique FILTER values from all FILTER column entries, in order of appearance
+    def get_entries_FILTER_col(summary):
+        allfilters = {}
+        for filtervalue in summary["filters"]:
+            for f in filtervalue.split(";"):
+                allfilters[f] = None
+        return list(allfilters)
 
     # check if any other filtervalues are present.
     def check_pass(filters):
-        otherfilters = filters.difference(passfilters)
+        otherfilters = [f for f in filters if f not in passfilters]
+        counts = {
+            "records": summary["records"],
+            "records_with_other_filters": sum(
+                count
+                for filtervalue, count in summary["filters"].items()
+                if any(f not in passfilters for f in filtervalue.split(";"))
+            ),
+        }
         if not otherfilters:
-            report_message = (
-                f'CHECK: {meta_id} contains only "." or "PASS" values in FILTER column.'
+            report_message = check_result(
+                "CHECK", f'{meta_id} contains only "." or "PASS" values in FILTER column.', counts
             )
         else:
             # if anything else than "PASS" or "." is present, report.
-            report_message = f"{log_level}: {meta_id} contains other FILTER values than \"PASS\" or \".\": {','.join(otherfilters)}. If pass_filter = true, these will be filtered."
+            report_message = check_result(
+                log_level,
+                f"{meta_id} contains other FILTER values than \"PASS\" or \".\": {','.join(otherfilters)}. If pass_filter = true, these will be filtered.",
+                counts,
+                otherfilters[:RESULT_EXAMPLES],
+            )
         return report_message
 
     # Check in records
-    filters = get_entries_FILTER_col(vcffile)
+    filters = get_entries_FILTER_col(summary)
     report_message = check_pass(filters)
 
     return report_message
 
 
+def check_reference(summary, vcfheader, fai, meta_id, log_level):
+    """
+    Check if the VCF file matches the reference genome.
+    The contig lengths of the VCF header are compared to the FASTA index, the REF alleles, contigs and sort order of the records
+    were checked while reading the records.
+    """
+    issues = []
+    header_contigs = re.findall(r"^##contig=<ID=([^,>]+),length=(\d+)", "\n".join(vcfheader), flags=re.MULTILINE)
+    wrong_lengths = [
+        f"{contig} ({length} instead of {fai[contig][0]})"
+        for contig, length in header_contigs
+        if contig in fai and int(length) != fai[contig][0]
+    ]
+    if wrong_lengths:
+        issues.append(f"contig lengths in the VCF header differ from the reference genome: {', '.join(wrong_lengths)}")
+    if summary["unknown_contigs"]:
+        issues.append(
+            f"{sum(summary['unknown_contigs'].values())} records on contigs missing in the reference genome: {','.join(summary['unknown_contigs'])}"
+        )
+    if summary["out_of_range"] > 0:
+        issues.append(f"{summary['out_of_range']} records beyond the end of their contig")
+    if summary["ref_mismatches"] > 0:
+        examples = list(summary["ref_mismatch_examples"])[:REF_MISMATCH_EXAMPLES]
+        issues.append(
+            f"{summary['ref_mismatches']} out of {summary['ref_checked']} REF alleles do not match the reference genome, e.g. {'; '.join(examples)}"
+        )
+    if summary["unsorted"] > 0:
+        issues.append(f"{summary['unsorted']} records are not sorted by contig and position")
+
+    counts = {
+        "ref_checked": summary["ref_checked"],
+        "ref_mismatches": summary["ref_mismatches"],
+        "unknown_contig_records": sum(summary["unknown_contigs"].values()),
+        "out_of_range": summary["out_of_range"],
+        "unsorted": summary["unsorted"],
+        "wrong_contig_lengths": len(wrong_lengths),
+    }
+    examples = list(summary["ref_mismatch_examples"])[:REF_MISMATCH_EXAMPLES]
+
+    if issues:
+        report_message = check_result(
+            log_level, f"{meta_id} does not match the reference genome: " + ". ".join(issues) + ".", counts, examples
+        )
+    else:
+        report_message = check_result(
+            "CHECK",
+            f"{meta_id} matches the reference genome in {summary['ref_checked']} REF alleles, contig names and lengths and is sorted.",
+            counts,
+        )
+    return report_message
+
+
+def read_bcftools_stats(statsfile):
+    """
+    Read a bcftools stats file once into an index of its SN, TSTV, SiS, AF, QUAL, IDD, ST and DP sections.
+    Each section maps the set id to a list of rows, which are dictionaries of the typed columns in STATS_SECTIONS.
+    The index is shared by all checks of the bcftools stats file, e.g. the summary numbers or the depth distribution.
+    Other sections and comment lines are skipped.
+    """
+    stats = {section: {} for section in STATS_SECTIONS}
+    with open(statsfile, "rt") as file:
+        for line_number, line in enumerate(file, start=1):
+            section = line.split("\t", 1)[0]
+            if section not in STATS_SECTIONS:
+                continue
+            fields = line.rstrip("\n").split("\t")
+            columns = STATS_SECTIONS[section]
+            if len(fields) < 3:
+                raise ValueError(f"ERROR: line {line_number} of {section} section in stats file has no values.")
+            try:
+                row = {name: convert(value) for (name, convert), value in zip(columns, fields[2:])}
+                set_id = int(fields[1])
+            except ValueError:
+                raise ValueError(f"ERROR: line {line_number} of {section} section in stats file has invalid values.")
+            if section == "SN":
+                row["key"] = row["key"].rstrip(":")
+            stats[section].setdefault(set_id, []).append(row)
+    return stats
+
+
+def stats_number(stats, key, set_id=0):
+    """
+    Return the value of a key in the SN section (summary numbers) of an indexed bcftools stats file.
+    The key has to occur exactly once for the set id.
+    """
+    matches = [row["value"] for row in stats["SN"].get(set_id, []) if row["key"] == key]
+    if len(matches) != 1:
+        raise ValueError(
+            f"ERROR: {key} matches {len(matches)} lines in SN section of stats file instead of exactly one line."
+        )
+    return matches[0]
+
+
 def check_stats_value(
-    statsfile,
-    pattern,
+    stats,
+    key,
     textsnippet,
     meta_id,
-    tabposition=4,
     intcheck=0,
     log_level="WARNING",
 ):
     """
-    This function generally opens the stats file, searches for a string to match and extracts a tab-delimited position.
-    This position is assumed to be integer and checked against a specific intcheck number.
-    Hence, you can extract specific values in the bcftools stats file and check them directly.
+    Checks a summary number of the indexed bcftools stats file against a specific intcheck number.
     The textsnippet argument adds specific error messages for better readability.
     """
+    return count_message(stats_number(stats, key), textsnippet, meta_id, intcheck, log_level)
 
-    def process_lines(line):
-        # strip newline
-        foundline = line.strip("\n")
-        # split tabs
-        tabs = re.split("\t", foundline)
-        # extract tabposition and return
-        return tabs[tabposition - 1]
-
-    # open file
-    with open(statsfile, "r") as file:
-        matches = []
-        for line in file:
-            # important: the line is no comment line.
-            if pattern in line and not line.startswith("#"):
-                matches.append(process_lines(line))
-    if len(matches) != 1:
-        print(f"ERROR: {pattern} matches more than one line on stats file.")
 
-    if int(matches[0]) > intcheck:
-        report_message = f"{log_level}: {meta_id} contains {matches[0]} {textsnippet}."
+def check_variant_class(
+    summary,
+    key,
+    textsnippet,
+    meta_id,
+    intcheck=0,
+    log_level="WARNING",
+):
+    """
+    Checks a variant class count of the VCF summary against a specific intcheck number,
+    like check_stats_value does for the bcftools stats file.
+    """
+    return count_message(summary[key], textsnippet, meta_id, intcheck, log_level)
+
+
+def count_message(count, textsnippet, meta_id, intcheck=0, log_level="WARNING"):
+    """
+    Report if a count is above the intcheck number.
+    """
+    if count > intcheck:
+        report_message = check_result(log_level, f"{meta_id} contains {count} {textsnippet}.", {"records": count})
     else:
-        report_message = (
-            f"CHECK: {meta_id} contains equal or less than {intcheck} {textsnippet}."
+        report_message = check_result(
+            "CHECK", f"{meta_id} contains equal or less than {intcheck} {textsnippet}.", {"records": count}
         )
     return report_message
 
 
-if __name__ == "__main__":
-    args = parse_arguments()
+def check_result(severity, message, counts=None, examples=None):
+    """
+    Structured result of a check with its severity ("CHECK", "WARNING" or "ERROR"), the report message,
+    the counts the check is based on and example values or records that caused a warning or error.
+    The check id, elapsed time and number of scanned records are added by run_check.
+    """
+    return {"severity": severity, "message": message, "counts": counts or {}, "examples": examples or []}
 
+
+def run_check(check, records_scanned, function, *args, **kwargs):
     """
-    meta_id is always needed to reassign the sample name when warnings are collated in the workflow.
-    The log_level determines a string that will be handled as following:
-        "ERROR": raise ValueError, workflow will stop.
-        "WARNING": The whole warning message will be collected in warnings_out and reported in multiQC file.
+    Run a check function and add the check id, its elapsed time and the number of VCF records it is based on to the result.
     """
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return {
+        "check": check,
+        **result,
+        "elapsed_seconds": time.perf_counter() - started,
+        "records_scanned": records_scanned,
+    }
 
-    # load VCF as pyVCF object. This checks VCF format as well.
-    vcffile = read_vcf(args.vcf_in)
-    vcfheader = read_vcf_header(args.vcf_in)
 
-    # Run all checks and collect feedback in report_message list
+def result_line(result):
+    """
+    Report message of a check result with its severity prefix, as written to the warnings file.
+    """
+    return f"{result['severity']}: {result['message']}"
+
+
+def write_stats(summary, vcfheader, meta_id, stats_out):
+    """
+    Write the variant class counts of the VCF summary as SN section of a bcftools stats file,
+    which is recognized by the bcftools module of MultiQC.
+    """
+    samples = 0
+    if vcfheader and vcfheader[-1].startswith("#CHROM"):
+        samples = max(len(vcfheader[-1].split("\t")) - 9, 0)
+    lines = [
+        "# This file was produced by bcftools stats compatible summary of check_vcf.py",
+        "# Definition of sets:",
+        "# ID\t[2]id\t[3]tab-separated file names",
+        f"ID\t0\t{meta_id}",
+        "# SN, Summary numbers:",
+        "# SN\t[2]id\t[3]key\t[4]value",
+        f"SN\t0\tnumber of samples:\t{samples}",
+    ] + [f"SN\t0\t{stats_key}\t{summary[key]}" for key, stats_key in STATS_KEYS]
+    with open(stats_out, "xt") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def run_checks(args):
+    """
+    Run all enabled checks on the VCF file of one sample.
+    Returns the structured results of all checks and the elapsed time of reading the VCF and bcftools stats files,
+    which is shared by the checks.
+    """
+    # read header and summarize all records in one pass, per contig in parallel if a bgzip compressed VCF is indexed.
+    # This checks the number of VCF columns as well.
+    # In sampling mode, records are read within a budget until the outcome of all record checks is settled.
+    record_checks = [
+        check
+        for check in RECORD_CHECKS
+        if getattr(args, check) and not (args.bcftools_stats_in and check in STATS_CHECKS)
+    ]
+    sampling = args.max_records is not None or args.max_bytes is not None
+    # The reference genome is checked in the same pass over the records.
+    reference = open_reference(args.fasta_in, args.fai_in) if args.check_reference else None
+    started = time.perf_counter()
+    if sampling:
+        vcfheader, summary, complete = sample_vcf(
+            args.vcf_in, args.tbi_in, args.max_records, args.max_bytes, record_checks, reference
+        )
+    elif args.tbi_in and args.workers > 1 and args.vcf_in.endswith(".gz"):
+        fasta_in, fai_in = (args.fasta_in, args.fai_in) if args.check_reference else (None, None)
+        vcfheader, summary = read_vcf_indexed(args.vcf_in, args.tbi_in, args.workers, fasta_in, fai_in)
+    else:
+        vcfheader, summary = read_vcf(args.vcf_in, reference)
+
+    stages = [
+        {"stage": "read_vcf", "elapsed_seconds": time.perf_counter() - started, "records_scanned": summary["records"]}
+    ]
+
+    # The bcftools stats file is read once for all checks.
+    stats = None
+    if args.bcftools_stats_in:
+        started = time.perf_counter()
+        stats = read_bcftools_stats(args.bcftools_stats_in)
+        stages.append(
+            {"stage": "read_bcftools_stats", "elapsed_seconds": time.perf_counter() - started, "records_scanned": 0}
+        )
+
+    # Run all checks and collect their results in report_message list
     report_message = []
 
     # Checks through VCF file:
-    # The input for all functions needs to be a PyVCF reader class object.
+    # The input for all functions is the summary of VCF records.
     if args.check_chr_prefix:
         report_message = report_message + [
-            check_chrom_def(vcffile, meta_id=args.meta_id, log_level="ERROR")
-        ]
-
-    if args.check_vep_annotation:
-        report_message = report_message + [
-            check_VEP(vcffile, vcfheader, meta_id=args.meta_id, log_level="WARNING")
+            run_check(
+                "check_chr_prefix", summary["records"], check_chrom_def, summary, meta_id=args.meta_id, log_level="ERROR"
+            )
         ]
 
-    if args.check_FILTERs:
-        report_message = report_message + [
-            check_FILTERs(vcffile, meta_id=args.meta_id, log_level="WARNING")
-        ]
+    if args.check_reference:
+        result = run_check(
+            "check_reference",
+            summary["records"],
+            check_reference,
+            summary,
+            vcfheader,
+            reference[1],
+            meta_id=args.meta_id,
+            log_level="ERROR",
+        )
+        # the comparison to the reference genome is part of the VCF pass, which is shared by all other checks
+        result["elapsed_seconds"] += summary["ref_seconds"]
+        report_message = report_message + [result]
 
-    # Input checks based on bcftools stats output.
-    if args.check_MNPs:
+    if args.check_vep_annotation:
         report_message = report_message + [
-            check_stats_value(
-                args.bcftools_stats_in,
-                pattern="number of MNPs",
-                textsnippet="MNPs (multinucleotide variants)",
+            run_check(
+                "check_vep_annotation",
+                summary["records"],
+                check_VEP,
+                summary,
+                vcfheader,
                 meta_id=args.meta_id,
+                log_level="WARNING",
             )
         ]
 
-    if args.check_gVCF:
+    if args.check_FILTERs:
         report_message = report_message + [
-            check_stats_value(
-                args.bcftools_stats_in,
-                pattern="number of no-ALTs",
-                textsnippet="nonvariant genomic postions (no-ALTs)",
-                meta_id=args.meta_id,
+            run_check(
+                "check_FILTERs", summary["records"], check_FILTERs, summary, meta_id=args.meta_id, log_level="WARNING"
             )
         ]
 
-    if args.check_other_variants:
-        report_message = report_message + [
-            check_stats_value(
-                args.bcftools_stats_in,
-                pattern="number of others",
-                textsnippet='"other" variants that are neither SNPs nor indels',
-                meta_id=args.meta_id,
-            )
-        ]
+    # Input checks of variant classes based on bcftools stats output if given, on the VCF summary otherwise.
+    variant_class_checks = [
+        (
+            "check_MNPs",
+            "mnps",
+            "MNPs (multinucleotide variants)",
+        ),
+        (
+            "check_gVCF",
+            "noalts",
+            "nonvariant genomic postions (no-ALTs)",
+        ),
+        (
+            "check_other_variants",
+            "others",
+            '"other" variants that are neither SNPs nor indels',
+        ),
+        (
+            "check_multiallelic_sites",
+            "multiallelic",
+            "variants with multiallelic sites. These will be splitted by `bcftools norm` into biallelic sites",
+        ),
+    ]
+    stats_keys = {key: stats_key.rstrip(":") for key, stats_key in STATS_KEYS}
+    for check, key, textsnippet in variant_class_checks:
+        if not getattr(args, check):
+            continue
+        if stats:
+            report_message = report_message + [
+                run_check(
+                    check,
+                    0,
+                    check_stats_value,
+                    stats,
+                    key=stats_keys[key],
+                    textsnippet=textsnippet,
+                    meta_id=args.meta_id,
+                )
+            ]
+        else:
+            report_message = report_message + [
+                run_check(
+                    check,
+                    summary["records"],
+                    check_variant_class,
+                    summary,
+                    key,
+                    textsnippet=textsnippet,
+                    meta_id=args.meta_id,
+                )
+            ]
+
+    if args.stats_out:
+        write_stats(summary, vcfheader, args.meta_id, args.stats_out)
 
-    if args.check_multiallelic_sites:
+    if sampling:
+        exhaustive_checks = [check for check in STATS_CHECKS if getattr(args, check) and stats]
         report_message = report_message + [
-            check_stats_value(
-                args.bcftools_stats_in,
-                pattern="number of multiallelic sites",
-                textsnippet="variants with multiallelic sites. These will be splitted by `bcftools norm` into biallelic sites",
-                meta_id=args.meta_id,
+            run_check(
+                "sampling",
+                summary["records"],
+                sampling_message,
+                args.meta_id,
+                summary,
+                complete,
+                record_checks,
+                exhaustive_checks,
             )
         ]
 
+    return {"meta_id": args.meta_id, "stages": stages, "checks": report_message}
+
+
+def error_results(meta_id, error):
+    """
+    Results of a sample whose VCF or stats file could not be read, with the error as only check result.
+    """
+    message = str(error)
+    if message.startswith("ERROR: "):
+        message = message[len("ERROR: "):]
+    return {
+        "meta_id": meta_id,
+        "stages": [],
+        "checks": [
+            {
+                "check": "read_vcf",
+                **check_result("ERROR", f"{meta_id}: {message}"),
+                "elapsed_seconds": 0.0,
+                "records_scanned": 0,
+            }
+        ],
+    }
+
+
+def write_results(results_out, results):
+    """
+    Write the structured check results of one sample as JSON.
+    """
+    with open(results_out, "xt") as f:
+        json.dump(results, f, indent=2)
+
+
+def write_metrics(metrics_json, sample_results):
+    """
+    Write the elapsed time of reading the input files and of each check as MultiQC custom content table,
+    with one row per sample. The number of scanned VCF records is hidden by default.
+    """
+    data = {}
+    headers = {}
+    for results in sample_results:
+        row = {}
+        for stage in results["stages"]:
+            row[f"{stage['stage']}_time"] = round(stage["elapsed_seconds"], 3)
+            headers[f"{stage['stage']}_time"] = {
+                "title": f"{stage['stage']} [s]",
+                "description": f"Elapsed time of the {stage['stage']} stage shared by all checks",
+                "format": "{:,.3f}",
+            }
+            if stage["stage"] == "read_vcf":
+                row["records_scanned"] = stage["records_scanned"]
+        for result in results["checks"]:
+            row[f"{result['check']}_time"] = round(result["elapsed_seconds"], 3)
+            headers[f"{result['check']}_time"] = {
+                "title": f"{result['check']} [s]",
+                "description": f"Elapsed time of {result['check']} ({result['severity']})",
+                "format": "{:,.3f}",
+            }
+        data[results["meta_id"]] = row
+    headers["records_scanned"] = {
+        "title": "Records scanned",
+        "description": "Number of VCF records read by the checks",
+        "format": "{:,.0f}",
+        "hidden": True,
+    }
+    content = {
+        "id": "vcfchecks_metrics",
+        "section_name": "VCF check timing",
+        "description": "Elapsed time of reading the VCF and bcftools stats files and of each check of the VCF check.",
+        "plot_type": "table",
+        "pconfig": {"id": "vcfchecks_metrics_table", "title": "VCF check timing"},
+        "headers": headers,
+        "data": data,
+    }
+    with open(metrics_json, "xt") as f:
+        json.dump(content, f, indent=2)
+
+
+def process_sample(args):
+    """
+    Check the VCF file of one sample, raise an error or write the warnings to --warnings_out.
+    The check results and timing are written before an error is raised.
+    """
+    results = run_checks(args)
+    if args.results_out:
+        write_results(args.results_out, results)
+    if args.metrics_json:
+        write_metrics(args.metrics_json, [results])
+    report_message = [result_line(result) for result in results["checks"]]
+
     # If log_level is set to "ERROR": crash and report ALL check messages
-    if any(["ERROR" in m for m in report_message]):
+    if any(result["severity"] == "ERROR" for result in results["checks"]):
         raise ValueError("\n".join(report_message))
 
     # If log_level is set to "WARNING". collect only those in warnings_out for including in multiQC report.
-    warnings = []
-    for m in report_message:
-        if "WARNING" in m:
-            warnings.append(m)
+    warnings = [result_line(result) for result in results["checks"] if result["severity"] == "WARNING"]
 
     with open(args.warnings_out, "xt") as warning_out:
         warning_out.write("\n".join(warnings))
 
     # Report messages also to stdin
     print(f"{args.meta_id} VCF check was successful:\n" + "\n".join(report_message))
+
+
+def check_batch_sample(args):
+    """
+    Run the checks of one sample in a worker of the batch process pool.
+    Errors while reading the input files, e.g. missing or corrupt files, are reported as check results, so that they
+    do not hide the results of other samples.
+    """
+    try:
+        return run_checks(args)
+    except (ValueError, OSError, EOFError, zlib.error, struct.error) as e:
+        return error_results(args.meta_id, e)
+
+
+def process_batch(args):
+    """
+    Check the VCF files of all samples of the --manifest in a process pool.
+    Per-sample warnings and check results (and variant class counts of samples without bcftools stats file) are written
+    to --outdir, the warnings of all samples to --batch_warnings_out and the timing of all samples to --metrics_json.
+    Errors of all samples are raised together after all samples were checked and the warnings of the other samples
+    were written.
+    """
+    sample_args = []
+    with open(args.manifest, "rt", newline="") as f:
+        for row in csv.DictReader(f):
+            sample_arg = argparse.Namespace(**vars(args))
+            sample_arg.meta_id = row["meta_id"]
+            sample_arg.vcf_in = row["vcf_in"]
+            sample_arg.tbi_in = row.get("tbi_in") or None
+            sample_arg.bcftools_stats_in = row.get("bcftools_stats_in") or None
+            sample_arg.stats_out = (
+                None if sample_arg.bcftools_stats_in else os.path.join(args.outdir, f"{row['meta_id']}_stats.txt")
+            )
+            # samples are checked in parallel, not their contigs
+            sample_arg.workers = 1
+            sample_args.append(sample_arg)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        sample_results = list(executor.map(check_batch_sample, sample_args))
+
+    for results in sample_results:
+        write_results(os.path.join(args.outdir, f"{results['meta_id']}_results.json"), results)
+    if args.metrics_json:
+        write_metrics(args.metrics_json, sample_results)
+
+    errors = []
+    all_warnings = []
+    for results in sample_results:
+        report_message = [result_line(result) for result in results["checks"]]
+        # If log_level is set to "ERROR": collect ALL check messages of the sample
+        if any(result["severity"] == "ERROR" for result in results["checks"]):
+            errors.append("\n".join(report_message))
+            continue
+        warnings = [result_line(result) for result in results["checks"] if result["severity"] == "WARNING"]
+        with open(os.path.join(args.outdir, f"{results['meta_id']}_warnings.txt"), "xt") as warning_out:
+            warning_out.write("\n".join(warnings))
+        all_warnings.extend(warnings)
+        print(f"{results['meta_id']} VCF check was successful:\n" + "\n".join(report_message))
+
+    with open(args.batch_warnings_out, "xt") as warning_out:
+        warning_out.write("\n".join(all_warnings))
+
+    # crash and report the check messages of all samples with errors
+    if errors:
+        raise ValueError("\n".join(errors))
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    """
+    meta_id is always needed to reassign the sample name when warnings are collated in the workflow.
+    The log_level determines a string that will be handled as following:
+        "ERROR": raise ValueError, workflow will stop.
+        "WARNING": The whole warning message will be collected in warnings_out and reported in multiQC file.
+    """
+
+    if args.manifest:
+        process_batch(args)
+    else:
+        process_sample(args)
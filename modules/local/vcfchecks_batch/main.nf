@@ -0,0 +1,47 @@
+process VCFCHECKS_BATCH {
+    tag "batch"
+    label 'process_medium'
+    conda "conda-forge::python=3.9.15 conda-forge::pandas=2.0.3"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/mulled-v2-0594c09780adaaa41fe60b1869ba41c8905a0c98:24a8102d6795963b77f04bb83cc82c081e4a2adc-0' :
+        'biocontainers/mulled-v2-0594c09780adaaa41fe60b1869ba41c8905a0c98:24a8102d6795963b77f04bb83cc82c081e4a2adc-0' }"
+
+    input:
+    tuple val(samples), path(vcfs), path(tbis), path(stats)
+    tuple val(meta2), path(fasta)
+    tuple val(meta3), path(fai)
+
+    output:
+    path("*_warnings.txt")         , emit: sample_warnings
+    path("*_stats.txt")            , emit: stats, optional: true
+    path("combined.warnings.txt")  , emit: warnings
+    path("*_results.json")         , emit: results
+    path("*_mqc.json")             , emit: metrics
+
+    when:
+    task.ext.when == null || task.ext.when
+
+    script:
+    def args = task.ext.args ?: ''
+    def vcf_list = vcfs instanceof List ? vcfs : [vcfs]
+    def tbi_list = tbis instanceof List ? tbis : [tbis]
+    // count variant classes from the VCF records if no bcftools stats files are provided
+    def stats_list = stats instanceof List ? stats : [stats]
+    if (!stats_list) stats_list = samples.collect { '' }
+    def manifest = [samples, vcf_list, tbi_list, stats_list].transpose().collect { sample, vcf, tbi, stat -> "'${sample},${vcf},${tbi},${stat}'" }.join(' ')
+
+    """
+    printf '%s\\n' 'meta_id,vcf_in,tbi_in,bcftools_stats_in' ${manifest} > manifest.csv
+
+    # Check VCF files of all samples
+    check_vcf.py \\
+        --manifest manifest.csv \\
+        --fasta_in $fasta \\
+        --fai_in $fai \\
+        --workers $task.cpus \\
+        --outdir . \\
+        --batch_warnings_out combined.warnings.txt \\
+        --metrics_json batch_vcfchecks_mqc.json \\
+        $args
+    """
+}
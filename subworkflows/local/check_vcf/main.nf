@@ -5,6 +5,7 @@
 include { GATK4_VALIDATEVARIANTS          } from '../../../modules/local/gatk4/validatevariants/main'
 include { BCFTOOLS_STATS                  } from '../../../modules/nf-core/bcftools/stats/main'
 include { VCFCHECKS                       } from '../../../modules/local/vcfchecks/main'
+include { VCFCHECKS_BATCH                 } from '../../../modules/local/vcfchecks_batch/main'
 
 workflow CHECKVCF {
     take:
@@ -18,39 +19,61 @@ workflow CHECKVCF {
     ch_multiqc_reports = Channel.empty()
 
     //
-    // Check VCF format integrity and reference genome correctness
+    // Check VCF format integrity and reference genome correctness, otherwise VCFCHECKS checks the reference genome itself
     //
 
-    GATK4_VALIDATEVARIANTS(vcf_tbi, fasta_ref, ref_dict, ref_fai)
-    ch_versions = ch_versions.mix(GATK4_VALIDATEVARIANTS.out.versions)
+    if (params.gatk_validatevariants) {
+        GATK4_VALIDATEVARIANTS(vcf_tbi, fasta_ref, ref_dict, ref_fai)
+        ch_versions = ch_versions.mix(GATK4_VALIDATEVARIANTS.out.versions)
+    }
 
     //
-    // produce bcftools stats
+    // produce bcftools stats, otherwise VCFCHECKS counts the variant classes itself
     //
 
-    BCFTOOLS_STATS (vcf_tbi,
-                    [ [], []],
-                    [ [], []],
-                    [ [], []],
-                    [ [], []],
-                    [ [], []]
-    )
-    ch_versions        = ch_versions.mix(BCFTOOLS_STATS.out.versions)
-    ch_multiqc_reports = ch_multiqc_reports.mix(BCFTOOLS_STATS.out.stats.collect{ meta, stats -> stats})
+    if (params.bcftools_stats) {
+        BCFTOOLS_STATS (vcf_tbi,
+                        [ [], []],
+                        [ [], []],
+                        [ [], []],
+                        [ [], []],
+                        [ [], []]
+        )
+        ch_versions        = ch_versions.mix(BCFTOOLS_STATS.out.versions)
+        ch_multiqc_reports = ch_multiqc_reports.mix(BCFTOOLS_STATS.out.stats.collect{ meta, stats -> stats})
+
+        // join vcf and stats file channels
+        vcf_stats=vcf_tbi
+            .join(BCFTOOLS_STATS.out.stats)
+    } else {
+        vcf_stats=vcf_tbi
+            .map { meta, vcf, tbi -> tuple(meta, vcf, tbi, []) }
+    }
 
     //
     // Check VCF file
     //
 
-    // join vcf and stats file channels
-    vcf_stats=vcf_tbi
-        .map { meta, vcf, tbi -> tuple(meta, vcf) }
-        .join(BCFTOOLS_STATS.out.stats)
-
-    VCFCHECKS(vcf_stats)
+    if (params.vcfchecks_batch) {
+        // all VCF files are checked in one task
+        vcf_stats_batch = vcf_stats
+            .map { meta, vcf, tbi, stats -> [ meta.id, vcf, tbi, stats ] }
+            .toSortedList { a, b -> a[0] <=> b[0] }
+            .map { rows -> [ rows.collect { it[0] },
+                             rows.collect { it[1] },
+                             rows.collect { it[2] },
+                             params.bcftools_stats ? rows.collect { it[3] } : [] ] }
+        VCFCHECKS_BATCH(vcf_stats_batch, fasta_ref, ref_fai)
+        ch_multiqc_reports = ch_multiqc_reports.mix(VCFCHECKS_BATCH.out.stats.collect(), VCFCHECKS_BATCH.out.metrics)
+        ch_warnings        = VCFCHECKS_BATCH.out.warnings
+    } else {
+        VCFCHECKS(vcf_stats, fasta_ref, ref_fai)
+        ch_multiqc_reports = ch_multiqc_reports.mix(VCFCHECKS.out.stats.collect(), VCFCHECKS.out.metrics.collect())
+        ch_warnings        = VCFCHECKS.out.warnings
+    }
 
     emit:
     versions        =   ch_versions                    // path: versions.yml
     multiqc_reports =   ch_multiqc_reports             // path: multiQC reports
-    warnings        =   VCFCHECKS.out.warnings         // path: warnings.txt
+    warnings        =   ch_warnings                    // path: warnings.txt
 }
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+### The scripts of bin/ and the synthetic data generator of benchmarks/ are imported as modules
+REPO_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_DIR / "bin"))
+sys.path.insert(0, str(REPO_DIR / "benchmarks"))
@@ -0,0 +1,247 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import calculate_TMB
+import process_bedfiles
+from generate_data import generate_dataset
+
+
+@pytest.mark.parametrize("outdir_name", ["tmb", "png.txt", "next."])
+def test_cohort_multisample_tsv(tmp_path, outdir_name):
+    ### A manifest mixing a 3-sample TSV with a single-sample TSV, written to an outdir named like the stripped suffixes
+    multi = generate_dataset(tmp_path / "multi", "panel", variants=300, samples=3)
+    single = generate_dataset(tmp_path / "single", "panel", variants=300, samples=1)
+    manifest = tmp_path / "manifest.csv"
+    pd.DataFrame({"sample": ["S1", "S2"], "file_in": [multi["tsv"], single["tsv"]]}).to_csv(manifest, index=False)
+    outdir = tmp_path / outdir_name
+    cohort_out = tmp_path / "cohort_TMB.csv"
+
+    calculate_TMB.main(
+        [
+            "--manifest", str(manifest),
+            "--bedfile", str(multi["bed"]),
+            "--outdir", str(outdir),
+            "--cohort_out", str(cohort_out),
+            "--population_db", "CSQ_MAX_AF",
+            "--min_AF", "0.05",
+            "--max_AF", "0.9",
+            "--min_cov", "20",
+            "--popfreq_max", "0.02",
+            "--plot", "none",
+        ]
+    )
+
+    assert sorted(path.name for path in outdir.glob("*.csv")) == [
+        "S1_[SAMPLE1].csv",
+        "S1_[SAMPLE2].csv",
+        "S1_[SAMPLE3].csv",
+        "S2.csv",
+    ]
+    cohort = pd.read_csv(cohort_out)
+    assert list(cohort["sample"]) == ["S1", "S1", "S1", "S2"]
+    assert list(cohort["vcf_sample"]) == ["SAMPLE1", "SAMPLE2", "SAMPLE3", "SAMPLE1"]
+
+
+def test_sample_outputs_keep_directory(tmp_path):
+    args = calculate_TMB.parse_args(
+        ["--file_out", str(tmp_path / "tmb" / "S1.csv"), "--plot_out", str(tmp_path / "tmb" / "S1.png")]
+    )
+    [outputs] = calculate_TMB.sample_outputs(args, True, ["[SAMPLE1]"], [(None, 0, 1000)])
+    assert outputs == [(str(tmp_path / "tmb" / "S1_[SAMPLE1].csv"), str(tmp_path / "tmb" / "S1_[SAMPLE1].png"))]
+
+
+def test_cohort_worker_maps_compiled_panel(tmp_path):
+    ### The compiled panel is handed to the workers by its path and memory-mapped instead of pickled
+    dataset = generate_dataset(tmp_path, "panel", variants=300, samples=1)
+    panel_file = tmp_path / "panel.npz"
+    process_bedfiles.write_compiled_panel(pd.read_csv(dataset["bed"], sep="\t", header=None), panel_file)
+    args = calculate_TMB.parse_args(["--bedfile", str(panel_file), "--panelsize_threshold", "0"])
+    interval_index, panels = calculate_TMB.load_panel(args)
+
+    calculate_TMB.init_cohort_worker((None, panels), {}, panel_file)
+
+    worker_index, worker_panels = calculate_TMB.cohort_state["panel"]
+    assert worker_panels == panels
+    assert worker_index.keys() == interval_index.keys()
+    for contig, (starts, ends, masks) in worker_index.items():
+        assert isinstance(starts, np.memmap) and isinstance(ends, np.memmap)
+        assert np.array_equal(starts, interval_index[contig][0])
+        assert np.array_equal(ends, interval_index[contig][1])
+
+
+def test_cohort_compiled_panel_equals_bed(tmp_path):
+    dataset = generate_dataset(tmp_path, "panel", variants=300, samples=2)
+    panel_file = tmp_path / "panel.npz"
+    process_bedfiles.write_compiled_panel(pd.read_csv(dataset["bed"], sep="\t", header=None), panel_file)
+    manifest = tmp_path / "manifest.csv"
+    pd.DataFrame({"sample": ["S1"], "file_in": [dataset["tsv"]]}).to_csv(manifest, index=False)
+
+    for bedfile in [dataset["bed"], panel_file]:
+        calculate_TMB.main(
+            [
+                "--manifest", str(manifest),
+                "--bedfile", str(bedfile),
+                "--outdir", str(tmp_path / bedfile.suffix.strip(".")),
+                "--cohort_out", str(tmp_path / f"cohort_{bedfile.suffix.strip('.')}.csv"),
+                "--workers", "2",
+                "--population_db", "CSQ_MAX_AF",
+                "--min_AF", "0.05",
+                "--max_AF", "0.9",
+                "--min_cov", "20",
+                "--popfreq_max", "0.02",
+                "--plot", "none",
+            ]
+        )
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "cohort_bed.csv"), pd.read_csv(tmp_path / "cohort_npz.csv"))
+
+
+def run_tmb(tsv, bedfiles, outdir, *extra):
+    ### Single TSV run writing all outputs to outdir, returns the contents of the written files
+    outdir.mkdir(parents=True, exist_ok=True)
+    calculate_TMB.main(
+        [
+            "--file_in", str(tsv),
+            "--bedfile", *[str(bedfile) for bedfile in bedfiles],
+            "--file_out", str(outdir / "tmb.csv"),
+            "--plot_out", str(outdir / "tmb.png"),
+            "--population_db", "CSQ_MAX_AF",
+            "--min_AF", "0.05",
+            "--max_AF", "0.9",
+            "--min_cov", "20",
+            "--popfreq_max", "0.02",
+            "--panelsize_threshold", "0",
+            *extra,
+        ]
+    )
+    return {path.name: path.read_bytes() for path in sorted(outdir.iterdir())}
+
+
+@pytest.fixture
+def tmb_dataset(tmp_path):
+    ### A 3-sample TSV with several transcript rows per mutation and a second panel without any mutation
+    dataset = generate_dataset(tmp_path / "data", "panel", variants=400, samples=3)
+    empty_bed = tmp_path / "data" / "empty.bed"
+    empty_bed.write_text("chr1\t100\t200\n")
+    return dataset["tsv"], [dataset["bed"], empty_bed]
+
+
+@pytest.mark.parametrize("chunksize", [3, 7, 64, 1000000])
+@pytest.mark.parametrize("roi", [[], ["--prefilter_region"]])
+def test_streaming_equals_in_memory(tmb_dataset, tmp_path, chunksize, roi):
+    tsv, bedfiles = tmb_dataset
+    extra = [
+        *roi,
+        "--plot", "json",
+        "--filter_consequence", "true",
+        "--csq_values", "missense_variant,stop_gained,frameshift_variant,synonymous_variant",
+        "--sweep_min_cov", "10", "20", "30",
+        "--sweep_min_AF", "0.01", "0.05",
+        "--sweep_max_AF", "0.5", "0.9",
+        "--sweep_popfreq_max", "0.02", "0.5",
+    ]
+    outputs = {}
+    for mode, mode_args in [("in_memory", []), ("streaming", ["--streaming", "--chunksize", str(chunksize)])]:
+        outdir = tmp_path / mode
+        outputs[mode] = run_tmb(
+            tsv,
+            bedfiles,
+            outdir,
+            *extra,
+            *mode_args,
+            "--sweep_out", str(outdir / "sweep.csv"),
+            "--variants_out", str(outdir / "variants.parquet"),
+        )
+    in_memory, streaming = outputs["in_memory"], outputs["streaming"]
+
+    assert sorted(streaming) == sorted(in_memory)
+    assert len([name for name in in_memory if name.endswith(".histogram.json")]) == 6
+    for name in in_memory:
+        if name.endswith(".parquet"):
+            ### streaming writes one row group per chunk
+            pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / "streaming" / name), pd.read_parquet(tmp_path / "in_memory" / name))
+        else:
+            assert streaming[name] == in_memory[name], name
+
+
+def test_streaming_outputs_independent_of_chunksize(tmb_dataset, tmp_path):
+    ### Rows of a mutation repeated at the end of the TSV fall into different chunks
+    tsv, bedfiles = tmb_dataset
+    lines = tsv.read_text().splitlines(keepends=True)
+    repeated = tmp_path / "repeated.tsv"
+    repeated.write_text("".join(lines + lines[1:40]))
+    outputs = [
+        run_tmb(repeated, bedfiles, tmp_path / str(chunksize), "--plot", "json", "--streaming", "--chunksize", str(chunksize))
+        for chunksize in [5, 1000000]
+    ]
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.parametrize("mode", [[], ["--streaming", "--chunksize", "50"]])
+@pytest.mark.parametrize("roi", [[], ["--prefilter_region"]])
+def test_sweep_at_base_thresholds_equals_report(tmb_dataset, tmp_path, mode, roi):
+    ### The base thresholds of run_tmb are part of every sweep grid
+    tsv, bedfiles = tmb_dataset
+    outputs = run_tmb(
+        tsv,
+        bedfiles,
+        tmp_path / "tmb",
+        *mode,
+        *roi,
+        "--plot", "none",
+        "--sweep_out", str(tmp_path / "tmb" / "sweep.csv"),
+        "--sweep_min_cov", "10", "20", "30",
+        "--sweep_min_AF", "0.01", "0.05",
+        "--sweep_max_AF", "0.9", "1",
+        "--sweep_popfreq_max", "0.02", "0.5",
+    )
+    sweep = pd.read_csv(tmp_path / "tmb" / "sweep.csv")
+    base = sweep.query("min_cov == 20 and min_AF == 0.05 and max_AF == 0.9 and popfreq_max == 0.02")
+    assert len(base) == 6
+    for row in base.itertuples():
+        report = pd.read_csv(io.BytesIO(outputs[f"tmb_[{row.sample}]_{row.panel}.csv"]), index_col="STEP")["#_MUTATIONS"]
+        assert row.mutations == int(report["Unique mutations after population database filter"])
+        assert row.TMB == float(report["TMB value"].split("/")[0])
+
+
+CACHE_ARGS = ["--plot", "json", "--sweep_min_cov", "10", "20", "--sweep_min_AF", "0.05", "0.1"]
+
+
+def run_cached(tsv, bedfiles, outdir, cache_dir, *extra):
+    return run_tmb(tsv, bedfiles, outdir, *CACHE_ARGS, "--sweep_out", str(outdir / "sweep.csv"), "--cache_dir", str(cache_dir), *extra)
+
+
+def test_cache_hit_restores_outputs(tmb_dataset, tmp_path, monkeypatch):
+    tsv, bedfiles = tmb_dataset
+    cache_dir = tmp_path / "cache"
+    calculated = run_cached(tsv, bedfiles, tmp_path / "calculated", cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    ### A hit neither reads nor filters the TSV, streaming gives the same results
+    def not_calculated(*args, **kwargs):
+        raise AssertionError("cache miss")
+
+    monkeypatch.setattr(calculate_TMB, "process_data", not_calculated)
+    monkeypatch.setattr(calculate_TMB, "process_streaming", not_calculated)
+    assert run_cached(tsv, bedfiles, tmp_path / "restored", cache_dir) == calculated
+    assert run_cached(tsv, bedfiles, tmp_path / "streaming", cache_dir, "--streaming") == calculated
+    assert len(list(cache_dir.iterdir())) == 1
+
+
+@pytest.mark.parametrize("change", ["tsv", "threshold"])
+def test_cache_miss_on_changed_input(tmb_dataset, tmp_path, change):
+    tsv, bedfiles = tmb_dataset
+    cache_dir = tmp_path / "cache"
+    run_cached(tsv, bedfiles, tmp_path / "cached", cache_dir)
+    changed_tsv, extra = tsv, []
+    if change == "tsv":
+        changed_tsv = tmp_path / "changed.tsv"
+        changed_tsv.write_text("".join(tsv.read_text().splitlines(keepends=True)[:-20]))
+    else:
+        extra = ["--min_cov", "30"]
+    missed = run_cached(changed_tsv, bedfiles, tmp_path / "missed", cache_dir, *extra)
+    assert len(list(cache_dir.iterdir())) == 2
+    assert missed == run_cached(changed_tsv, bedfiles, tmp_path / "uncached", tmp_path / "other_cache", *extra)
+    assert missed != run_cached(tsv, bedfiles, tmp_path / "cached_again", cache_dir)
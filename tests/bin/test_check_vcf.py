@@ -0,0 +1,269 @@
+import gzip
+import random
+import shutil
+import struct
+import subprocess
+import zlib
+
+import pytest
+
+import check_vcf
+
+### gVCF-style records with <NON_REF> and <*> alleles and alleles htslib classifies differently from their bases
+GVCF_RECORDS = [
+    ("A", "G"),
+    ("A", "G,<NON_REF>"),
+    ("A", "G,T,<*>"),
+    ("A", "<NON_REF>"),
+    ("A", "<*>"),
+    ("AC", "A,<NON_REF>"),
+    ("A", "G,AT"),
+    ("AC", "GT,<*>"),
+    ("A", "."),
+    ("ac", "at,<*>"),
+    ("a", "A"),
+    ("A", "X"),
+    ("A", "G,*"),
+    ("A", "*"),
+]
+
+### SN section of bcftools stats 1.24 for GVCF_RECORDS
+BCFTOOLS_STATS_SN = {
+    "number of records": 14,
+    "number of no-ALTs": 4,
+    "number of SNPs": 7,
+    "number of MNPs": 1,
+    "number of indels": 2,
+    "number of others": 0,
+    "number of multiallelic sites": 7,
+    "number of multiallelic SNP sites": 3,
+}
+
+
+@pytest.fixture
+def gvcf(tmp_path):
+    vcf = tmp_path / "gvcf.vcf"
+    lines = [
+        "##fileformat=VCFv4.2",
+        "##contig=<ID=chr1,length=10000>",
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+        "\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT", "S1"]),
+    ]
+    for index, (ref, alt) in enumerate(GVCF_RECORDS):
+        lines.append("\t".join(["chr1", str(100 * (index + 1)), ".", ref, alt, ".", "PASS", ".", "GT", "0/1"]))
+    vcf.write_text("\n".join(lines) + "\n")
+    return vcf
+
+
+def stats_numbers(stats):
+    return {key: check_vcf.stats_number(stats, key) for key in BCFTOOLS_STATS_SN}
+
+
+def test_variant_classes_equal_bcftools_stats(gvcf, tmp_path):
+    header, summary = check_vcf.read_vcf(str(gvcf))
+    stats_out = tmp_path / "gvcf_stats.txt"
+    check_vcf.write_stats(summary, header, "gvcf", str(stats_out))
+
+    assert stats_numbers(check_vcf.read_bcftools_stats(str(stats_out))) == BCFTOOLS_STATS_SN
+
+
+@pytest.mark.skipif(shutil.which("bcftools") is None, reason="bcftools is not installed")
+def test_variant_classes_equal_bcftools_stats_output(gvcf, tmp_path):
+    bcftools_out = tmp_path / "bcftools_stats.txt"
+    with open(bcftools_out, "w") as f:
+        subprocess.run(["bcftools", "stats", str(gvcf)], stdout=f, check=True)
+    header, summary = check_vcf.read_vcf(str(gvcf))
+    stats_out = tmp_path / "gvcf_stats.txt"
+    check_vcf.write_stats(summary, header, "gvcf", str(stats_out))
+
+    assert stats_numbers(check_vcf.read_bcftools_stats(str(stats_out))) == stats_numbers(
+        check_vcf.read_bcftools_stats(str(bcftools_out))
+    )
+
+
+def write_bgzf(path, data, block_size):
+    ### BGZF blocks of block_size uncompressed bytes and the end-of-file block, returns the samtools .gzi offsets
+    offsets = []
+    with open(path, "wb") as f:
+        for start in range(0, len(data), block_size) or [0]:
+            chunk = data[start : start + block_size]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            deflated = compressor.compress(chunk) + compressor.flush()
+            if start:
+                offsets.append((f.tell(), start))
+            f.write(b"\x1f\x8b\x08\x04" + bytes(5) + b"\xff\x06\x00BC\x02\x00")
+            f.write(struct.pack("<H", 25 + len(deflated)) + deflated)
+            f.write(struct.pack("<II", zlib.crc32(chunk), len(chunk)))
+        f.write(bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000"))
+    return offsets
+
+
+@pytest.fixture
+def reference(tmp_path):
+    ### Contigs with different line widths, split into many small BGZF blocks
+    random.seed(22)
+    fasta, fai = [], []
+    offset = 0
+    for contig, length, linebases in [("chr1", 2345, 60), ("chr2", 1000, 70), ("chr3", 17, 60)]:
+        sequence = "".join(random.choice("ACGTNacgt") for _ in range(length))
+        header = f">{contig}\n"
+        lines = "".join(sequence[i : i + linebases] + "\n" for i in range(0, length, linebases))
+        fai.append(f"{contig}\t{length}\t{offset + len(header)}\t{linebases}\t{linebases + 1}\n")
+        fasta.append(header + lines)
+        offset += len(header) + len(lines)
+    data = "".join(fasta).encode()
+    (tmp_path / "ref.fa").write_bytes(data)
+    (tmp_path / "ref.fa.fai").write_text("".join(fai))
+    return tmp_path / "ref.fa", data
+
+
+@pytest.mark.parametrize("with_gzi", [True, False])
+def test_bgzip_reference_equals_uncompressed(reference, tmp_path, with_gzi):
+    fasta, data = reference
+    fasta_gz = tmp_path / "ref.fa.gz"
+    offsets = write_bgzf(fasta_gz, data, 100)
+    if with_gzi:
+        with open(str(fasta_gz) + ".gzi", "wb") as f:
+            f.write(struct.pack("<Q", len(offsets)))
+            for coffset, uoffset in offsets:
+                f.write(struct.pack("<QQ", coffset, uoffset))
+    plain, fai = check_vcf.open_reference(str(fasta), str(fasta) + ".fai")
+    compressed, _ = check_vcf.open_reference(str(fasta_gz), str(fasta) + ".fai")
+    for contig, entry in fai.items():
+        for pos in range(1, entry[0] + 2):
+            for length in (1, 3, 150):
+                assert check_vcf.reference_bases(compressed, entry, pos, length) == check_vcf.reference_bases(
+                    plain, entry, pos, length
+                ), (contig, pos, length)
+
+
+def test_gzip_reference_fails(reference, tmp_path):
+    fasta, data = reference
+    fasta_gz = tmp_path / "ref.fa.gz"
+    fasta_gz.write_bytes(gzip.compress(data))
+    with pytest.raises(ValueError, match="uncompressed or bgzip compressed"):
+        check_vcf.open_reference(str(fasta_gz), str(fasta) + ".fai")
+
+
+def write_tbi(path, contigs):
+    ### Tabix index with one chunk per contig, which is all check_vcf.read_tbi needs
+    names = b"".join(contig.encode() + b"\x00" for contig, _, _ in contigs)
+    data = struct.pack("<4s8i", b"TBI\x01", len(contigs), 2, 1, 2, 0, ord("#"), 0, len(names)) + names
+    for _, start, end in contigs:
+        data += struct.pack("<iIiQQi", 1, 4681, 1, start, end, 0)
+    with open(path, "wb") as f:
+        f.write(gzip.compress(data))
+
+
+@pytest.fixture
+def large_vcf(tmp_path):
+    ### 20000 records on 3 contigs, plain, bgzip compressed and bgzip compressed with tabix index
+    lines = [
+        "##fileformat=VCFv4.2",
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+    ]
+    contigs = [("chr1", 10000), ("chr2", 6000), ("chr3", 4000)]
+    lines += [f"##contig=<ID={contig},length=1000000>" for contig, _ in contigs]
+    lines.append("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT", "S1"]))
+    spans = []
+    offset = len("\n".join(lines)) + 1
+    for contig, records in contigs:
+        start = offset
+        for index in range(records):
+            ref, alt = [("A", "G"), ("C", "T"), ("AC", "A"), ("G", "GT"), ("T", "C,G")][index % 5]
+            line = "\t".join([contig, str(10 * (index + 1)), ".", ref, alt, ".", "PASS", ".", "GT", "0/1"])
+            lines.append(line)
+            offset += len(line) + 1
+        spans.append((contig, start, offset))
+    data = ("\n".join(lines) + "\n").encode()
+    vcf = tmp_path / "large.vcf"
+    vcf.write_bytes(data)
+    vcf_gz = tmp_path / "large.vcf.gz"
+    blocks = [(0, 0)] + write_bgzf(vcf_gz, data, 4000)
+
+    def virtual_offset(uoffset):
+        coffset, block_uoffset = blocks[max(i for i, block in enumerate(blocks) if block[1] <= uoffset)]
+        return coffset << 16 | (uoffset - block_uoffset)
+
+    tbi = tmp_path / "large.vcf.gz.tbi"
+    write_tbi(tbi, [(contig, virtual_offset(start), virtual_offset(end)) for contig, start, end in spans])
+    return vcf, vcf_gz, tbi
+
+
+@pytest.mark.parametrize("input_type", ["plain", "bgzip", "indexed"])
+@pytest.mark.parametrize("max_records", [1, 10, 50, 63, 64, 65, 1000])
+def test_sampling_within_record_budget(large_vcf, input_type, max_records):
+    vcf, vcf_gz, tbi = large_vcf
+    vcf_in, tbi_in = {"plain": (vcf, None), "bgzip": (vcf_gz, None), "indexed": (vcf_gz, tbi)}[input_type]
+    header, summary, complete = check_vcf.sample_vcf(str(vcf_in), tbi_in and str(tbi_in), max_records=max_records)
+
+    assert summary["records"] == max_records
+    assert not complete
+
+
+@pytest.mark.parametrize("input_type", ["plain", "bgzip", "indexed"])
+@pytest.mark.parametrize("max_bytes", [1, 100, 5000, 100000])
+def test_sampling_within_byte_budget(large_vcf, input_type, max_bytes):
+    vcf, vcf_gz, tbi = large_vcf
+    vcf_in, tbi_in = {"plain": (vcf, None), "bgzip": (vcf_gz, None), "indexed": (vcf_gz, tbi)}[input_type]
+    header, summary, complete = check_vcf.sample_vcf(str(vcf_in), tbi_in and str(tbi_in), max_bytes=max_bytes)
+
+    assert summary["records"] * len("chr1\t10\t.\tA\tG\t.\tPASS\t.\tGT\t0/1\n") <= max_bytes
+    assert summary["records"] >= max_bytes // 40 - check_vcf.SAMPLE_WINDOWS
+    assert not complete
+
+
+@pytest.mark.parametrize("input_type", ["plain", "bgzip", "indexed"])
+def test_sampling_budget_covering_all_records(large_vcf, input_type):
+    vcf, vcf_gz, tbi = large_vcf
+    vcf_in, tbi_in = {"plain": (vcf, None), "bgzip": (vcf_gz, None), "indexed": (vcf_gz, tbi)}[input_type]
+    _, full = check_vcf.read_vcf(str(vcf))
+    header, summary, complete = check_vcf.sample_vcf(str(vcf_in), tbi_in and str(tbi_in), max_records=100000)
+
+    assert complete
+    assert summary == full
+
+
+def test_batch_with_failing_samples(large_vcf, gvcf, tmp_path, monkeypatch):
+    vcf, vcf_gz, tbi = large_vcf
+    truncated = tmp_path / "truncated.vcf.gz"
+    truncated.write_bytes(vcf_gz.read_bytes()[:5000])
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text(
+        "meta_id,vcf_in,tbi_in,bcftools_stats_in\n"
+        f"A,{vcf_gz},{tbi},\n"
+        f"B,{tmp_path / 'missing.vcf'},,\n"
+        f"C,{truncated},,\n"
+        f"D,{gvcf},,\n"
+    )
+    outdir = tmp_path / "out"
+    monkeypatch.setattr(
+        "sys.argv",
+        ["check_vcf.py", "--manifest", str(manifest), "--outdir", str(outdir), "--workers", "2"]
+        + ["--batch_warnings_out", str(tmp_path / "combined.warnings.txt"), "--check_multiallelic_sites"],
+    )
+    with pytest.raises(ValueError) as error:
+        check_vcf.process_batch(check_vcf.parse_arguments())
+
+    assert "ERROR: B:" in str(error.value) and "missing.vcf" in str(error.value)
+    assert "ERROR: C:" in str(error.value)
+    assert "A" not in {line.split(":")[1].strip() for line in str(error.value).split("\n")}
+    assert sorted(path.name for path in outdir.glob("*_warnings.txt")) == ["A_warnings.txt", "D_warnings.txt"]
+    assert sorted(path.name for path in outdir.glob("*_results.json")) == [f"{meta_id}_results.json" for meta_id in "ABCD"]
+    combined = (tmp_path / "combined.warnings.txt").read_text().split("\n")
+    assert combined == [
+        (outdir / "A_warnings.txt").read_text(),
+        (outdir / "D_warnings.txt").read_text(),
+    ]
+    assert all("multiallelic" in warning for warning in combined)
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_contigs_equal_serial(large_vcf, workers):
+    vcf, vcf_gz, tbi = large_vcf
+    serial_header, serial = check_vcf.read_vcf(str(vcf_gz))
+    header, summary = check_vcf.read_vcf_indexed(str(vcf_gz), str(tbi), workers)
+
+    assert header == serial_header
+    assert summary == serial
+    assert summary["records"] == 20000
@@ -18,6 +18,7 @@ include { TSV_CONVERSION                            } from '../subworkflows/loca
 include { VARIANTFILTER as PRESETS_FILTER_REPORT    } from '../subworkflows/local/variantfilter/main'
 include { HTML_REPORT                               } from '../subworkflows/local/html_report/main'
 include { TMB_CALCULATE	    	                    } from '../modules/local/tmbcalculation/main'
+include { TMB_CALCULATE_COHORT                      } from '../modules/local/tmbcalculation_cohort/main'
 
 /*
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -82,10 +83,14 @@ workflow VARIANTINTERPRETATION {
     ch_versions = ch_versions.mix(BCFTOOLS_INDEX.out.versions)
     vcf_tbi = ch_samplesheet.join(BCFTOOLS_INDEX.out.tbi)
 
-    // create sequence dictionary and faidx index of reference FASTA
+    // create sequence dictionary (only required by GATK ValidateVariants) and faidx index of reference FASTA
     fasta_ref = ch_fasta.map { ch_fasta -> ['ref', ch_fasta] }
-    SAMTOOLS_DICT( fasta_ref )
-    ch_versions = ch_versions.mix(SAMTOOLS_DICT.out.versions)
+    ref_dict = Channel.value([[], []])
+    if (params.gatk_validatevariants) {
+        SAMTOOLS_DICT( fasta_ref )
+        ch_versions = ch_versions.mix(SAMTOOLS_DICT.out.versions)
+        ref_dict = SAMTOOLS_DICT.out.dict
+    }
     SAMTOOLS_FAIDX( fasta_ref, [[], []] )
     ch_versions = ch_versions.mix(SAMTOOLS_FAIDX.out.versions)
 
@@ -96,7 +101,7 @@ workflow VARIANTINTERPRETATION {
     CHECKVCF (
         vcf_tbi,
         fasta_ref,
-        SAMTOOLS_DICT.out.dict,
+        ref_dict,
         SAMTOOLS_FAIDX.out.fai
     )
     ch_versions = ch_versions.mix(CHECKVCF.out.versions)
@@ -110,6 +115,7 @@ workflow VARIANTINTERPRETATION {
     if (params.bedfile) {
         CHECKBEDFILE ( ch_bedfile )
         ch_min_bedfile=CHECKBEDFILE.out.bedfile_min
+        ch_panel=CHECKBEDFILE.out.panel
         ch_versions = ch_versions.mix(CHECKBEDFILE.out.versions)
     }
 
@@ -220,11 +226,25 @@ workflow VARIANTINTERPRETATION {
         // MODULE: TMB calculation
         //
         if ( params.bedfile && params.calculate_tmb ) {
-                if ( CHECKBEDFILE.out.bed_valid ) {
+                if ( CHECKBEDFILE.out.bed_valid && params.tmb_cohort ) {
+                        // all TSV files are processed in one task sharing the panel
+                        ch_tsv_cohort = TSV_CONVERSION.out.tsv
+                            .map { meta, tsv -> [ meta.id, tsv ] }
+                            .toSortedList { a, b -> a[0] <=> b[0] }
+                            .map { rows -> [ rows.collect { it[0] }, rows.collect { it[1] } ] }
+                        TMB_CALCULATE_COHORT ( ch_tsv_cohort,
+                                               ch_panel,
+                                               ch_consequence_tmb
+                    )
+                    ch_versions = ch_versions.mix(TMB_CALCULATE_COHORT.out.versions)
+                    ch_multiqc_files = ch_multiqc_files.mix(TMB_CALCULATE_COHORT.out.metrics)
+                } else if ( CHECKBEDFILE.out.bed_valid ) {
                         TMB_CALCULATE ( TSV_CONVERSION.out.tsv,
-                                        ch_min_bedfile
+                                        ch_panel,
+                                        ch_consequence_tmb
                     )
                     ch_versions = ch_versions.mix(TMB_CALCULATE.out.versions)
+                    ch_multiqc_files = ch_multiqc_files.mix(TMB_CALCULATE.out.metrics.collect{ meta, metrics -> metrics })
             }
         }
     }